@@ -0,0 +1,231 @@
+import math
+import time
+import json
+import threading
+from error import RateLimitError, QuotaExceededError
+from METRICS.metrics import Counter
+
+INTERACTIVE = 0
+BULK = 1
+PRIORITIES = {"interactive": INTERACTIVE, "bulk": BULK}
+
+KEY_REQUESTS = Counter(
+    "prescription_api_key_requests_total", "Upload requests by API key and outcome: accepted, rate_limited or quota_exceeded, and refunded for accepted requests that failed later.", ("key", "outcome"))
+KEY_IMAGES = Counter(
+    "prescription_api_key_images_total", "Images accepted by API key.", ("key",))
+
+
+def _today() -> int:
+    return int(time.time() // 86400)
+
+
+class TokenBucket:
+    """
+    #### A token bucket refilled continuously at a fixed rate.
+    """
+
+    def __init__(self, rate: float, burst: float) -> None:
+        """
+        #### Initializes a full bucket.
+
+        Arguments:
+        - rate (float): The tokens added per second.
+        - burst (float): The capacity of the bucket, i.e. the largest burst allowed after an idle period.
+        """
+        self.rate = float(rate)
+        self.burst = max(1.0, float(burst))
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+
+    def take(self, cost=1.0) -> float:
+        """
+        #### Takes `cost` tokens if enough are available.
+
+        Returns:
+        - 0 if the tokens were taken, otherwise the number of seconds until they will be available.
+
+        Notes:
+        - A cost above `burst` is allowed once the bucket is full and leaves it in debt, so a large batch is delayed rather than refused forever.
+        - Not thread-safe on its own; `ApiKeyRegistry` serializes the calls.
+        """
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens +
+                          (now - self.updated) * self.rate)
+        self.updated = now
+        needed = min(float(cost), self.burst)
+        if self.tokens >= needed:
+            self.tokens -= cost
+            return 0.0
+        return (needed - self.tokens) / self.rate
+
+    def refund(self, cost=1.0) -> None:
+        """
+        #### Puts back `cost` tokens taken by `take()`, up to `burst`.
+        """
+        self.tokens = min(self.burst, self.tokens + float(cost))
+
+
+class ApiKey:
+    """
+    #### One API key, its priority class, limits and usage counters.
+    """
+    name = None
+    priority = INTERACTIVE
+
+    def __init__(self, NAME: str, KEY: str, PRIORITY="interactive", RATE=0, BURST=0, DAILY_QUOTA=0) -> None:
+        """
+        #### Initializes an API key.
+
+        Arguments:
+        - NAME (str): The name of the key, used in usage counters and metrics instead of the secret.
+        - KEY (str): The secret sent in the `x-api-key` header.
+        - PRIORITY (str, optional): 'interactive' or 'bulk'. Work of interactive keys is detected and recognized before queued bulk work. Defaults to 'interactive'.
+        - RATE (float, optional): The images per second the key may submit on average. Defaults to 0, which disables the rate limit.
+        - BURST (float, optional): The images the key may submit at once after an idle period. Defaults to 0, which allows one second of `RATE` and at least one image.
+        - DAILY_QUOTA (int, optional): The images the key may submit per UTC day. Defaults to 0, which disables the quota.
+
+        Raises:
+        - ValueError: If PRIORITY is unknown.
+        """
+        if str(PRIORITY).lower() not in PRIORITIES:
+            raise ValueError("Unknown priority {!r}".format(PRIORITY))
+        self.name = str(NAME)
+        self.key = str(KEY)
+        self.priority = PRIORITIES[str(PRIORITY).lower()]
+        self.bucket = TokenBucket(float(RATE), float(BURST) or float(
+            RATE)) if float(RATE) > 0 else None
+        self.daily_quota = max(0, int(DAILY_QUOTA))
+        self.day = None
+        self.used_today = 0
+        self.requests = 0
+        self.images = 0
+        self.rate_limited = 0
+        self.quota_exceeded = 0
+
+    def usage(self) -> dict:
+        """
+        #### Returns the usage counters of this key since the process started, and its quota for the current UTC day.
+        """
+        return {
+            "priority": "bulk" if self.priority == BULK else "interactive",
+            "requests": self.requests,
+            "images": self.images,
+            "rate_limited": self.rate_limited,
+            "quota_exceeded": self.quota_exceeded,
+            "rate": self.bucket.rate if self.bucket is not None else None,
+            "daily_quota": self.daily_quota or None,
+            "used_today": self.used_today if self.day == _today() else 0,
+            "remaining_today": max(0, self.daily_quota - (self.used_today if self.day == _today() else 0)) if self.daily_quota else None
+        }
+
+
+class ApiKeyRegistry:
+    """
+    #### Authenticates API keys and enforces their rate limits and quotas.
+    """
+
+    def __init__(self, KEYS: list) -> None:
+        """
+        #### Initializes the registry.
+
+        Arguments:
+        - KEYS (list[ApiKey]): The accepted keys.
+
+        Notes:
+        - Limits and counters are kept in memory, per process. With several gunicorn workers, each worker enforces the limits on its own share of the traffic, so configure `RATE` and `DAILY_QUOTA` divided by the number of workers.
+        - All methods are thread-safe.
+        """
+        self._keys = {key.key: key for key in KEYS}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def parse(API_KEYS: str, API_KEY=None) -> list:
+        """
+        #### Builds the keys from the `API_KEYS` environment value, plus the legacy single `API_KEY`.
+
+        Arguments:
+        - API_KEYS (str): A JSON list of objects with the fields 'name', 'key', and optionally 'priority', 'rate', 'burst' and 'daily_quota', e.g. `[{"name": "counter", "key": "...", "priority": "interactive"}, {"name": "backfill", "key": "...", "priority": "bulk", "rate": 2, "daily_quota": 50000}]`. May be None or empty.
+        - API_KEY (str, optional): A key accepted as the unlimited interactive key 'default', for existing deployments.
+
+        Returns:
+        - A list of `ApiKey`.
+
+        Raises:
+        - ValueError: If `API_KEYS` is not valid.
+        """
+        keys = []
+        for entry in json.loads(API_KEYS) if API_KEYS else []:
+            keys.append(ApiKey(entry["name"], entry["key"], entry.get("priority", "interactive"), entry.get(
+                "rate", 0), entry.get("burst", 0), entry.get("daily_quota", 0)))
+        if API_KEY and all(key.key != API_KEY for key in keys):
+            keys.append(ApiKey("default", API_KEY))
+        return keys
+
+    def authenticate(self, key: str):
+        """
+        #### Returns the `ApiKey` with this secret, or None.
+        """
+        if not key:
+            return None
+        return self._keys.get(key)
+
+    def charge(self, apiKey: ApiKey, images=1) -> None:
+        """
+        #### Counts an upload request of `images` images against the rate limit and quota of a key.
+
+        Raises:
+        - RateLimitError: If the token bucket of the key is empty. `retry_after` is the number of seconds until it holds enough tokens.
+        - QuotaExceededError: If the request would exceed the daily quota of the key. `retry_after` is the number of seconds until the quota resets at midnight UTC.
+
+        Notes:
+        - A rejected request consumes neither tokens nor quota. An accepted request that fails later, e.g. because the server is busy or the upload is unreadable, is given back with `refund()`.
+        """
+        with self._lock:
+            apiKey.requests += 1
+            today = _today()
+            if apiKey.day != today:
+                apiKey.day = today
+                apiKey.used_today = 0
+            if apiKey.daily_quota and apiKey.used_today + images > apiKey.daily_quota:
+                apiKey.quota_exceeded += 1
+                KEY_REQUESTS.inc(key=apiKey.name, outcome="quota_exceeded")
+                raise QuotaExceededError(retry_after=max(
+                    1, math.ceil((today + 1) * 86400 - time.time())))
+            if apiKey.bucket is not None:
+                wait = apiKey.bucket.take(images)
+                if wait > 0:
+                    apiKey.rate_limited += 1
+                    KEY_REQUESTS.inc(key=apiKey.name, outcome="rate_limited")
+                    raise RateLimitError(retry_after=max(1, math.ceil(wait)))
+            apiKey.used_today += images
+            apiKey.images += images
+        KEY_REQUESTS.inc(key=apiKey.name, outcome="accepted")
+        KEY_IMAGES.inc(images, key=apiKey.name)
+
+    def refund(self, apiKey: ApiKey, images=1) -> None:
+        """
+        #### Gives back the tokens and quota charged by `charge()` for images that were not processed.
+
+        Arguments:
+        - apiKey (ApiKey): The key that was charged.
+        - images (int, optional): The number of images to give back. Defaults to 1. A value of 0 does nothing.
+
+        Notes:
+        - Quota charged on an earlier UTC day is not given back, since it has already been reset.
+        """
+        if images <= 0:
+            return
+        with self._lock:
+            if apiKey.day == _today():
+                apiKey.used_today = max(0, apiKey.used_today - images)
+            apiKey.images = max(0, apiKey.images - images)
+            if apiKey.bucket is not None:
+                apiKey.bucket.refund(images)
+        KEY_REQUESTS.inc(key=apiKey.name, outcome="refunded")
+
+    def usage(self) -> dict:
+        """
+        #### Returns the usage counters of every key, by key name.
+        """
+        with self._lock:
+            return {key.name: key.usage() for key in self._keys.values()}
@@ -0,0 +1,339 @@
+import io
+import os
+import sys
+import json
+import time
+import uuid
+import random
+import shutil
+import argparse
+import tempfile
+import subprocess
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from PIL import Image, ImageDraw
+
+STAGE_METRIC = "prescription_stage_seconds"
+WORDS = ["Amoxicillin", "500mg", "Paracetamol", "Ibuprofen", "twice", "daily",
+         "after", "meals", "Tab", "Cap", "1-0-1", "x", "5", "days", "Syrup", "10ml"]
+
+
+def synthetic_prescription(width=1240, height=1754, lines=12, seed=0) -> bytes:
+    """
+    #### Draws a prescription-like page of random text lines and returns it as JPEG bytes.
+
+    Arguments:
+    - width (int, optional): The page width in pixels. Defaults to 1240, an A4 page at 150 dpi.
+    - height (int, optional): The page height in pixels. Defaults to 1754.
+    - lines (int, optional): The number of text lines. Defaults to 12.
+    - seed (int, optional): The random seed, so runs are repeatable.
+    """
+    rng = random.Random(seed)
+    image = Image.new("RGB", (width, height), (250, 250, 245))
+    draw = ImageDraw.Draw(image)
+    draw.rectangle((40, 40, width - 40, 200), outline=(30, 30, 30), width=3)
+    draw.text((60, 80), "Dr. {} - Reg. No. {}".format(rng.choice(WORDS),
+              rng.randint(10000, 99999)), fill=(20, 20, 20))
+    spacing = max(1, (height - 320) // max(1, lines))
+    for index in range(lines):
+        text = " ".join(rng.choice(WORDS) for _ in range(rng.randint(2, 6)))
+        draw.text((80 + rng.randint(0, 60), 260 + index * spacing),
+                  text, fill=(10, 10, 60))
+    buffer = io.BytesIO()
+    image.save(buffer, format="JPEG", quality=90)
+    return buffer.getvalue()
+
+
+def multipart(field: str, filename: str, data: bytes) -> tuple:
+    """
+    #### Encodes one file as a multipart/form-data body.
+
+    Returns:
+    - A tuple of the body and its Content-Type header.
+    """
+    boundary = uuid.uuid4().hex
+    body = b"".join([
+        "--{}\r\n".format(boundary).encode(),
+        'Content-Disposition: form-data; name="{}"; filename="{}"\r\n'.format(
+            field, filename).encode(),
+        b"Content-Type: image/jpeg\r\n\r\n",
+        data,
+        "\r\n--{}--\r\n".format(boundary).encode()
+    ])
+    return (body, "multipart/form-data; boundary={}".format(boundary))
+
+
+def request(url: str, api_key: str, data=None, content_type=None, timeout=120.0) -> tuple:
+    """
+    #### Sends a GET, or a POST if `data` is given.
+
+    Returns:
+    - A tuple of the HTTP status and the response body. Connection errors are reported as status 0.
+    """
+    headers = {"x-api-key": api_key}
+    if content_type is not None:
+        headers["Content-Type"] = content_type
+    try:
+        with urllib.request.urlopen(urllib.request.Request(url, data=data, headers=headers), timeout=timeout) as response:
+            return (response.status, response.read())
+    except urllib.error.HTTPError as e:
+        return (e.code, e.read())
+    except Exception as e:
+        return (0, str(e).encode())
+
+
+def stage_totals(base_url: str, api_key: str) -> dict:
+    """
+    #### Reads the sum and count of every stage of `prescription_stage_seconds` from `/metrics`.
+
+    Returns:
+    - A dictionary of stage name to `[sum, count]`.
+    """
+    code, body = request(base_url + "/metrics", api_key)
+    totals = {}
+    if code != 200:
+        return totals
+    for line in body.decode().splitlines():
+        for suffix, slot in (("_sum", 0), ("_count", 1)):
+            prefix = STAGE_METRIC + suffix + '{stage="'
+            if line.startswith(prefix):
+                name, _, value = line[len(prefix):].partition('"} ')
+                totals.setdefault(name, [0.0, 0])[slot] = float(value)
+    return totals
+
+
+def peak_rss(pid) -> int:
+    """
+    #### Returns the peak resident set size of a process in bytes, read from `/proc/<pid>/status`, or None where unavailable.
+    """
+    if pid is None:
+        return None
+    try:
+        with open("/proc/{}/status".format(pid)) as status:
+            for line in status:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        return None
+    return None
+
+
+def percentile(values: list, fraction: float) -> float:
+    """
+    #### Returns a percentile of a list of numbers by linear interpolation, or None if it is empty.
+    """
+    if not values:
+        return None
+    values = sorted(values)
+    position = (len(values) - 1) * fraction
+    lower = int(position)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (position - lower)
+
+
+def wait_ready(base_url: str, timeout: float, process=None) -> None:
+    """
+    #### Polls `/ready` until the server answers 200.
+
+    Raises:
+    - RuntimeError: If the server exits or is not ready within `timeout` seconds.
+    """
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process is not None and process.poll() is not None:
+            raise RuntimeError(
+                "Server exited with code {}".format(process.returncode))
+        if request(base_url + "/ready", "", timeout=5.0)[0] == 200:
+            return
+        time.sleep(1.0)
+    raise RuntimeError("Server not ready after {} seconds".format(timeout))
+
+
+def spawn(port: int, api_key: str, environment: list, directory: str) -> subprocess.Popen:
+    """
+    #### Starts `main:app` under uvicorn with the in-memory storage backend, so no Firebase project is needed.
+
+    Arguments:
+    - port (int): The port to listen on, on 127.0.0.1.
+    - api_key (str): The API key the server accepts.
+    - environment (list[str]): Extra `NAME=VALUE` variables, e.g. to compare `DETECT_WORKERS` settings.
+    - directory (str): A scratch directory for the job queue database, so the run neither replays nor leaves behind jobs of the real deployment.
+
+    Notes:
+    - The result cache is disabled, so every request is detected and recognized instead of being answered from the cache of an earlier upload. `--env RESULT_CACHE_SIZE=...` turns it back on.
+    """
+    env = dict(os.environ)
+    env.update({"STORAGE_BACKEND": "memory", "API_KEY": api_key, "RESULT_CACHE_SIZE": "0",
+                "JOB_QUEUE_PATH": os.path.join(directory, "jobs.sqlite3")})
+    for item in environment:
+        name, _, value = item.partition("=")
+        env[name] = value
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    return subprocess.Popen([sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1",
+                             "--port", str(port), "--log-level", "warning"], cwd=root, env=env)
+
+
+def run(base_url: str, api_key: str, images: list, requests_count: int, concurrency: int, query: str, wait_recognition: bool, timeout: float) -> list:
+    """
+    #### Posts `requests_count` images to `/detect_img` from `concurrency` threads.
+
+    Returns:
+    - A list of per-request dictionaries with the keys 'status', 'seconds' and, with `wait_recognition`, 'recognition_seconds' measured until `/job_status` reports DONE or FAILED.
+    """
+    url = base_url + "/detect_img" + ("?" + query if query else "")
+
+    def one(index: int) -> dict:
+        body, content_type = multipart(
+            "file", "bench-{}.jpg".format(index), images[index % len(images)])
+        started = time.perf_counter()
+        code, reply = request(url, api_key, body, content_type, timeout)
+        result = {"status": code, "seconds": time.perf_counter() - started}
+        if wait_recognition and code == 200:
+            documentId = json.loads(reply).get("documentID")
+            while time.perf_counter() - started < timeout:
+                code, reply = request(
+                    base_url + "/job_status/" + documentId, api_key)
+                if code == 200 and json.loads(reply).get("status") in ("DONE", "FAILED"):
+                    result["recognition_status"] = json.loads(reply)["status"]
+                    break
+                time.sleep(0.05)
+            result["recognition_seconds"] = time.perf_counter() - started
+        return result
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        return list(executor.map(one, range(requests_count)))
+
+
+def summarize(results: list, wall_seconds: float, before: dict, after: dict, rss, settings: dict) -> dict:
+    """
+    #### Builds the JSON report: latency percentiles in milliseconds, throughput, mean milliseconds per stage during the run, and peak RSS.
+    """
+    ok = [result["seconds"] for result in results if result["status"] == 200]
+    statuses = {}
+    for result in results:
+        statuses[str(result["status"])] = statuses.get(
+            str(result["status"]), 0) + 1
+
+    def latency(values: list) -> dict:
+        return {
+            "p50_ms": None if not values else percentile(values, 0.50) * 1000,
+            "p95_ms": None if not values else percentile(values, 0.95) * 1000,
+            "p99_ms": None if not values else percentile(values, 0.99) * 1000,
+            "mean_ms": None if not values else sum(values) / len(values) * 1000,
+            "max_ms": None if not values else max(values) * 1000
+        }
+
+    stages = {}
+    for name, (total, count) in after.items():
+        total -= before.get(name, [0.0, 0])[0]
+        count -= before.get(name, [0.0, 0])[1]
+        if count > 0:
+            stages[name] = {"count": int(count),
+                            "mean_ms": total / count * 1000}
+    report = {
+        "settings": settings,
+        "requests": len(results),
+        "statuses": statuses,
+        "wall_seconds": wall_seconds,
+        "throughput_rps": len(ok) / wall_seconds if wall_seconds > 0 else None,
+        "latency": latency(ok),
+        "stages": stages,
+        "peak_rss_bytes": rss
+    }
+    recognition = [result["recognition_seconds"]
+                   for result in results if "recognition_seconds" in result]
+    if recognition:
+        report["recognition_latency"] = latency(recognition)
+    return report
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(
+        description="Load-tests /detect_img with synthetic prescriptions and reports latency percentiles, throughput, per-stage timings and peak RSS as JSON.")
+    parser.add_argument("--url", help="Base URL of a running server. Without it, a server is spawned with --spawn-port.")
+    parser.add_argument("--pid", type=int, help="PID of the server at --url, to report its peak RSS.")
+    parser.add_argument("--spawn-port", type=int, default=8765)
+    parser.add_argument("--env", action="append", default=[], metavar="NAME=VALUE",
+                        help="Extra environment of the spawned server, repeatable.")
+    parser.add_argument("--api-key", default=os.environ.get("API_KEY", "benchmark"))
+    parser.add_argument("--requests", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--warmup", type=int, default=4, help="Requests sent before measuring.")
+    parser.add_argument("--images", type=int, default=0,
+                        help="Number of distinct synthetic images, reused in turn. Defaults to one per request.")
+    parser.add_argument("--width", type=int, default=1240)
+    parser.add_argument("--height", type=int, default=1754)
+    parser.add_argument("--lines", type=int, default=12)
+    parser.add_argument("--query", default="", help="Query string of /detect_img, e.g. 'overlay=false'.")
+    parser.add_argument("--wait-recognition", action="store_true",
+                        help="Also measure the time until /job_status reports the recognition done.")
+    parser.add_argument("--timeout", type=float, default=120.0)
+    parser.add_argument("--ready-timeout", type=float, default=600.0)
+    parser.add_argument("--output", help="File to write the JSON report to. Defaults to stdout.")
+    args = parser.parse_args(argv)
+
+    # Distinct seeds per run keep the result cache from answering uploads of earlier runs
+    base = int(time.time())
+    distinct = args.images if args.images > 0 else args.requests
+    images = [synthetic_prescription(args.width, args.height, args.lines, base + index)
+              for index in range(max(1, distinct))]
+    warmup_images = [synthetic_prescription(args.width, args.height, args.lines, base - index - 1)
+                     for index in range(max(1, args.warmup))]
+
+    process = None
+    directory = None
+    base_url = (args.url or "").rstrip("/")
+    pid = args.pid
+    if base_url and distinct < args.requests:
+        print("Warning: {} images for {} requests; repeated images may be answered by the result cache of the server. Set RESULT_CACHE_SIZE=0 on it or raise --images.".format(
+            distinct, args.requests), file=sys.stderr)
+    if not base_url:
+        directory = tempfile.mkdtemp(prefix="benchmark-")
+        process = spawn(args.spawn_port, args.api_key, args.env, directory)
+        base_url = "http://127.0.0.1:{}".format(args.spawn_port)
+        pid = process.pid
+    try:
+        wait_ready(base_url, args.ready_timeout, process)
+        if args.warmup > 0:
+            run(base_url, args.api_key, warmup_images, args.warmup,
+                args.concurrency, args.query, False, args.timeout)
+        before = stage_totals(base_url, args.api_key)
+        started = time.perf_counter()
+        results = run(base_url, args.api_key, images, args.requests, args.concurrency,
+                      args.query, args.wait_recognition, args.timeout)
+        wall_seconds = time.perf_counter() - started
+        after = stage_totals(base_url, args.api_key)
+        report = summarize(results, wall_seconds, before, after, peak_rss(pid), {
+            "url": base_url,
+            "spawned": process is not None,
+            "env": args.env,
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+            "images": len(images),
+            "image_size": [args.width, args.height],
+            "lines": args.lines,
+            "query": args.query,
+            "wait_recognition": args.wait_recognition
+        })
+    finally:
+        if process is not None:
+            process.terminate()
+            try:
+                process.wait(30)
+            except subprocess.TimeoutExpired:
+                process.kill()
+        if directory is not None:
+            shutil.rmtree(directory, ignore_errors=True)
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as file:
+            file.write(output + "\n")
+    else:
+        print(output)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,211 @@
+import os
+import json
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+
+
+class ResultCache:
+    max_entries = 0
+    ttl = 0
+    directory = None
+
+    PRUNE_INTERVAL = 600
+
+    def __init__(self, MAX_ENTRIES=256, TTL=3600, DIRECTORY=None) -> None:
+        """
+        #### Initializes a content-addressed cache of extraction results for duplicate uploads.
+
+        Arguments:
+        - MAX_ENTRIES (int, optional): The maximum number of results kept in memory. The least recently used result is evicted first. Defaults to 256.
+        - TTL (float, optional): The number of seconds a result stays valid, in both tiers. Defaults to 3600.
+        - DIRECTORY (str, optional): A directory for the on-disk tier. Results are also written there as JSON files and survive restarts. Defaults to None, which keeps results in memory only.
+
+        Notes:
+        - Results are looked up in memory first, then on disk. A disk hit is promoted back into memory.
+        - Expired files are deleted when the cache is created and then at most every `PRUNE_INTERVAL` seconds by `put()`, so the directory stays bounded by the uploads of one `TTL`.
+        - All methods are thread-safe.
+        """
+        self.max_entries = max(1, int(MAX_ENTRIES))
+        self.ttl = float(TTL)
+        self.directory = DIRECTORY
+        if self.directory:
+            os.makedirs(self.directory, exist_ok=True)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._memory_hits = 0
+        self._disk_hits = 0
+        self._misses = 0
+        self._pruned = 0.0
+        self.prune()
+
+    @staticmethod
+    def key(file: bytes, confidence: float, overlay=True, settings=None) -> str:
+        """
+        #### Builds the cache key of an upload.
+
+        Arguments:
+        - file (bytes): The raw bytes of the uploaded image.
+        - confidence (float): The detection confidence threshold the result was computed with.
+        - overlay (bool, optional): Whether the result carries an annotated image URL. Defaults to True.
+        - settings (dict, optional): The per-request recognition overrides, e.g. 'NUM_BEAMS'. Overrides that are None are ignored. Defaults to None.
+
+        Returns:
+        - A hex SHA-256 digest of the bytes, the threshold, the overlay flag and the overrides.
+        """
+        digest = hashlib.sha256(file)
+        digest.update("|{!r}".format(float(confidence)).encode())
+        if not overlay:
+            digest.update(b"|no-overlay")
+        overrides = {name: value for name, value in (settings or {}).items()
+                     if value is not None}
+        if overrides:
+            digest.update("|{}".format(json.dumps(overrides, sort_keys=True)).encode())
+        return digest.hexdigest()
+
+    def get(self, key: str):
+        """
+        #### Returns the cached result for a key.
+
+        Arguments:
+        - key (str): A key returned by `key()`.
+
+        Returns:
+        - The cached result dictionary, or None if there is no valid entry.
+        """
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[0] > now:
+                    self._entries.move_to_end(key)
+                    self._memory_hits += 1
+                    return entry[1]
+                del self._entries[key]
+
+        entry = self._readDisk(key, now)
+        with self._lock:
+            if entry is None:
+                self._misses += 1
+                return None
+            self._disk_hits += 1
+            self._store(key, entry)
+            return entry[1]
+
+    def put(self, key: str, value: dict) -> None:
+        """
+        #### Stores the result of an upload.
+
+        Arguments:
+        - key (str): A key returned by `key()`.
+        - value (dict): A JSON-serializable result dictionary.
+        """
+        now = time.time()
+        entry = (now + self.ttl, value)
+        with self._lock:
+            self._store(key, entry)
+            prune = self.directory and now - self._pruned >= self.PRUNE_INTERVAL
+        self._writeDisk(key, entry)
+        if prune:
+            self.prune()
+
+    def evict(self, key: str) -> None:
+        """
+        #### Removes the result of a key from both tiers, e.g. because the recognition it points to failed.
+
+        Arguments:
+        - key (str): A key returned by `key()`.
+        """
+        with self._lock:
+            self._entries.pop(key, None)
+        if self.directory:
+            try:
+                os.remove(self._path(key))
+            except OSError:
+                pass
+
+    def prune(self) -> int:
+        """
+        #### Deletes the expired files of the on-disk tier.
+
+        Returns:
+        - The number of files deleted.
+
+        Notes:
+        - Files are rewritten on every `put()`, so a file whose modification time is older than `TTL` holds an expired entry. Leftover temporary files are deleted the same way.
+        """
+        with self._lock:
+            self._pruned = time.time()
+        if not self.directory:
+            return 0
+        deadline = time.time() - self.ttl
+        deleted = 0
+        try:
+            entries = list(os.scandir(self.directory))
+        except OSError:
+            return 0
+        for entry in entries:
+            try:
+                if entry.is_file() and entry.stat().st_mtime < deadline:
+                    os.remove(entry.path)
+                    deleted += 1
+            except OSError:
+                pass
+        return deleted
+
+    def stats(self) -> dict:
+        """
+        #### Returns the cache counters.
+
+        Returns:
+        - A dictionary with the number of entries in memory, the memory hits, disk hits and misses, and the overall hit rate.
+        """
+        with self._lock:
+            hits = self._memory_hits + self._disk_hits
+            total = hits + self._misses
+            return {
+                "entries": len(self._entries),
+                "memory_hits": self._memory_hits,
+                "disk_hits": self._disk_hits,
+                "misses": self._misses,
+                "hit_rate": hits / total if total else 0.0
+            }
+
+    def _store(self, key: str, entry: tuple) -> None:
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, "{}.json".format(key))
+
+    def _readDisk(self, key: str, now: float):
+        if not self.directory:
+            return None
+        path = self._path(key)
+        try:
+            with open(path, "r") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if data.get("expires", 0) <= now:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            return None
+        return (data["expires"], data["value"])
+
+    def _writeDisk(self, key: str, entry: tuple) -> None:
+        if not self.directory:
+            return
+        path = self._path(key)
+        temp_path = "{}.{}.tmp".format(path, threading.get_ident())
+        try:
+            with open(temp_path, "w") as f:
+                json.dump({"expires": entry[0], "value": entry[1]}, f)
+            os.replace(temp_path, path)
+        except OSError:
+            pass
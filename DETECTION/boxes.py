@@ -0,0 +1,85 @@
+import cv2
+import numpy as np
+from PIL import Image
+
+
+def image_size(image) -> tuple:
+    """
+    #### Returns the (width, height) of a PIL image or an (H, W, C) NumPy array.
+    """
+    if isinstance(image, np.ndarray):
+        return (image.shape[1], image.shape[0])
+    return image.size
+
+
+def scale_boxes(xyxy, image, source):
+    """
+    #### Maps boxes detected on `image` to the coordinates of `source`, a resized copy of the same picture.
+
+    Arguments:
+    - xyxy (numpy.ndarray): An (N, 4) array of box coordinates (x1, y1, x2, y2) in the pixels of `image`.
+    - image: The PIL image or NumPy array the boxes were detected on.
+    - source: The PIL image or NumPy array to map the boxes to.
+
+    Returns:
+    - A new float32 (N, 4) array of box coordinates in the pixels of `source`.
+    """
+    image_width, image_height = image_size(image)
+    source_width, source_height = image_size(source)
+    scale_x = source_width / image_width
+    scale_y = source_height / image_height
+    return np.asarray(xyxy, dtype=np.float32) * np.array([scale_x, scale_y, scale_x, scale_y], dtype=np.float32)
+
+
+def crop_boxes(image_array, xyxy, as_pil=False) -> list:
+    """
+    #### Crops many bounding boxes out of one image array at once.
+
+    Arguments:
+    - image_array (numpy.ndarray): An (H, W, C) array holding the image.
+    - xyxy (numpy.ndarray): An (N, 4) array of box coordinates (x1, y1, x2, y2) in pixels.
+    - as_pil (bool): Convert every crop to a PIL Image object. Default is False.
+
+    Returns:
+    - A list of N crops, in the same order as the boxes.
+
+    Notes:
+    - All boxes are rounded outwards and clipped to the image bounds in one vectorized step. The crops are NumPy views into `image_array`, so no pixel data is copied unless `as_pil` is set.
+    """
+    height, width = image_array.shape[:2]
+    bounds = np.empty((len(xyxy), 4), dtype=np.int64)
+    bounds[:, :2] = np.floor(xyxy[:, :2])
+    bounds[:, 2:] = np.ceil(xyxy[:, 2:])
+    np.clip(bounds[:, 0::2], 0, width, out=bounds[:, 0::2])
+    np.clip(bounds[:, 1::2], 0, height, out=bounds[:, 1::2])
+    crops = [image_array[y1:y2, x1:x2] for x1, y1, x2, y2 in bounds.tolist()]
+    if as_pil:
+        crops = [Image.fromarray(crop) for crop in crops]
+    return crops
+
+
+def render_boxes(image_array, xyxy, conf=None):
+    """
+    #### Draws bounding boxes and their confidence scores on an image, the way the detection overlay is shown to clients.
+
+    Arguments:
+    - image_array (numpy.ndarray): An (H, W, 3) RGB array holding the image.
+    - xyxy (numpy.ndarray): An (N, 4) array of box coordinates (x1, y1, x2, y2) in the pixels of `image_array`.
+    - conf (numpy.ndarray, optional): The N confidence scores as percentages, drawn above each box.
+
+    Returns:
+    - A new BGR array with the overlay, ready for `cv2.imencode`.
+
+    Notes:
+    - This only needs the image and the boxes, so the overlay can be rendered after the response is sent, on a smaller copy of the image, instead of inside the detector call like `result.plot()`.
+    """
+    overlay = cv2.cvtColor(np.asarray(image_array), cv2.COLOR_RGB2BGR)
+    thickness = max(1, round(max(overlay.shape[:2]) / 500))
+    font_scale = thickness / 3
+    boxes = np.rint(np.asarray(xyxy, dtype=np.float32)).astype(np.int64).tolist()
+    for index, (x1, y1, x2, y2) in enumerate(boxes):
+        cv2.rectangle(overlay, (x1, y1), (x2, y2), (255, 56, 56), thickness)
+        if conf is not None:
+            cv2.putText(overlay, "{:.0f}%".format(float(conf[index])), (x1, max(0, y1 - thickness * 2)),
+                        cv2.FONT_HERSHEY_SIMPLEX, font_scale, (255, 56, 56), thickness)
+    return overlay
@@ -1,98 +1,215 @@
 import os
+import time
+import queue
+import numpy as np
 from ultralytics import YOLO
 from configs import Config
 from error import DetectionInitializationError, DetectionDetectError, DetectionCropError
+from DETECTION.boxes import scale_boxes, crop_boxes, render_boxes
 
 
 class TEXT_DETECTION:
-    image = None
     model = None
-    result = None
+    layout = None
 
-    def __init__(self) -> None:
+    def __init__(self, LAYOUT=None) -> None:
         """
         #### Initializes a YOLO object detector for use in detecting objects in images.
 
+        Arguments:
+        - LAYOUT (LineLayout, optional): Cleans up the boxes and sorts them in reading order before cropping. Defaults to None, which keeps YOLO's boxes and order.
+
         Raises:
         - DetectionInitializationError: If the YOLO model cannot be loaded.
 
         Notes:
         - This function initializes a YOLO object detector by loading the model weights from a pre-trained model file. The path to the model file is specified in the `Config` object.
         - The function raises a `DetectionInitializationError` if the model fails to load, which could be due to a variety of reasons such as a missing or corrupted file, unsupported file format, or incorrect file path.
-        - The initialized object detector can be used to detect objects in images by calling the `detect()` method of the object, which takes an image file or array as input and returns a list of detection results, each containing
+        - The initialized object detector can be used to detect objects in images by calling the `detect_and_crop()` method of the object, which takes an image as input and returns the detection results together with the cropped regions.
 
         """
+        self.layout = LAYOUT
         try:
             self.model = YOLO(os.path.join(
                 Config.ROOT_DIR.value, 'DETECTION', 'model', 'best.pt'))
         except:
             raise DetectionInitializationError()
 
-    def detect(self, image, confidence=0.5) -> dict:
+    def detect_and_crop(self, image, confidence=0.5, as_pil=False, source=None, plot=True) -> dict:
         """
-        #### Detects objects in an image using the YOLO object detector.
+        #### Detects text regions in an image using the YOLO object detector and crops them from the image in a single stateless call.
 
         Arguments:
-        - image: An image file or array to be processed.
+        - image: A PIL image object to be processed.
         - confidence: The minimum confidence score threshold for detections to be considered. Default is 0.5.
+        - as_pil (bool): Return the crops as PIL Image objects instead of NumPy arrays. Default is False.
+        - source (optional): A higher-resolution PIL image of the same picture, or a callable returning one, to take the crops from. The boxes are scaled to its coordinates. Defaults to None, which crops from `image`.
+        - plot (bool): Draw the detection results on the image. Default is True. When False, `Config.IMAGE.value` is None; use `render_boxes()` to draw the overlay later if it is needed.
 
         Returns:
         - A dictionary containing the following keys and values:
-         - Config.IMAGE.value: A visualization of the image with detection results overlaid.
-         - Config.CONF_LIST.value: A list of confidence scores for the detected objects, expressed as a percentage.
+         - Config.IMAGE.value: A visualization of the image with detection results overlaid, or None if `plot` is False.
+         - Config.CONF_LIST.value: A float32 NumPy array of shape (N,) with the confidence scores of the detected objects, expressed as a percentage.
+         - Config.CROP_IMG.value: A list of N RGB NumPy arrays (or PIL Image objects if `as_pil` is set), each of which represents one of the detected objects in the input image.
+         - Config.CROP_XYXY.value: A float32 NumPy array of shape (N, 4) with the coordinates (x1, y1, x2, y2) of the bounding box for the corresponding cropped image.
+         - Config.TIMINGS.value: A dictionary with the seconds spent in the 'detect', 'layout' (with a `LineLayout`) and 'crop' stages.
+
+        Raises:
+        - DetectionDetectError: If an error occurs during object detection.
+        - DetectionCropError: If an error occurs while cropping the detected objects from the input image.
+
+        Notes:
+        - Nothing about the request is stored on the instance, so the image and its detection results can never be mixed up with those of another call.
+        - A single YOLO instance must still not be called from two threads at once. Use `TEXT_DETECTION_POOL` to run several detections in parallel.
+        - The boxes and confidences are read from the result tensors in one transfer each. Use `.tolist()` on them before serializing to JSON or Firestore.
+        - With a `source`, detection runs on the small `image` while the crops keep the full resolution for recognition. The visualization stays at the size of `image`. A callable `source` is only called after detection, so the detector and the full-resolution pixels are not in memory at the same time.
+
+        """
+        return self.detect_and_crop_batch([image], confidence, as_pil, None if source is None else [source], plot)[0]
+
+    def detect_and_crop_batch(self, images, confidence=0.5, as_pil=False, sources=None, plot=True) -> list:
+        """
+        #### Detects and crops text regions in many images with a single batched YOLO call.
+
+        Arguments:
+        - images: A list of PIL image objects, or RGB NumPy arrays, to be processed.
+        - confidence: The minimum confidence score threshold for detections to be considered. Default is 0.5.
+        - as_pil (bool): Return the crops as PIL Image objects instead of NumPy arrays. Default is False.
+        - sources (list, optional): One `source` per image, as in `detect_and_crop()`. Defaults to None.
+        - plot (bool): Draw the detection results on each image. Default is True.
+
+        Returns:
+        - A list with one dictionary per input image, in input order, with the same keys as `detect_and_crop()`. The 'detect' timing of each image is its share of the batched call.
 
         Raises:
         - DetectionDetectError: If an error occurs during object detection.
+        - DetectionCropError: If an error occurs while cropping the detected objects from one of the images.
 
         Notes:
-        - This function takes an image file or array as input and processes it using the YOLO object detector that was initialized earlier. The detection results are returned in a dictionary that contains a visualization of the image with detection results overlaid, as well as a list of confidence scores for the detected objects.
-        - The `confidence` argument can be used to control the sensitivity of the detector. A lower value will result in more detections being made, but at the cost of lower precision.
-        - The function raises a `DetectionDetectError` if an error occurs during object detection, which could be due to a variety of reasons such as an invalid input image, memory allocation errors, or internal model errors.
+        - YOLO letterboxes every image of the list into one input tensor, so the backbone runs once per batch instead of once per image.
+        - NumPy arrays are used in place, without building a PIL image first, so images read from shared memory are not copied before YOLO's own preprocessing. YOLO reads arrays as BGR, so they are passed as a channel-reversed view.
+        - With a `LineLayout`, the boxes are arranged on the detection image, before they are scaled to `sources` and cropped, and `plot` draws the arranged boxes with `render_boxes()`.
 
         """
+        images = list(images)
+        if not images:
+            return []
+        started = time.perf_counter()
         try:
-            self.image = image
-            self.result = self.model(source=self.image, conf=confidence)
-            result_plotted = self.result[0].plot()
-            conf_list = self.result[0].boxes.conf.tolist()
-            true_conf_list = [conf * 100 for conf in conf_list]
-            return {Config.IMAGE.value: result_plotted, Config.CONF_LIST.value: true_conf_list}
+            detections = []
+            inputs = [image[..., ::-1] if isinstance(image, np.ndarray) else image
+                      for image in images]
+            for result in self.model(source=inputs, conf=confidence):
+                detections.append((
+                    result.plot() if plot and self.layout is None else None,
+                    result.boxes.xyxy.cpu().numpy().astype(np.float32),
+                    result.boxes.conf.cpu().numpy().astype(np.float32) * 100))
         except:
             raise DetectionDetectError()
+        detect_seconds = (time.perf_counter() - started) / len(images)
+
+        detected_list = []
+        sources = sources if sources is not None else [None] * len(images)
+        for image, source, (result_plotted, xyxy, conf) in zip(images, sources, detections):
+            timings = {"detect": detect_seconds}
+            if self.layout is not None:
+                layout_started = time.perf_counter()
+                try:
+                    xyxy, conf = self.layout.arrange(xyxy, conf)
+                    if plot:
+                        result_plotted = render_boxes(
+                            np.asarray(image), xyxy, conf)
+                except:
+                    raise DetectionDetectError()
+                timings["layout"] = time.perf_counter() - layout_started
+            crop_started = time.perf_counter()
+            try:
+                if source is not None:
+                    source = source() if callable(source) else source
+                    xyxy = scale_boxes(xyxy, image, source)
+                    image = source
+                cropped_img_list = crop_boxes(np.asarray(image), xyxy, as_pil)
+            except:
+                raise DetectionCropError()
+            detected_list.append({
+                Config.IMAGE.value: result_plotted,
+                Config.CONF_LIST.value: conf,
+                Config.CROP_IMG.value: cropped_img_list,
+                Config.CROP_XYXY.value: xyxy,
+                Config.TIMINGS.value: dict(timings, crop=time.perf_counter() - crop_started)
+            })
+        return detected_list
+
+
+class TEXT_DETECTION_POOL:
+    size = 0
+    detectors = None
+
+    def __init__(self, size=1, LAYOUT=None) -> None:
+        """
+        #### Initializes a pool of independent YOLO object detectors so several detections can run in parallel.
+
+        Arguments:
+        - size (int): The number of detector instances to load. Default is 1.
+        - LAYOUT (LineLayout, optional): The box layout shared by every instance, see `TEXT_DETECTION`. It holds no state, so sharing it is safe.
+
+        Raises:
+        - DetectionInitializationError: If one of the YOLO models cannot be loaded.
+
+        Notes:
+        - Each instance owns its own YOLO predictor, because a predictor keeps per-call state and is not safe to share between threads. The weights are small compared to the recognition model, so one copy per worker is cheap.
+        - The pool size should match the number of threads calling `detect_and_crop()`; extra callers block until an instance is free.
+
+        """
+        self.size = max(1, int(size))
+        self.detectors = queue.Queue()
+        for _ in range(self.size):
+            self.detectors.put(TEXT_DETECTION(LAYOUT))
 
-    def crop_image(self) -> dict:
+    def detect_and_crop(self, image, confidence=0.5, as_pil=False, source=None, plot=True) -> dict:
         """
-        #### Crops the detected objects from the input image and returns a dictionary containing the cropped images and their respective coordinates.
+        #### Runs `TEXT_DETECTION.detect_and_crop()` on a free detector instance of the pool.
 
         Arguments:
-        - None
+        - image: A PIL image object to be processed.
+        - confidence: The minimum confidence score threshold for detections to be considered. Default is 0.5.
+        - as_pil (bool): Return the crops as PIL Image objects instead of NumPy arrays. Default is False.
+        - source (optional): The image or callable to take the crops from, see `TEXT_DETECTION.detect_and_crop()`.
+        - plot (bool): Draw the detection results on the image. Default is True.
 
         Returns:
-        - A dictionary containing the following keys and values:
-         - Config.CROP_IMG.value:  A list of PIL Image objects, each of which represents one of the detected objects in the input image.
-         - Config.CROP_XYXY.value: A list of lists, each containing the four coordinates (x1, y1, x2, y2) of the bounding box for the corresponding cropped image.
+        - The dictionary returned by `TEXT_DETECTION.detect_and_crop()`.
 
         Raises:
-        - DetectionCropError: If there is an error in the detection or cropping of objects from the input image.
-
-        Notes:
-        - The function assumes that the image and detection results are already loaded into the instance of the class before calling this function.
-        - The function loops through each box in the detection results and extracts the xyxy coordinates to crop the corresponding region from the original image.
-        - The function returns a dictionary containing two lists. The first list contains the cropped image objects and the second list contains the xyxy coordinates of each cropped image.
-        - The function raises a `DetectionCropError` if there is an error in the detection or cropping of objects from the input image, which could be due to a variety of reasons such as an invalid input image, memory allocation errors, or internal model errors.
+        - DetectionDetectError, DetectionCropError: If detection or cropping failed.
 
         """
+        detector = self.detectors.get()
         try:
-            boxes = self.result[0].boxes
-            cropped_img_list = []
-            cropped_img_xy_list = []
+            return detector.detect_and_crop(image, confidence, as_pil, source, plot)
+        finally:
+            self.detectors.put(detector)
+
+    def detect_and_crop_batch(self, images, confidence=0.5, as_pil=False, sources=None, plot=True) -> list:
+        """
+        #### Runs `TEXT_DETECTION.detect_and_crop_batch()` on a free detector instance of the pool.
 
-            for box in boxes:
-                x1, y1, x2, y2 = box[0].xyxy.tolist()[0][:4]
-                cropped_img_xy_list.append([x1, y1, x2, y2])
-                cropped_img = self.image.crop((x1, y1, x2, y2))
-                cropped_img_list.append(cropped_img)
+        Arguments:
+        - images: A list of PIL image objects to be processed.
+        - confidence: The minimum confidence score threshold for detections to be considered. Default is 0.5.
+        - as_pil (bool): Return the crops as PIL Image objects instead of NumPy arrays. Default is False.
+        - sources (list, optional): One image or callable per image to take the crops from, see `TEXT_DETECTION.detect_and_crop()`.
+        - plot (bool): Draw the detection results on each image. Default is True.
 
-            return {Config.CROP_IMG.value: cropped_img_list, Config.CROP_XYXY.value: cropped_img_xy_list}
-        except:
-            raise DetectionCropError()
+        Returns:
+        - The list returned by `TEXT_DETECTION.detect_and_crop_batch()`.
+
+        Raises:
+        - DetectionDetectError, DetectionCropError: If detection or cropping failed.
+
+        """
+        detector = self.detectors.get()
+        try:
+            return detector.detect_and_crop_batch(images, confidence, as_pil, sources, plot)
+        finally:
+            self.detectors.put(detector)
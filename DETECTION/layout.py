@@ -0,0 +1,89 @@
+import numpy as np
+
+
+class LineLayout:
+    """
+    #### Cleans up detected boxes and puts them in reading order before they are cropped.
+    """
+    MIN_SIDE = 4
+    MIN_HEIGHT_RATIO = 0.3
+    LINE_OVERLAP = 0.5
+    MERGE_GAP = 1.0
+
+    def __init__(self, MIN_SIDE=4, MIN_HEIGHT_RATIO=0.3, LINE_OVERLAP=0.5, MERGE_GAP=1.0) -> None:
+        """
+        #### Initializes the layout settings.
+
+        Arguments:
+        - MIN_SIDE (float, optional): Boxes narrower or lower than this many pixels of the detection image are dropped. Defaults to 4.
+        - MIN_HEIGHT_RATIO (float, optional): Boxes lower than this fraction of the median box height are dropped as noise, e.g. specks and stray strokes. Defaults to 0.3. A value of 0 keeps them.
+        - LINE_OVERLAP (float, optional): The fraction of the lower of two heights two boxes must overlap vertically to be on the same line. Defaults to 0.5.
+        - MERGE_GAP (float, optional): Fragments of one line are merged into one box when the horizontal gap between them is at most this many line heights. Defaults to 1.0. A value of 0 only merges overlapping and duplicate boxes.
+        """
+        self.MIN_SIDE = max(0.0, float(MIN_SIDE))
+        self.MIN_HEIGHT_RATIO = max(0.0, float(MIN_HEIGHT_RATIO))
+        self.LINE_OVERLAP = min(1.0, max(0.0, float(LINE_OVERLAP)))
+        self.MERGE_GAP = max(0.0, float(MERGE_GAP))
+
+    def arrange(self, xyxy, conf) -> tuple:
+        """
+        #### Drops tiny boxes, groups the rest into lines, merges the fragments of each line and sorts everything in reading order.
+
+        Arguments:
+        - xyxy (numpy.ndarray): An (N, 4) array of box coordinates (x1, y1, x2, y2), in YOLO's output order.
+        - conf (numpy.ndarray): The N confidence scores.
+
+        Returns:
+        - A tuple of a float32 (M, 4) array of boxes and a float32 (M,) array of confidences, top to bottom and left to right, with M <= N. A merged box is the union of its fragments and keeps their highest confidence.
+
+        Notes:
+        - The boxes are sorted by vertical center once and swept top to bottom. A box joins the current line if it overlaps the line's average extent by `LINE_OVERLAP`, otherwise it starts the next one. Each box is compared with one line only, so the pass is O(N log N).
+        - Each crop costs one recognizer line, so merging fragments and duplicates cuts recognition work directly, and the texts written to `DETECT_LIST` follow the order of the prescription.
+        """
+        xyxy = np.asarray(xyxy, dtype=np.float32).reshape(-1, 4)
+        conf = np.asarray(conf, dtype=np.float32).reshape(-1)
+        widths = xyxy[:, 2] - xyxy[:, 0]
+        heights = xyxy[:, 3] - xyxy[:, 1]
+        keep = (widths >= self.MIN_SIDE) & (heights >= self.MIN_SIDE)
+        if keep.any() and self.MIN_HEIGHT_RATIO > 0:
+            keep &= heights >= np.median(heights[keep]) * self.MIN_HEIGHT_RATIO
+        xyxy, conf = xyxy[keep], conf[keep]
+        if len(xyxy) == 0:
+            return (xyxy, conf)
+
+        centers = (xyxy[:, 1] + xyxy[:, 3]) / 2
+        lines = []
+        top = bottom = 0.0
+        for index in np.argsort(centers, kind="stable").tolist():
+            y1, y2 = float(xyxy[index, 1]), float(xyxy[index, 3])
+            if lines:
+                overlap = min(y2, bottom) - max(y1, top)
+                if overlap >= self.LINE_OVERLAP * min(y2 - y1, bottom - top):
+                    line = lines[-1]
+                    line.append(index)
+                    top += (y1 - top) / len(line)
+                    bottom += (y2 - bottom) / len(line)
+                    continue
+            lines.append([index])
+            top, bottom = y1, y2
+
+        boxes = []
+        scores = []
+        for line in lines:
+            line.sort(key=lambda index: float(xyxy[index, 0]))
+            height = float(np.median(xyxy[line, 3] - xyxy[line, 1]))
+            box = xyxy[line[0]].copy()
+            score = conf[line[0]]
+            for index in line[1:]:
+                if xyxy[index, 0] - box[2] <= self.MERGE_GAP * height:
+                    box[:2] = np.minimum(box[:2], xyxy[index, :2])
+                    box[2:] = np.maximum(box[2:], xyxy[index, 2:])
+                    score = max(score, conf[index])
+                    continue
+                boxes.append(box)
+                scores.append(score)
+                box = xyxy[index].copy()
+                score = conf[index]
+            boxes.append(box)
+            scores.append(score)
+        return (np.stack(boxes).astype(np.float32), np.asarray(scores, dtype=np.float32))
@@ -1,17 +1,24 @@
 import cv2
 import time
+import uuid
+import asyncio
 import firebase_admin
+from requests.adapters import HTTPAdapter
 from configs import Config
 from firebase_admin import credentials, firestore, storage
 from error import FirebaseInitializationError, FirebaseCreateDocumentError, FirebaseUpdateDocumentError, FirebaseUploadError
+from METRICS.metrics import stage
 
 
 class FirebaseIO:
     db = None
     bucket = None
     collection_ref = None
+    async_collection_ref = None
+    image_quality = 90
+    image_max_dimension = 0
 
-    def __init__(self, FIREBASE_KEY_JSON, FIREBASE_DATABASE_URL, FIREBASE_STORAGE_BUCKET_URL) -> None:
+    def __init__(self, FIREBASE_KEY_JSON, FIREBASE_DATABASE_URL, FIREBASE_STORAGE_BUCKET_URL, IMAGE_QUALITY=90, IMAGE_MAX_DIMENSION=0, POOL_SIZE=32) -> None:
         """
         #### Initializes a new instance of the FirebaseClient class.
 
@@ -19,6 +26,9 @@ class FirebaseIO:
         - FIREBASE_KEY_JSON (str): The path to the Firebase service account key JSON file.
         - FIREBASE_DATABASE_URL (str): The URL of the Firebase Realtime Database instance to use.
         - FIREBASE_STORAGE_BUCKET_URL (str): The URL of the Firebase Cloud Storage bucket to use.
+        - IMAGE_QUALITY (int, optional): The JPEG quality (1-100) used when uploading images. Defaults to 90.
+        - IMAGE_MAX_DIMENSION (int, optional): The maximum width or height in pixels of uploaded images. Larger images are downscaled before encoding. Defaults to 0, which keeps the original size.
+        - POOL_SIZE (int, optional): The number of keep-alive HTTPS connections to Cloud Storage kept open for concurrent uploads. Defaults to 32.
 
         Returns:
         None.
@@ -29,9 +39,12 @@ class FirebaseIO:
         Notes:
         - This function initializes a new Firebase app instance with the provided service account key, database URL, and storage bucket URL. It also sets up a Firestore client instance and a Cloud Storage bucket instance for further use. The app instance and its associated resources can be accessed via the instance properties 'db', 'bucket', and 'collection_ref'.
         - This function should be called only once per application instance, typically at startup. Subsequent calls to this function will result in undefined behavior.
+        - An async Firestore client is opened next to the sync one for `createDocumentAsync()`, if the installed `google-cloud-firestore` provides it. Otherwise the async methods run the sync client in a thread.
 
         """
         try:
+            self.image_quality = min(100, max(1, int(IMAGE_QUALITY)))
+            self.image_max_dimension = max(0, int(IMAGE_MAX_DIMENSION))
             fb_cred = credentials.Certificate(FIREBASE_KEY_JSON)
             firebase_admin.initialize_app(fb_cred, {
                 Config.FIREBASE_DATABASE_URL.value: FIREBASE_DATABASE_URL,
@@ -41,16 +54,36 @@ class FirebaseIO:
             self.bucket = storage.bucket()
             self.collection_ref = self.db.collection(
                 Config.FIREBASE_COLL_STORE_NAME.value)
+            self.poolConnections(POOL_SIZE)
+            try:
+                from firebase_admin import firestore_async
+                self.async_collection_ref = firestore_async.client().collection(
+                    Config.FIREBASE_COLL_STORE_NAME.value)
+            except (ImportError, AttributeError):
+                self.async_collection_ref = None
         except:
             raise FirebaseInitializationError()
 
-    def createDocument(self, IMAGE_URL: str, IMAGE_NAME: str) -> str:
+    def poolConnections(self, POOL_SIZE: int) -> None:
+        """
+        #### Sizes the connection pool of the authorized HTTP session of the Cloud Storage client.
+
+        Notes:
+        - The session keeps at most 10 connections per host by default, so concurrent uploads beyond that open and discard a TLS connection each time.
+        """
+        adapter = HTTPAdapter(pool_connections=max(1, int(POOL_SIZE)),
+                              pool_maxsize=max(1, int(POOL_SIZE)))
+        self.bucket.client._http.mount("https://", adapter)
+
+    def createDocument(self, IMAGE_URL: str, IMAGE_NAME: str, CONFIDENCE_LIST=[], XYXY_LIST=[]) -> str:
         """
         #### Creates a new document in the specified Firestore collection with the given image URL and name.
 
         Arguments:
         - IMAGE_URL (str): The URL of the image to store in the new document.
         - IMAGE_NAME (str): The name of the image to store in the new document.
+        - CONFIDENCE_LIST (list[float], optional): A list of detection confidence scores to store in the new document. Defaults to an empty list.
+        - XYXY_LIST (list[list[float]], optional): A list of bounding box coordinates to store in the new document, in the format [[x1, y1, x2, y2], ...]. Defaults to an empty list.
 
         Returns:
         - str: The ID of the newly created document.
@@ -59,7 +92,7 @@ class FirebaseIO:
         - FirebaseCreateDocumentError: If IMAGE_URL or IMAGE_NAME is empty,invalid or Failed to create document.
 
         Notes:
-        - This function creates a new document in the Firestore collection specified in the FirebaseClient instance, with the given image URL and name. The document is initially empty, with no detection results or bounding box data.
+        - This function creates a new document in the Firestore collection specified in the FirebaseClient instance, with the given image URL and name. The document initially has no detection results; the confidence scores and bounding boxes are written up front if given, so later updates only need to send `DETECT_LIST`.
         - The input `IMAGE_URL` should be a valid URL pointing to an image file. The input `IMAGE_NAME` should be a non-empty string representing the name of the image file.
         - The function returns the ID of the newly created document as a string. The ID is generated automatically by Firestore and is unique within the specified collection.
         - If an error occurs during document creation, such as a connection error or invalid input, a ValueError is raised with an appropriate error message.
@@ -70,10 +103,37 @@ class FirebaseIO:
                 "IMAGE_NAME": IMAGE_NAME,
                 "IMAGE_URL": IMAGE_URL,
                 "DETECT_LIST": [],
-                "CONFIDENCE_LIST": [],
-                "BOX_LIST": {}
+                "CONFIDENCE_LIST": CONFIDENCE_LIST,
+                "BOX_LIST": self.boxData(XYXY_LIST)
+            }
+            with stage("createDocument"):
+                _, doc_ref = self.collection_ref.add(DATA)
+            return doc_ref.id
+        except:
+            raise FirebaseCreateDocumentError()
+
+    async def createDocumentAsync(self, IMAGE_URL: str, IMAGE_NAME: str, CONFIDENCE_LIST=[], XYXY_LIST=[]) -> str:
+        """
+        #### Same as `createDocument()`, without blocking the event loop.
+
+        Raises:
+        - FirebaseCreateDocumentError: If IMAGE_URL or IMAGE_NAME is empty,invalid or Failed to create document.
+
+        Notes:
+        - Uses the async Firestore client when available, so the request handler awaits the write without taking a thread. Otherwise `createDocument()` runs in a thread.
+        """
+        if self.async_collection_ref is None:
+            return await asyncio.to_thread(self.createDocument, IMAGE_URL, IMAGE_NAME, CONFIDENCE_LIST, XYXY_LIST)
+        try:
+            DATA = {
+                "IMAGE_NAME": IMAGE_NAME,
+                "IMAGE_URL": IMAGE_URL,
+                "DETECT_LIST": [],
+                "CONFIDENCE_LIST": CONFIDENCE_LIST,
+                "BOX_LIST": self.boxData(XYXY_LIST)
             }
-            _, doc_ref = self.collection_ref.add(DATA)
+            with stage("createDocument"):
+                _, doc_ref = await self.async_collection_ref.add(DATA)
             return doc_ref.id
         except:
             raise FirebaseCreateDocumentError()
@@ -102,30 +162,97 @@ class FirebaseIO:
 
         """
         try:
-            sub_keys = ['x1', 'y1', 'x2', 'y2']
-            box_data = {}
-            for i, sub_list in enumerate(XYXY_LIST):
-                sub_dict = {}
-                for j, value in enumerate(sub_list):
-                    sub_dict[sub_keys[j]] = value
-                box_data[f"box{i + 1}"] = sub_dict
-
             DATA = {
                 "DETECT_LIST": DETECT_LIST,
                 "CONFIDENCE_LIST": CONFIDENCE_LIST,
-                "BOX_LIST": box_data
+                "BOX_LIST": self.boxData(XYXY_LIST)
             }
             doc_ref = self.collection_ref.document(documentId)
-            doc_ref.update(DATA)
+            with stage("updateDocument"):
+                doc_ref.update(DATA)
         except:
             raise FirebaseUpdateDocumentError()
 
-    def uploadImage(self, image) -> tuple:
+    def updateDetections(self, documentId: str, DETECT_LIST: list, SCORE_LIST=None):
+        """
+        #### Updates only the recognized texts of a document in the Firebase Firestore collection.
+
+        Arguments:
+        - documentId (str): The ID of the document to update.
+        - DETECT_LIST (list[str]): The recognized texts so far, in box order.
+        - SCORE_LIST (list[float], optional): The recognition confidence of each text, between 0 and 1. Not written if omitted.
+
+        Returns:
+            None.
+
+        Raises:
+        - FirebaseUpdateDocumentError: If document update failed.
+
+        Notes:
+        - Unlike `updateDocument()`, the confidence scores and bounding boxes are left untouched, so each write only carries the texts.
+        """
+        try:
+            DATA = {"DETECT_LIST": DETECT_LIST}
+            if SCORE_LIST is not None:
+                DATA["SCORE_LIST"] = SCORE_LIST
+            doc_ref = self.collection_ref.document(documentId)
+            with stage("updateDetections"):
+                doc_ref.update(DATA)
+        except:
+            raise FirebaseUpdateDocumentError()
+
+    def boxData(self, XYXY_LIST: list) -> dict:
+        """
+        #### Converts a list of bounding boxes into the `BOX_LIST` map stored in Firestore.
+
+        Arguments:
+        - XYXY_LIST (list[list[float]]): A list of bounding box coordinates, in the format [[x1, y1, x2, y2], ...].
+
+        Returns:
+        - A dictionary with keys 'box1', 'box2', and so on, each mapping to a dictionary with keys 'x1', 'y1', 'x2' and 'y2'.
+        """
+        sub_keys = ['x1', 'y1', 'x2', 'y2']
+        box_data = {}
+        for i, sub_list in enumerate(XYXY_LIST):
+            sub_dict = {}
+            for j, value in enumerate(sub_list):
+                sub_dict[sub_keys[j]] = value
+            box_data[f"box{i + 1}"] = sub_dict
+        return box_data
+
+    def reserveImage(self) -> tuple:
+        """
+        #### Chooses the file name of an image before it is uploaded.
+
+        Returns:
+        - A tuple containing the public URL and file name the image will have once it is passed to `uploadImage()`.
+
+        Notes:
+        - The URL is derived from the bucket and file name without contacting Cloud Storage, so a document can point to an image that is still being rendered or uploaded in the background. Until then the URL answers 404.
+        """
+        fileName = self.newImageName()
+        return (self.imageBlob(fileName).public_url, fileName)
+
+    def newImageName(self) -> str:
+        """
+        #### Returns a unique image file name made of the current date and time followed by a random UUID.
+        """
+        return "{}-{}".format(time.strftime("%Y%m%d-%H%M%S"), uuid.uuid4().hex)
+
+    def imageBlob(self, fileName: str):
+        """
+        #### Returns the Cloud Storage blob of an image file name.
+        """
+        return self.bucket.blob(
+            "{}/{}.jpg".format(Config.FIREBASE_COLL_STORE_NAME.value, fileName))
+
+    def uploadImage(self, image, fileName=None) -> tuple:
         """
         #### Uploads an image to a Firebase Cloud Storage bucket associated with the FirebaseClient instance.
 
         Arguments:
         - image (numpy.ndarray): A NumPy array representing the image to upload.
+        - fileName (str, optional): A file name returned by `reserveImage()`. Defaults to a new one.
 
         Returns:
         - A tuple containing the public URL and file name of the uploaded image.
@@ -134,18 +261,129 @@ class FirebaseIO:
         - FirebaseUploadError: If file upload failed.
 
         Notes:
-        - This function takes a NumPy array representing an image and saves it to a temporary file in JPEG format. The file is then uploaded to a Cloud Storage bucket associated with the FirebaseClient instance. The uploaded file is given a unique file name based on the current date and time.
+        - This function takes a NumPy array representing an image, downscales it to `image_max_dimension` if needed and encodes it to JPEG at `image_quality` in memory. The buffer is uploaded straight to a Cloud Storage bucket associated with the FirebaseClient instance, without touching the disk, so concurrent uploads cannot overwrite each other. The public-read ACL is set by the upload request itself, so there is no second round-trip to make the file public.
+        - The uploaded file is given a unique file name made of the current date and time followed by a random UUID, so uploads within the same second do not collide.
         - The function returns a tuple containing the public URL of the uploaded file and its file name. The public URL can be used to access the file via HTTP or HTTPS.
         - This function assumes that the FirebaseClient instance has been properly initialized with a valid Firebase app and Cloud Storage bucket instance.
         """
         try:
-            saveImgName = "{}.jpg".format(Config.TEMP_IMG.value)
-            cv2.imwrite(saveImgName, image)
-            fileName = time.strftime("%Y%m%d-%H%M%S")
-            blob = self.bucket.blob(
-                "{}/{}.jpg".format(Config.FIREBASE_COLL_STORE_NAME.value, fileName))
-            blob.upload_from_filename(saveImgName)
-            blob.make_public()
+            data = self.encodeImage(image)
+            if fileName is None:
+                fileName = self.reserveImage()[1]
+            blob = self.imageBlob(fileName)
+            with stage("uploadImage"):
+                blob.upload_from_string(
+                    data, content_type="image/jpeg", predefined_acl="publicRead")
             return (blob.public_url, fileName)
         except:
             raise FirebaseUploadError()
+
+    def encodeImage(self, image) -> bytes:
+        """
+        #### Downscales an image to `image_max_dimension` if needed and encodes it to JPEG at `image_quality`, in memory.
+
+        Arguments:
+        - image (numpy.ndarray): A NumPy array representing the image, in BGR order.
+
+        Returns:
+        - The JPEG bytes.
+
+        Raises:
+        - FirebaseUploadError: If encoding failed.
+        """
+        with stage("encodeImage"):
+            image = self.resizeImage(image)
+            success, buffer = cv2.imencode(
+                ".jpg", image, [cv2.IMWRITE_JPEG_QUALITY, self.image_quality])
+        if not success:
+            raise FirebaseUploadError()
+        return buffer.tobytes()
+
+    def resizeImage(self, image):
+        """
+        #### Downscales an image so that its longest side is at most `image_max_dimension` pixels.
+
+        Arguments:
+        - image (numpy.ndarray): A NumPy array representing the image.
+
+        Returns:
+        - The resized image, or the input image unchanged if it already fits or no maximum dimension is configured.
+        """
+        height, width = image.shape[:2]
+        longest = max(height, width)
+        if self.image_max_dimension <= 0 or longest <= self.image_max_dimension:
+            return image
+        scale = self.image_max_dimension / longest
+        return cv2.resize(image, (max(1, round(width * scale)), max(1, round(height * scale))),
+                          interpolation=cv2.INTER_AREA)
+
+
+class CoalescedWriter:
+    fb = None
+    documentId = None
+    detect_list = None
+    score_list = None
+
+    def __init__(self, fb: FirebaseIO, documentId: str, FLUSH_COUNT=8, FLUSH_INTERVAL=1.0) -> None:
+        """
+        #### Initializes a writer that coalesces the recognized texts of one document into few Firestore writes.
+
+        Arguments:
+        - fb (FirebaseIO): The FirebaseIO instance used to write the document.
+        - documentId (str): The ID of the document to update. Its confidence scores and bounding boxes are expected to have been written by `FirebaseIO.createDocument()`.
+        - FLUSH_COUNT (int, optional): The number of new texts that triggers a write. Defaults to 8. A value of 0 writes after every call to `extend()`.
+        - FLUSH_INTERVAL (float, optional): The number of seconds after the last write that triggers a write when new texts are pending. Defaults to 1.0.
+
+        Notes:
+        - Clients still see progressive results, but an N-line prescription costs about N / FLUSH_COUNT writes instead of N, and the boxes are never resent.
+        - `close()` must be called once all texts are added, to flush the remainder.
+        """
+        self.fb = fb
+        self.documentId = documentId
+        self.detect_list = []
+        self.score_list = []
+        self.flush_count = max(0, int(FLUSH_COUNT))
+        self.flush_interval = max(0.0, float(FLUSH_INTERVAL))
+        self._pending = 0
+        self._last_flush = time.monotonic()
+
+    def extend(self, texts: list, scores: list) -> None:
+        """
+        #### Appends recognized texts and writes them if the count or time threshold is reached.
+
+        Arguments:
+        - texts (list[str]): The next recognized texts, in box order.
+        - scores (list[float]): The recognition confidence of each text.
+
+        Raises:
+        - FirebaseUpdateDocumentError: If document update failed.
+        """
+        self.detect_list.extend(texts)
+        self.score_list.extend(scores)
+        self._pending += len(texts)
+        if self._pending >= self.flush_count or \
+                time.monotonic() - self._last_flush >= self.flush_interval:
+            self.flush()
+
+    def flush(self) -> None:
+        """
+        #### Writes the pending texts to the document, if there are any.
+
+        Raises:
+        - FirebaseUpdateDocumentError: If document update failed.
+        """
+        if self._pending == 0:
+            return
+        self.fb.updateDetections(
+            self.documentId, self.detect_list, self.score_list)
+        self._pending = 0
+        self._last_flush = time.monotonic()
+
+    def close(self) -> None:
+        """
+        #### Writes any texts still pending. Call once after the last `extend()`.
+
+        Raises:
+        - FirebaseUpdateDocumentError: If document update failed.
+        """
+        self.flush()
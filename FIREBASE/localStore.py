@@ -0,0 +1,137 @@
+import os
+import json
+import uuid
+import threading
+from configs import Config
+from FIREBASE.firebaseIO import FirebaseIO
+from error import FirebaseInitializationError, FirebaseCreateDocumentError, FirebaseUpdateDocumentError, FirebaseUploadError
+from METRICS.metrics import stage
+
+
+class LocalFirebaseIO(FirebaseIO):
+    """
+    #### Stand-in for `FirebaseIO` that keeps documents and images in memory or in a local directory, for development and benchmarks without a Firebase project.
+    """
+    directory = None
+    documents = None
+    images = None
+
+    def __init__(self, DIRECTORY=None, IMAGE_QUALITY=90, IMAGE_MAX_DIMENSION=0) -> None:
+        """
+        #### Initializes the local store.
+
+        Arguments:
+        - DIRECTORY (str, optional): A directory to write documents as JSON files and images as JPEG files to. Defaults to None, which keeps both in memory only.
+        - IMAGE_QUALITY (int, optional): The JPEG quality (1-100) used when storing images. Defaults to 90.
+        - IMAGE_MAX_DIMENSION (int, optional): The maximum width or height in pixels of stored images. Defaults to 0, which keeps the original size.
+
+        Raises:
+        - FirebaseInitializationError: If the directory cannot be created.
+
+        Notes:
+        - Every method keeps the contract of its `FirebaseIO` counterpart, including the exceptions, the `BOX_LIST` layout and the image encoding, so the rest of the pipeline cannot tell the difference. Only the network round-trips are missing, which should be kept in mind when reading benchmark results.
+        - All methods are thread-safe.
+        """
+        try:
+            self.image_quality = min(100, max(1, int(IMAGE_QUALITY)))
+            self.image_max_dimension = max(0, int(IMAGE_MAX_DIMENSION))
+            self.directory = DIRECTORY
+            if DIRECTORY is not None:
+                os.makedirs(os.path.join(
+                    DIRECTORY, Config.FIREBASE_COLL_STORE_NAME.value), exist_ok=True)
+            self.documents = {}
+            self.images = {}
+            self._lock = threading.Lock()
+        except:
+            raise FirebaseInitializationError()
+
+    def createDocument(self, IMAGE_URL: str, IMAGE_NAME: str, CONFIDENCE_LIST=[], XYXY_LIST=[]) -> str:
+        try:
+            DATA = {
+                "IMAGE_NAME": IMAGE_NAME,
+                "IMAGE_URL": IMAGE_URL,
+                "DETECT_LIST": [],
+                "CONFIDENCE_LIST": CONFIDENCE_LIST,
+                "BOX_LIST": self.boxData(XYXY_LIST)
+            }
+            documentId = uuid.uuid4().hex[:20]
+            with stage("createDocument"):
+                self._write(documentId, DATA)
+            return documentId
+        except:
+            raise FirebaseCreateDocumentError()
+
+    def updateDocument(self, documentId: str, DETECT_LIST=[], CONFIDENCE_LIST=[], XYXY_LIST=[]):
+        try:
+            with stage("updateDocument"):
+                self._update(documentId, {
+                    "DETECT_LIST": DETECT_LIST,
+                    "CONFIDENCE_LIST": CONFIDENCE_LIST,
+                    "BOX_LIST": self.boxData(XYXY_LIST)
+                })
+        except:
+            raise FirebaseUpdateDocumentError()
+
+    def updateDetections(self, documentId: str, DETECT_LIST: list, SCORE_LIST=None):
+        try:
+            DATA = {"DETECT_LIST": list(DETECT_LIST)}
+            if SCORE_LIST is not None:
+                DATA["SCORE_LIST"] = list(SCORE_LIST)
+            with stage("updateDetections"):
+                self._update(documentId, DATA)
+        except:
+            raise FirebaseUpdateDocumentError()
+
+    def getDocument(self, documentId: str):
+        """
+        #### Returns a copy of a stored document, or None if it does not exist.
+        """
+        with self._lock:
+            document = self.documents.get(documentId)
+            return dict(document) if document is not None else None
+
+    def reserveImage(self) -> tuple:
+        fileName = self.newImageName()
+        return (self.imageURL(fileName), fileName)
+
+    def imageURL(self, fileName: str) -> str:
+        """
+        #### Returns the URL of a stored image: a `file://` URL in directory mode, or a `memory://` URL otherwise.
+        """
+        path = "{}/{}.jpg".format(Config.FIREBASE_COLL_STORE_NAME.value, fileName)
+        if self.directory is None:
+            return "memory://{}".format(path)
+        return "file://{}".format(os.path.abspath(os.path.join(self.directory, path)))
+
+    def uploadImage(self, image, fileName=None) -> tuple:
+        try:
+            data = self.encodeImage(image)
+            if fileName is None:
+                fileName = self.newImageName()
+            with stage("uploadImage"):
+                if self.directory is None:
+                    with self._lock:
+                        self.images[fileName] = data
+                else:
+                    with open(os.path.join(self.directory, Config.FIREBASE_COLL_STORE_NAME.value, "{}.jpg".format(fileName)), "wb") as file:
+                        file.write(data)
+            return (self.imageURL(fileName), fileName)
+        except:
+            raise FirebaseUploadError()
+
+    def _write(self, documentId: str, DATA: dict) -> None:
+        with self._lock:
+            self.documents[documentId] = DATA
+            self._persist(documentId, DATA)
+
+    def _update(self, documentId: str, DATA: dict) -> None:
+        with self._lock:
+            document = self.documents[documentId]
+            document.update(DATA)
+            self._persist(documentId, document)
+
+    def _persist(self, documentId: str, document: dict) -> None:
+        if self.directory is None:
+            return
+        with open(os.path.join(self.directory, Config.FIREBASE_COLL_STORE_NAME.value, "{}.json".format(documentId)), "w") as file:
+            json.dump(document, file)
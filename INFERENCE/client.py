@@ -0,0 +1,258 @@
+import time
+import threading
+import numpy as np
+from multiprocessing.connection import Client
+from configs import Config
+from error import DetectionDetectError, DetectionCropError, RecognitionRecognizeError, InferenceServerError
+from DETECTION.boxes import scale_boxes, crop_boxes, render_boxes
+from RECOGNITION.generation import GenerationSettings
+from RECOGNITION.scheduler import RecognitionJob
+from INFERENCE.transport import share_arrays, release, parse_address, PING, DETECT, RECOGNIZE, STATS
+
+
+class InferenceClient:
+    address = None
+
+    def __init__(self, ADDRESS: str, AUTHKEY: bytes) -> None:
+        """
+        #### Initializes a client of the inference server started with `python -m INFERENCE.server`.
+
+        Arguments:
+        - ADDRESS (str): The Unix socket path or 'host:port' TCP address of the server.
+        - AUTHKEY (bytes): The key shared with the server. Must not be empty.
+
+        Raises:
+        - ValueError: If AUTHKEY is empty. The server refuses to start without one, and an empty key would disable authentication.
+
+        Notes:
+        - Every request opens its own connection, so the client can be used from any number of threads without locking.
+        """
+        if not AUTHKEY:
+            raise ValueError(
+                "INFERENCE_MODE=remote requires a non-empty INFERENCE_AUTHKEY")
+        self.address = parse_address(ADDRESS)
+        self.authkey = AUTHKEY
+
+    def connect(self):
+        """
+        #### Opens a connection to the server.
+
+        Raises:
+        - InferenceServerError: If the server cannot be reached.
+        """
+        try:
+            return Client(self.address, authkey=self.authkey)
+        except Exception:
+            raise InferenceServerError()
+
+    def call(self, request: dict) -> dict:
+        """
+        #### Sends one request and returns its single reply.
+
+        Raises:
+        - InferenceServerError: If the server cannot be reached or closed the connection.
+        """
+        connection = self.connect()
+        try:
+            with connection:
+                connection.send(request)
+                return connection.recv()
+        except (EOFError, OSError):
+            raise InferenceServerError()
+
+    def waitReady(self, interval=1.0) -> None:
+        """
+        #### Blocks until the server answers, which it only does once its models are loaded and warmed up.
+        """
+        while True:
+            try:
+                self.call({"op": PING})
+                return
+            except InferenceServerError:
+                time.sleep(interval)
+
+
+class RemoteDetectionPool:
+    """
+    #### Stand-in for `TEXT_DETECTION_POOL` that runs detection on the inference server.
+    """
+    size = 0
+
+    def __init__(self, client: InferenceClient, size=1) -> None:
+        """
+        #### Initializes the remote detector.
+
+        Arguments:
+        - client (InferenceClient): The client of the inference server.
+        - size (int): The number of detections this process sends at once, usually the number of detector instances of the server. Default is 1.
+        """
+        self.client = client
+        self.size = max(1, int(size))
+
+    def detect_and_crop(self, image, confidence=0.5, as_pil=False, source=None, plot=True) -> dict:
+        """
+        #### Same contract as `TEXT_DETECTION.detect_and_crop()`.
+        """
+        return self.detect_and_crop_batch([image], confidence, as_pil, None if source is None else [source], plot)[0]
+
+    def detect_and_crop_batch(self, images, confidence=0.5, as_pil=False, sources=None, plot=True) -> list:
+        """
+        #### Same contract as `TEXT_DETECTION.detect_and_crop_batch()`.
+
+        Raises:
+        - InferenceServerError: If the server cannot be reached.
+        - DetectionDetectError: If detection failed on the server.
+        - DetectionCropError: If cropping failed.
+
+        Notes:
+        - Only the detection images are copied to shared memory. The server returns the boxes and confidences, and the crops are cut here from `sources`, so full-resolution pixels never leave this process.
+        - With `plot`, the overlay is drawn here with `render_boxes()`.
+        """
+        images = list(images)
+        if not images:
+            return []
+        block, layout = share_arrays(images)
+        try:
+            reply = self.client.call({
+                "op": DETECT,
+                "name": block.name,
+                "layout": layout,
+                "confidence": confidence
+            })
+        finally:
+            release(block, unlink=True)
+        if "error" in reply:
+            raise DetectionDetectError(reply["error"])
+
+        detected_list = []
+        sources = sources if sources is not None else [None] * len(images)
+        for image, source, detection in zip(images, sources, reply["detections"]):
+            crop_started = time.perf_counter()
+            xyxy = detection["xyxy"]
+            try:
+                plotted = render_boxes(np.asarray(image), xyxy,
+                                       detection["conf"]) if plot else None
+                if source is not None:
+                    source = source() if callable(source) else source
+                    xyxy = scale_boxes(xyxy, image, source)
+                    image = source
+                cropped_img_list = crop_boxes(np.asarray(image), xyxy, as_pil)
+            except:
+                raise DetectionCropError()
+            timings = dict(detection["timings"])
+            timings["crop"] = time.perf_counter() - crop_started
+            detected_list.append({
+                Config.IMAGE.value: plotted,
+                Config.CONF_LIST.value: detection["conf"],
+                Config.CROP_IMG.value: cropped_img_list,
+                Config.CROP_XYXY.value: xyxy,
+                Config.TIMINGS.value: timings
+            })
+        return detected_list
+
+
+class RemoteRecognitionScheduler:
+    """
+    #### Stand-in for `RECOGNITION_SCHEDULER` that queues crops on the scheduler of the inference server.
+    """
+
+    def __init__(self, client: InferenceClient) -> None:
+        """
+        #### Initializes the remote scheduler.
+
+        Notes:
+        - The crops of a job are copied into one shared memory block. A reader thread per job receives the results as the server's batches complete and hands them to a regular `RecognitionJob`, so callers cannot tell the difference.
+        """
+        self.client = client
+
+    def submit(self, images, settings=None, priority=0) -> RecognitionJob:
+        """
+        #### Queues the crops of one document for recognition on the server.
+
+        Arguments:
+        - images: A list of PIL image objects or NumPy arrays representing the crops of one document.
+        - settings (GenerationSettings, optional): The decoding settings of this document. Defaults to the settings of the server.
+        - priority (int, optional): The priority class of this document, honored by the server's scheduler across all web workers. Defaults to 0.
+
+        Returns:
+        - A `RecognitionJob`. If the server cannot be reached, the job fails with an `InferenceServerError`.
+        """
+        images = list(images)
+        job = RecognitionJob(len(images))
+        if not images:
+            return job
+        block, layout = share_arrays(images)
+        try:
+            connection = self.client.connect()
+            connection.send({
+                "op": RECOGNIZE,
+                "name": block.name,
+                "layout": layout,
+                "settings": settings.toDict() if settings is not None else None,
+                "priority": priority
+            })
+        except Exception:
+            release(block, unlink=True)
+            job._fail(InferenceServerError())
+            return job
+        threading.Thread(target=self._receive, args=(
+            job, connection, block), daemon=True).start()
+        return job
+
+    def _receive(self, job: RecognitionJob, connection, block) -> None:
+        try:
+            with connection:
+                while True:
+                    reply = connection.recv()
+                    if "lines" in reply:
+                        indices, texts, scores = zip(*reply["lines"])
+                        job._deliver(list(indices), list(texts), list(scores))
+                    elif "error" in reply:
+                        job._fail(RecognitionRecognizeError(reply["error"]))
+                        return
+                    else:
+                        return
+        except (EOFError, OSError):
+            job._fail(InferenceServerError())
+        finally:
+            release(block, unlink=True)
+
+    def stats(self) -> dict:
+        """
+        #### Returns the statistics of the server's scheduler, see `RECOGNITION_SCHEDULER.stats()`.
+        """
+        return self.client.call({"op": STATS})["recognition_scheduler"]
+
+    def shutdown(self) -> None:
+        pass
+
+
+class RemoteCropCache:
+    """
+    #### Exposes the statistics of the inference server's crop cache.
+    """
+
+    def __init__(self, client: InferenceClient) -> None:
+        self.client = client
+
+    def stats(self):
+        return self.client.call({"op": STATS})["crop_cache"]
+
+
+class RemoteRecognition:
+    """
+    #### Stand-in for `TEXT_RECOGNITION` in a web worker whose crops are recognized by the inference server.
+    """
+    generation = None
+    crop_cache = None
+
+    def __init__(self, client: InferenceClient, GENERATION=None) -> None:
+        """
+        #### Initializes the remote recognizer.
+
+        Arguments:
+        - client (InferenceClient): The client of the inference server.
+        - GENERATION (GenerationSettings, optional): The default decoding settings, used to resolve per-request overrides before they are sent. Should match the settings of the server.
+        """
+        self.generation = GENERATION if GENERATION is not None else GenerationSettings()
+        self.crop_cache = RemoteCropCache(client)
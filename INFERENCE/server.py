@@ -0,0 +1,179 @@
+import os
+import sys
+import threading
+import numpy as np
+from multiprocessing.connection import Listener
+from dotenv import load_dotenv
+from configs import Config
+from error import RecognitionRecognizeError
+from DETECTION.detection import TEXT_DETECTION_POOL
+from DETECTION.layout import LineLayout
+from RECOGNITION.recognition import TEXT_RECOGNITION, GenerationSettings
+from RECOGNITION.scheduler import RECOGNITION_SCHEDULER
+from INFERENCE.transport import attach_arrays, release, parse_address, PING, DETECT, RECOGNIZE, STATS, EXPORT_METRICS
+from METRICS.metrics import Gauge, render as renderMetrics
+
+
+class INFERENCE_SERVER:
+    """
+    #### Runs the detection and recognition models in one process on behalf of any number of web worker processes.
+    """
+    detection_model = None
+    recognition_model = None
+    scheduler = None
+
+    def __init__(self, detection_model: TEXT_DETECTION_POOL, recognition_model: TEXT_RECOGNITION, scheduler: RECOGNITION_SCHEDULER, ADDRESS: str, AUTHKEY: bytes) -> None:
+        """
+        #### Initializes the server around already loaded models.
+
+        Arguments:
+        - detection_model (TEXT_DETECTION_POOL): The detector pool.
+        - recognition_model (TEXT_RECOGNITION): The recognizer, used for its crop cache statistics.
+        - scheduler (RECOGNITION_SCHEDULER): The scheduler in front of `recognition_model`.
+        - ADDRESS (str): A Unix socket path or a 'host:port' TCP address to listen on.
+        - AUTHKEY (bytes): The key clients must authenticate with. Must not be empty.
+
+        Raises:
+        - ValueError: If AUTHKEY is empty.
+
+        Notes:
+        - Each client connection carries one request and is served on its own thread. Detections run in parallel up to the size of the detector pool. The crops of every web worker share one recognition scheduler, so they are batched together.
+        - Images never travel over the socket. The client copies them into a shared memory block and sends its name and layout; the server reads them in place.
+        - Requests are unpickled, so a client that connects can run code in this process. `Listener` skips the authentication challenge entirely for an empty key, which is why one is required.
+        """
+        if not AUTHKEY:
+            raise ValueError("The inference server requires a non-empty AUTHKEY")
+        self.detection_model = detection_model
+        self.recognition_model = recognition_model
+        self.scheduler = scheduler
+        self.address = parse_address(ADDRESS)
+        self.authkey = AUTHKEY
+        Gauge("prescription_recognition_queue_depth",
+              "Crops waiting for the recognition scheduler of this process.", scheduler.queueDepth)
+        Gauge("prescription_threads",
+              "Threads alive in this process, including one per open client connection.", threading.active_count)
+
+    def serve_forever(self) -> None:
+        """
+        #### Accepts client connections until the process is stopped.
+        """
+        if isinstance(self.address, str) and os.path.exists(self.address):
+            os.remove(self.address)
+        with Listener(self.address, authkey=self.authkey) as listener:
+            while True:
+                try:
+                    connection = listener.accept()
+                except Exception:
+                    continue
+                threading.Thread(target=self._handle, args=(
+                    connection,), daemon=True).start()
+
+    def warm_up(self) -> None:
+        """
+        #### Runs one detection per detector instance and one recognition on blank images.
+        """
+        blank = np.full((640, 640, 3), 255, dtype=np.uint8)
+        for _ in range(self.detection_model.size):
+            self.detection_model.detect_and_crop(blank, plot=False)
+        self.recognition_model.recognize_batch_scored(
+            [np.full((32, 128, 3), 255, dtype=np.uint8)], 1)
+
+    def _handle(self, connection) -> None:
+        with connection:
+            try:
+                request = connection.recv()
+                if request["op"] == PING:
+                    connection.send({"ok": True})
+                elif request["op"] == DETECT:
+                    self._detect(connection, request)
+                elif request["op"] == RECOGNIZE:
+                    self._recognize(connection, request)
+                elif request["op"] == STATS:
+                    connection.send({
+                        "recognition_scheduler": self.scheduler.stats(),
+                        "crop_cache": self.recognition_model.crop_cache.stats() if self.recognition_model.crop_cache is not None else None
+                    })
+                elif request["op"] == EXPORT_METRICS:
+                    connection.send({"metrics": renderMetrics()})
+            except (EOFError, OSError):
+                pass
+
+    def _detect(self, connection, request: dict) -> None:
+        block, images = attach_arrays(request["name"], request["layout"])
+        try:
+            detected_list = self.detection_model.detect_and_crop_batch(
+                images, request["confidence"], plot=False)
+            reply = {"detections": [{
+                "conf": detected[Config.CONF_LIST.value],
+                "xyxy": detected[Config.CROP_XYXY.value],
+                "timings": detected[Config.TIMINGS.value]
+            } for detected in detected_list]}
+            del detected_list
+        except Exception as e:
+            reply = {"error": getattr(e, "message", "Unknown Error")}
+        finally:
+            del images
+            release(block)
+        connection.send(reply)
+
+    def _recognize(self, connection, request: dict) -> None:
+        block, crops = attach_arrays(request["name"], request["layout"])
+        settings = GenerationSettings(
+            **request["settings"]) if request["settings"] is not None else None
+        job = self.scheduler.submit(
+            crops, settings, request.get("priority", 0))
+        del crops
+        try:
+            for chunk in job:
+                connection.send({"lines": chunk})
+            connection.send({"done": True})
+        except RecognitionRecognizeError as e:
+            connection.send({"error": e.message})
+        finally:
+            job.wait()
+            release(block)
+
+
+if __name__ == "__main__":
+    load_dotenv(".env.development")
+    DETECT_WORKERS = int(os.environ.get(str(Config.DETECT_WORKERS.name), 1))
+    CROP_CACHE_SIZE = int(os.environ.get(str(Config.CROP_CACHE_SIZE.name), 0))
+    RECOGNITION_BACKEND = os.environ.get(
+        str(Config.RECOGNITION_BACKEND.name), "eager")
+    RECOGNITION_BATCH_SIZE = int(
+        os.environ.get(str(Config.RECOGNITION_BATCH_SIZE.name), 8))
+    RECOGNITION_MAX_WAIT_MS = float(
+        os.environ.get(str(Config.RECOGNITION_MAX_WAIT_MS.name), 20))
+    GENERATION = GenerationSettings(
+        int(os.environ.get(str(Config.GENERATION_NUM_BEAMS.name), 1)),
+        int(os.environ.get(str(Config.GENERATION_MAX_NEW_TOKENS.name), 48)),
+        float(os.environ.get(str(Config.GENERATION_TOKENS_PER_ASPECT.name), 1.0)),
+        float(os.environ.get(str(Config.GENERATION_EARLY_EXIT_SCORE.name), 0.0)),
+        int(os.environ.get(str(Config.GENERATION_RESCORE_BEAMS.name), 4)))
+    INFERENCE_ADDRESS = os.environ.get(str(Config.INFERENCE_ADDRESS.name), os.path.join(
+        Config.ROOT_DIR.value, "inference.sock"))
+    INFERENCE_AUTHKEY = os.environ.get(
+        str(Config.INFERENCE_AUTHKEY.name), "").encode()
+    if not INFERENCE_AUTHKEY:
+        print("INFERENCE_AUTHKEY must be set to a non-empty secret")
+        sys.exit(1)
+    MODEL_WARMUP = os.environ.get(
+        str(Config.MODEL_WARMUP.name), "true").lower() not in ("0", "false", "no")
+    LINE_LAYOUT = os.environ.get(
+        str(Config.LINE_LAYOUT.name), "true").lower() not in ("0", "false", "no")
+    LAYOUT = LineLayout(
+        MIN_HEIGHT_RATIO=float(os.environ.get(
+            str(Config.LINE_MIN_HEIGHT_RATIO.name), 0.3)),
+        MERGE_GAP=float(os.environ.get(str(Config.LINE_MERGE_GAP.name), 1.0))) if LINE_LAYOUT else None
+
+    recognition_model = TEXT_RECOGNITION(
+        CROP_CACHE_SIZE, RECOGNITION_BACKEND, GENERATION)
+    server = INFERENCE_SERVER(
+        TEXT_DETECTION_POOL(DETECT_WORKERS, LAYOUT), recognition_model,
+        RECOGNITION_SCHEDULER(
+            recognition_model, RECOGNITION_BATCH_SIZE, RECOGNITION_MAX_WAIT_MS),
+        INFERENCE_ADDRESS, INFERENCE_AUTHKEY)
+    if MODEL_WARMUP:
+        server.warm_up()
+    print("Inference server listening on {}".format(INFERENCE_ADDRESS))
+    server.serve_forever()
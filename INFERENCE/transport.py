@@ -0,0 +1,95 @@
+import threading
+import numpy as np
+from multiprocessing import shared_memory, resource_tracker
+
+PING = "ping"
+DETECT = "detect"
+RECOGNIZE = "recognize"
+STATS = "stats"
+EXPORT_METRICS = "metrics"
+
+_lock = threading.Lock()
+_unclosed = []
+
+
+def share_arrays(arrays) -> tuple:
+    """
+    #### Copies NumPy arrays into one new shared memory block.
+
+    Arguments:
+    - arrays: A list of NumPy arrays or PIL images.
+
+    Returns:
+    - A tuple of the SharedMemory block and its layout, a list of `(offset, shape, dtype)` tuples, one per array. The block name and the layout are all the other process needs to read the arrays.
+
+    Notes:
+    - The caller owns the block and must pass it to `release(..., unlink=True)` once the other process is done with it.
+    """
+    arrays = [np.asarray(array) for array in arrays]
+    layout = []
+    offset = 0
+    for array in arrays:
+        layout.append((offset, array.shape, array.dtype.str))
+        offset += array.nbytes
+    block = shared_memory.SharedMemory(create=True, size=max(1, offset))
+    for array, (start, shape, dtype) in zip(arrays, layout):
+        np.ndarray(shape, dtype, buffer=block.buf, offset=start)[...] = array
+    return (block, layout)
+
+
+def attach_arrays(name: str, layout: list) -> tuple:
+    """
+    #### Maps the arrays of a shared memory block created by `share_arrays()` in another process.
+
+    Arguments:
+    - name (str): The name of the block.
+    - layout (list): The layout returned by `share_arrays()`.
+
+    Returns:
+    - A tuple of the SharedMemory block and a list of NumPy arrays that are views into it. No pixel data is copied.
+
+    Notes:
+    - The block is not registered with this process's resource tracker, so it is never unlinked here; its creator unlinks it.
+    - Pass the block to `release()` when done. It stays mapped until the views are dropped.
+    """
+    try:
+        block = shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        block = shared_memory.SharedMemory(name=name)
+        resource_tracker.unregister(block._name, "shared_memory")
+    arrays = [np.ndarray(tuple(shape), dtype, buffer=block.buf, offset=start)
+              for start, shape, dtype in layout]
+    return (block, arrays)
+
+
+def release(block, unlink=False) -> None:
+    """
+    #### Closes a shared memory block, and unlinks it if this process created it.
+
+    Notes:
+    - A block cannot be unmapped while NumPy views into it are alive. Such blocks are kept and closed by a later call once their views are gone.
+    """
+    with _lock:
+        _unclosed.append(block)
+        pending = []
+        for item in _unclosed:
+            try:
+                item.close()
+            except BufferError:
+                pending.append(item)
+        _unclosed[:] = pending
+    if unlink:
+        try:
+            block.unlink()
+        except FileNotFoundError:
+            pass
+
+
+def parse_address(address: str):
+    """
+    #### Turns an `INFERENCE_ADDRESS` value into a `multiprocessing.connection` address: a 'host:port' TCP tuple, or a Unix socket path.
+    """
+    host, separator, port = address.rpartition(":")
+    if separator and port.isdigit() and "/" not in address:
+        return (host, int(port))
+    return address
@@ -0,0 +1,378 @@
+import os
+import json
+import time
+import uuid
+import socket
+import sqlite3
+import threading
+from error import JobQueueError, JobQueueFullError
+
+
+class JobQueue:
+    connection = None
+    max_pending = 0
+    owner = None
+    lease = 0
+    retention = 0
+
+    QUEUED = "QUEUED"
+    RUNNING = "RUNNING"
+    DONE = "DONE"
+    FAILED = "FAILED"
+
+    def __init__(self, DATABASE_PATH: str, MAX_PENDING=100, BULK_SHARE=1.0, LEASE=30, RETENTION=86400) -> None:
+        """
+        #### Initializes a durable recognition job queue backed by a local SQLite database.
+
+        Arguments:
+        - DATABASE_PATH (str): The path of the SQLite database file. It is created if it does not exist.
+        - MAX_PENDING (int, optional): The maximum number of queued and running jobs. Defaults to 100.
+        - BULK_SHARE (float, optional): The fraction of `MAX_PENDING` that jobs of a priority above 0 (bulk) may fill, so a backlog of bulk jobs leaves room for interactive ones. Defaults to 1.0.
+        - LEASE (float, optional): The number of seconds a process holds its jobs without renewing the lease. Defaults to 30.
+        - RETENTION (float, optional): The number of seconds finished jobs stay in the database for `status()`. Defaults to 86400. A value of 0 keeps them forever.
+
+        Raises:
+        - JobQueueError: If the database cannot be opened or initialized.
+
+        Notes:
+        - Every job keeps the uploaded image bytes and its bounding boxes until it finishes, so a job that was queued or running when its process stopped is picked up again once its lease expires.
+        - Every queue instance has its own owner ID. A job is owned by the process that enqueued it and then by the process that claimed it, and only the owner claims or finishes it while the lease is renewed, so several gunicorn workers can share one database. `JobWorkerPool` renews the leases of its queue in the background.
+        - A single connection is shared by all threads and every operation is serialized by a lock. The operations are small, so this is not a bottleneck next to recognition.
+        """
+        try:
+            self.max_pending = max(1, int(MAX_PENDING))
+            self.max_pending_bulk = max(
+                1, int(self.max_pending * min(1.0, max(0.0, float(BULK_SHARE)))))
+            self.owner = "{}:{}:{}".format(
+                socket.gethostname(), os.getpid(), uuid.uuid4().hex[:8])
+            self.lease = max(1.0, float(LEASE))
+            self.retention = max(0.0, float(RETENTION))
+            self._lock = threading.Lock()
+            self.connection = sqlite3.connect(
+                DATABASE_PATH, check_same_thread=False, isolation_level=None)
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    document_id TEXT UNIQUE NOT NULL,
+                    status TEXT NOT NULL,
+                    image BLOB,
+                    boxes TEXT,
+                    settings TEXT,
+                    trace TEXT,
+                    priority INTEGER NOT NULL DEFAULT 0,
+                    owner TEXT,
+                    lease REAL,
+                    error TEXT,
+                    created REAL NOT NULL,
+                    updated REAL NOT NULL
+                )""")
+            columns = [row[1] for row in self.connection.execute(
+                "PRAGMA table_info(jobs)")]
+            for column in ("settings", "trace", "owner"):
+                if column not in columns:
+                    self.connection.execute(
+                        "ALTER TABLE jobs ADD COLUMN {} TEXT".format(column))
+            if "priority" not in columns:
+                self.connection.execute(
+                    "ALTER TABLE jobs ADD COLUMN priority INTEGER NOT NULL DEFAULT 0")
+            if "lease" not in columns:
+                self.connection.execute(
+                    "ALTER TABLE jobs ADD COLUMN lease REAL")
+            self.connection.execute(
+                "CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, id)")
+            self.connection.execute(
+                "CREATE INDEX IF NOT EXISTS jobs_priority ON jobs (status, priority, id)")
+            self.connection.execute(
+                "CREATE INDEX IF NOT EXISTS jobs_updated ON jobs (status, updated)")
+        except:
+            raise JobQueueError()
+
+    def pendingCount(self) -> int:
+        """
+        #### Returns the number of queued and running jobs.
+
+        Raises:
+        - JobQueueError: If the database query failed.
+        """
+        try:
+            with self._lock:
+                return self.connection.execute(
+                    "SELECT COUNT(*) FROM jobs WHERE status IN (?, ?)", (self.QUEUED, self.RUNNING)).fetchone()[0]
+        except:
+            raise JobQueueError()
+
+    def checkCapacity(self, PRIORITY=0) -> None:
+        """
+        #### Rejects new work early when the queue is full.
+
+        Arguments:
+        - PRIORITY (int, optional): The priority of the work. Bulk work is rejected once `BULK_SHARE` of the queue is used. Defaults to 0.
+
+        Raises:
+        - JobQueueFullError: If `MAX_PENDING` jobs, or the bulk share of them, are already queued or running.
+        - JobQueueError: If the database query failed.
+        """
+        if self.pendingCount() >= (self.max_pending if PRIORITY <= 0 else self.max_pending_bulk):
+            raise JobQueueFullError()
+
+    def enqueue(self, documentId: str, IMAGE: bytes, XYXY_LIST: list, SETTINGS=None, TRACE=None, PRIORITY=0) -> None:
+        """
+        #### Adds a recognition job for a document.
+
+        Arguments:
+        - documentId (str): The ID of the Firestore document the job writes to.
+        - IMAGE (bytes): The uploaded image bytes the boxes were detected on.
+        - XYXY_LIST (list[list[float]]): The bounding boxes to crop and recognize, in the format [[x1, y1, x2, y2], ...].
+        - SETTINGS (dict, optional): JSON-serializable per-request recognition settings, returned unchanged by `claim()`. Defaults to an empty dictionary.
+        - TRACE (dict, optional): The tracing carrier of the request that queued the job, returned unchanged by `claim()`. Defaults to None.
+        - PRIORITY (int, optional): The priority class of the job. Jobs with lower values are claimed first. Defaults to 0.
+
+        Raises:
+        - JobQueueFullError: If `MAX_PENDING` jobs, or the bulk share of them for a bulk job, are already queued or running.
+        - JobQueueError: If the job could not be stored.
+        """
+        try:
+            with self._lock:
+                self.connection.execute("BEGIN IMMEDIATE")
+                try:
+                    pending = self.connection.execute(
+                        "SELECT COUNT(*) FROM jobs WHERE status IN (?, ?)", (self.QUEUED, self.RUNNING)).fetchone()[0]
+                    if pending >= (self.max_pending if PRIORITY <= 0 else self.max_pending_bulk):
+                        raise JobQueueFullError()
+                    now = time.time()
+                    self.connection.execute(
+                        "INSERT INTO jobs (document_id, status, image, boxes, settings, trace, priority, owner, lease, created, updated) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                        (documentId, self.QUEUED, sqlite3.Binary(IMAGE), json.dumps(XYXY_LIST), json.dumps(SETTINGS or {}), json.dumps(TRACE) if TRACE else None, int(PRIORITY), self.owner, now + self.lease, now, now))
+                    self.connection.execute("COMMIT")
+                except:
+                    self.connection.execute("ROLLBACK")
+                    raise
+        except JobQueueFullError:
+            raise
+        except:
+            raise JobQueueError()
+
+    def claim(self):
+        """
+        #### Marks the oldest queued job of the most urgent priority as running and returns it.
+
+        Returns:
+        - A dictionary with the keys 'documentID', 'image', 'boxes', 'settings', 'trace' and 'priority', or None if no job is queued.
+
+        Raises:
+        - JobQueueError: If the database query failed.
+
+        Notes:
+        - Only jobs enqueued by this queue instance, or whose owner let the lease expire, are claimed. A job therefore runs in the process that accepted the upload unless that process died.
+        """
+        try:
+            with self._lock:
+                self.connection.execute("BEGIN IMMEDIATE")
+                try:
+                    now = time.time()
+                    row = self.connection.execute(
+                        "SELECT id, document_id, image, boxes, settings, trace, priority FROM jobs WHERE status = ? AND (owner = ? OR lease IS NULL OR lease < ?) ORDER BY priority, id LIMIT 1", (self.QUEUED, self.owner, now)).fetchone()
+                    if row is not None:
+                        self.connection.execute(
+                            "UPDATE jobs SET status = ?, owner = ?, lease = ?, updated = ? WHERE id = ?", (self.RUNNING, self.owner, now + self.lease, now, row[0]))
+                    self.connection.execute("COMMIT")
+                except:
+                    self.connection.execute("ROLLBACK")
+                    raise
+            if row is None:
+                return None
+            return {"documentID": row[1], "image": bytes(row[2]), "boxes": json.loads(row[3]), "settings": json.loads(row[4] or "{}"), "trace": json.loads(row[5]) if row[5] else None, "priority": row[6]}
+        except:
+            raise JobQueueError()
+
+    def complete(self, documentId: str) -> None:
+        """
+        #### Marks a job as done and drops its stored image.
+
+        Raises:
+        - JobQueueError: If the database update failed.
+        """
+        self._finish(documentId, self.DONE, None)
+
+    def fail(self, documentId: str, message: str) -> None:
+        """
+        #### Marks a job as failed with an error message and drops its stored image.
+
+        Raises:
+        - JobQueueError: If the database update failed.
+        """
+        self._finish(documentId, self.FAILED, message)
+
+    def _finish(self, documentId: str, status: str, message) -> None:
+        try:
+            with self._lock:
+                self.connection.execute(
+                    "UPDATE jobs SET status = ?, error = ?, image = NULL, lease = NULL, updated = ? WHERE document_id = ? AND owner = ?",
+                    (status, message, time.time(), documentId, self.owner))
+        except:
+            raise JobQueueError()
+
+    def renewLeases(self) -> int:
+        """
+        #### Extends the lease of every queued and running job owned by this queue instance.
+
+        Returns:
+        - The number of jobs whose lease was renewed.
+
+        Raises:
+        - JobQueueError: If the database update failed.
+        """
+        try:
+            with self._lock:
+                return self.connection.execute(
+                    "UPDATE jobs SET lease = ? WHERE owner = ? AND status IN (?, ?)", (time.time() + self.lease, self.owner, self.QUEUED, self.RUNNING)).rowcount
+        except:
+            raise JobQueueError()
+
+    def requeueExpired(self) -> int:
+        """
+        #### Puts running jobs whose owner stopped renewing the lease back into the queue, so any process can claim them.
+
+        Returns:
+        - The number of jobs that were requeued.
+
+        Raises:
+        - JobQueueError: If the database update failed.
+
+        Notes:
+        - Jobs of live processes are left alone, so this is safe to call at any time from any process. Rows written before leases existed have no lease and are requeued.
+        """
+        try:
+            with self._lock:
+                now = time.time()
+                return self.connection.execute(
+                    "UPDATE jobs SET status = ?, updated = ? WHERE status = ? AND (lease IS NULL OR lease < ?)", (self.QUEUED, now, self.RUNNING, now)).rowcount
+        except:
+            raise JobQueueError()
+
+    def prune(self) -> int:
+        """
+        #### Deletes finished jobs older than `RETENTION`.
+
+        Returns:
+        - The number of jobs that were deleted.
+
+        Raises:
+        - JobQueueError: If the database update failed.
+        """
+        if self.retention <= 0:
+            return 0
+        try:
+            with self._lock:
+                return self.connection.execute(
+                    "DELETE FROM jobs WHERE status IN (?, ?) AND updated < ?", (self.DONE, self.FAILED, time.time() - self.retention)).rowcount
+        except:
+            raise JobQueueError()
+
+    def status(self, documentId: str):
+        """
+        #### Returns the status of the job of a document.
+
+        Arguments:
+        - documentId (str): The ID of the Firestore document.
+
+        Returns:
+        - A dictionary with the keys 'documentID', 'status', 'error', 'created' and 'updated', or None if there is no such job.
+
+        Raises:
+        - JobQueueError: If the database query failed.
+        """
+        try:
+            with self._lock:
+                row = self.connection.execute(
+                    "SELECT document_id, status, error, created, updated FROM jobs WHERE document_id = ?", (documentId,)).fetchone()
+        except:
+            raise JobQueueError()
+        if row is None:
+            return None
+        return {"documentID": row[0], "status": row[1], "error": row[2], "created": row[3], "updated": row[4]}
+
+
+class JobWorkerPool:
+    job_queue = None
+    handler = None
+    workers = 0
+
+    def __init__(self, job_queue: JobQueue, handler, workers=4, poll_interval=1.0, on_failure=None) -> None:
+        """
+        #### Starts a bounded pool of worker threads that run the jobs of a `JobQueue`.
+
+        Arguments:
+        - job_queue (JobQueue): The queue to take jobs from.
+        - handler: A callable taking the job dictionary returned by `JobQueue.claim()`. A job is marked done when it returns and failed when it raises.
+        - workers (int): The number of worker threads. Default is 4.
+        - poll_interval (float): The number of seconds an idle worker waits before looking at the queue again. Default is 1.0.
+        - on_failure (optional): A callable taking the job dictionary and the exception, called after a job was marked failed, e.g. to invalidate what was derived from it. Its own errors are ignored. Defaults to None.
+
+        Notes:
+        - The number of documents being recognized at once is bounded by `workers`, no matter how many uploads arrive. Their crops still reach the model through the shared recognition scheduler.
+        - Call `notify()` after enqueuing a job so an idle worker picks it up without waiting for the poll interval.
+        - A maintenance thread renews the leases of the queue every third of `LEASE`, requeues jobs of processes that stopped, and prunes finished jobs.
+        """
+        self.job_queue = job_queue
+        self.handler = handler
+        self.workers = max(1, int(workers))
+        self.poll_interval = poll_interval
+        self.on_failure = on_failure
+        self._wakeup = threading.Condition()
+        self._threads = []
+        for _ in range(self.workers):
+            thread = threading.Thread(target=self._run, daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        thread = threading.Thread(target=self._maintain, daemon=True)
+        thread.start()
+        self._threads.append(thread)
+
+    def notify(self) -> None:
+        """
+        #### Wakes up one idle worker.
+        """
+        with self._wakeup:
+            self._wakeup.notify()
+
+    def _maintain(self) -> None:
+        while True:
+            try:
+                self.job_queue.renewLeases()
+                if self.job_queue.requeueExpired():
+                    self.notify()
+                self.job_queue.prune()
+            except JobQueueError:
+                pass
+            time.sleep(self.job_queue.lease / 3)
+
+    def _run(self) -> None:
+        while True:
+            try:
+                job = self.job_queue.claim()
+            except JobQueueError:
+                job = None
+            if job is None:
+                with self._wakeup:
+                    self._wakeup.wait(self.poll_interval)
+                continue
+            try:
+                self.handler(job)
+            except Exception as e:
+                message = getattr(e, "message", None) or "Unknown Error"
+                try:
+                    self.job_queue.fail(job["documentID"], message)
+                except JobQueueError:
+                    pass
+                if self.on_failure is not None:
+                    try:
+                        self.on_failure(job, e)
+                    except Exception:
+                        pass
+                continue
+            try:
+                self.job_queue.complete(job["documentID"])
+            except JobQueueError:
+                pass
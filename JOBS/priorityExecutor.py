@@ -0,0 +1,73 @@
+import queue
+import itertools
+import threading
+from concurrent.futures import Future
+
+
+class PriorityExecutor:
+    """
+    #### A thread pool whose queued calls run by priority, then in submission order.
+    """
+
+    def __init__(self, max_workers=1) -> None:
+        """
+        #### Starts the worker threads.
+
+        Arguments:
+        - max_workers (int): The number of calls run at once. Default is 1.
+
+        Notes:
+        - Unlike `ThreadPoolExecutor`, a call submitted with a lower priority value overtakes calls already queued with a higher one. Running calls are never interrupted.
+        - `submit()` returns a `concurrent.futures.Future`, so it can be awaited with `asyncio.wrap_future()`.
+        """
+        self.max_workers = max(1, int(max_workers))
+        self._queue = queue.PriorityQueue()
+        self._sequence = itertools.count()
+        self._threads = [threading.Thread(target=self._run, daemon=True)
+                         for _ in range(self.max_workers)]
+        for thread in self._threads:
+            thread.start()
+
+    def submit(self, function, *args, priority=0, **kwargs) -> Future:
+        """
+        #### Queues a call.
+
+        Arguments:
+        - function: The callable to run on a worker thread.
+        - priority (int, optional): Lower values run first. Defaults to 0.
+
+        Returns:
+        - A Future holding the return value or the exception of the call.
+        """
+        future = Future()
+        self._queue.put((priority, next(self._sequence),
+                        (future, function, args, kwargs)))
+        return future
+
+    def queueDepth(self) -> int:
+        """
+        #### Returns the number of calls waiting for a worker.
+        """
+        return self._queue.qsize()
+
+    def shutdown(self) -> None:
+        """
+        #### Stops the workers after the calls already queued have run.
+        """
+        for _ in self._threads:
+            self._queue.put((float("inf"), next(self._sequence), None))
+        for thread in self._threads:
+            thread.join()
+
+    def _run(self) -> None:
+        while True:
+            item = self._queue.get()[2]
+            if item is None:
+                return
+            future, function, args, kwargs = item
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                future.set_result(function(*args, **kwargs))
+            except BaseException as e:
+                future.set_exception(e)
@@ -0,0 +1,190 @@
+import time
+import bisect
+import threading
+from contextlib import contextmanager
+from METRICS import tracing
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25,
+                   0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+REGISTRY = []
+
+
+def _labels(names: tuple, values: tuple, extra="") -> str:
+    pairs = ['{}="{}"'.format(name, str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n"))
+             for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value) -> str:
+    return repr(float(value)) if value != float("inf") else "+Inf"
+
+
+class Counter:
+    """
+    #### A monotonically increasing count, optionally split by labels.
+    """
+
+    def __init__(self, name: str, documentation: str, labelnames=()) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def inc(self, amount=1, **labels) -> None:
+        key = tuple(labels.get(name, "") for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def collect(self) -> list:
+        with self._lock:
+            values = sorted(self._values.items())
+        lines = ["# HELP {} {}".format(self.name, self.documentation),
+                 "# TYPE {} counter".format(self.name)]
+        for key, value in values:
+            lines.append("{}{} {}".format(
+                self.name, _labels(self.labelnames, key), _number(value)))
+        return lines
+
+
+class Gauge:
+    """
+    #### A value read from a callback at scrape time.
+    """
+
+    def __init__(self, name: str, documentation: str, function) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.function = function
+        REGISTRY.append(self)
+
+    def collect(self) -> list:
+        lines = ["# HELP {} {}".format(self.name, self.documentation),
+                 "# TYPE {} gauge".format(self.name)]
+        try:
+            lines.append("{} {}".format(self.name, _number(self.function())))
+        except Exception:
+            pass
+        return lines
+
+
+class Histogram:
+    """
+    #### A distribution of observed values in fixed buckets, optionally split by labels.
+    """
+
+    def __init__(self, name: str, documentation: str, buckets=LATENCY_BUCKETS, labelnames=()) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.buckets = tuple(sorted(buckets))
+        self.labelnames = tuple(labelnames)
+        self._series = {}
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def observe(self, value: float, **labels) -> None:
+        key = tuple(labels.get(name, "") for name in self.labelnames)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [
+                    [0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        """
+        #### Observes the seconds spent in a `with` block, including when it raises.
+        """
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def collect(self) -> list:
+        with self._lock:
+            series = sorted((key, (list(counts), total))
+                            for key, (counts, total) in self._series.items())
+        lines = ["# HELP {} {}".format(self.name, self.documentation),
+                 "# TYPE {} histogram".format(self.name)]
+        for key, (counts, total) in series:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                lines.append("{}_bucket{} {}".format(self.name, _labels(
+                    self.labelnames, key, 'le="{}"'.format(_number(bound))), cumulative))
+            lines.append("{}_sum{} {}".format(
+                self.name, _labels(self.labelnames, key), _number(total)))
+            lines.append("{}_count{} {}".format(
+                self.name, _labels(self.labelnames, key), cumulative))
+        return lines
+
+
+def render() -> str:
+    """
+    #### Returns every registered metric in the Prometheus text exposition format.
+    """
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.collect())
+    return "\n".join(lines) + "\n"
+
+
+STAGE_SECONDS = Histogram(
+    "prescription_stage_seconds", "Seconds spent in each stage of the extraction pipeline.", labelnames=("stage",))
+REQUEST_SECONDS = Histogram(
+    "prescription_request_seconds", "Seconds spent serving HTTP requests.", labelnames=("endpoint", "status"))
+BOX_COUNT = Histogram(
+    "prescription_boxes_per_image", "Number of text lines detected per image.", (0, 1, 2, 5, 10, 15, 20, 30, 50, 100))
+CROP_PIXELS = Histogram(
+    "prescription_crop_pixels", "Width and height in pixels of the cropped text lines.", (8, 16, 32, 64, 128, 256, 512, 1024, 2048), ("dimension",))
+RECOGNITION_BATCH_SIZE = Histogram(
+    "prescription_recognition_batch_size", "Number of crops per recognition model call.", (1, 2, 4, 8, 16, 32, 64))
+ERRORS = Counter(
+    "prescription_errors_total", "Errors by exception class and by where they surfaced.", ("error", "source"))
+
+
+@contextmanager
+def stage(name: str, **attributes):
+    """
+    #### Times a pipeline stage into `STAGE_SECONDS` and wraps it in a tracing span of the same name.
+    """
+    with tracing.span(name, **attributes):
+        with STAGE_SECONDS.time(stage=name):
+            yield
+
+
+def observe_timings(timings: dict) -> None:
+    """
+    #### Records the stage timings returned by the detector, in seconds, into `STAGE_SECONDS`.
+    """
+    for name, seconds in timings.items():
+        STAGE_SECONDS.observe(seconds, stage=name)
+
+
+def observe_detection(xyxy) -> None:
+    """
+    #### Records the number of boxes of an image and the width and height of each box.
+
+    Arguments:
+    - xyxy (list[list[float]]): The boxes, in the format [[x1, y1, x2, y2], ...].
+    """
+    BOX_COUNT.observe(len(xyxy))
+    for x1, y1, x2, y2 in xyxy:
+        CROP_PIXELS.observe(x2 - x1, dimension="width")
+        CROP_PIXELS.observe(y2 - y1, dimension="height")
+
+
+def count_error(error: Exception, source: str) -> None:
+    """
+    #### Counts an error under its exception class name, e.g. 'DetectionDetectError'.
+    """
+    ERRORS.inc(error=type(error).__name__, source=source)
@@ -0,0 +1,91 @@
+import contextvars
+from contextlib import contextmanager
+
+tracer = None
+
+
+def configure(ENABLED=False, SERVICE_NAME="prescription-extractor") -> bool:
+    """
+    #### Enables OpenTelemetry spans, if the optional `opentelemetry-api` package is installed.
+
+    Arguments:
+    - ENABLED (bool, optional): Whether to create spans at all. Defaults to False.
+    - SERVICE_NAME (str, optional): The instrumentation name of the tracer.
+
+    Returns:
+    - True if spans are enabled.
+
+    Notes:
+    - Only the API is used here. The tracer provider and exporter come from the OpenTelemetry SDK, for example by starting the server under `opentelemetry-instrument` or by setting the `OTEL_*` environment variables it reads. Without a provider, spans are no-ops.
+    - With tracing disabled or the package missing, every function of this module is a cheap no-op.
+    """
+    global tracer
+    if not ENABLED:
+        tracer = None
+        return False
+    try:
+        from opentelemetry import trace
+    except ImportError:
+        print("TRACING is enabled but opentelemetry-api is not installed")
+        tracer = None
+        return False
+    tracer = trace.get_tracer(SERVICE_NAME)
+    return True
+
+
+@contextmanager
+def span(name: str, link=None, **attributes):
+    """
+    #### Opens a span as a child of the current one.
+
+    Arguments:
+    - name (str): The span name.
+    - link (dict, optional): A carrier returned by `inject()` in another request or thread. The new span is linked to the span it was taken from, which is how a background recognition job points back to the HTTP request that queued it.
+    - attributes: Span attributes. None values are skipped.
+    """
+    if tracer is None:
+        yield None
+        return
+    from opentelemetry import trace, propagate
+
+    links = []
+    if link:
+        linked = trace.get_current_span(
+            propagate.extract(link)).get_span_context()
+        if linked.is_valid:
+            links.append(trace.Link(linked))
+    with tracer.start_as_current_span(name, links=links) as current:
+        for key, value in attributes.items():
+            if value is not None:
+                current.set_attribute(key, value)
+        yield current
+
+
+def inject():
+    """
+    #### Returns a carrier dictionary for the current span, or None if tracing is disabled.
+
+    Notes:
+    - The carrier is JSON-serializable, so it can be stored with a queued job and passed to `span(..., link=carrier)` after a restart.
+    """
+    if tracer is None:
+        return None
+    from opentelemetry import propagate
+
+    carrier = {}
+    propagate.inject(carrier)
+    return carrier
+
+
+def bind(function):
+    """
+    #### Wraps a callable so it runs in a copy of the current context, keeping the current span as parent when it is sent to an executor.
+
+    Notes:
+    - `loop.run_in_executor` and `ThreadPoolExecutor.submit` do not carry context variables to the worker thread, unlike `run_in_threadpool`.
+    """
+    context = contextvars.copy_context()
+
+    def run(*args, **kwargs):
+        return context.run(function, *args, **kwargs)
+    return run
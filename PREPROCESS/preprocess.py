@@ -0,0 +1,127 @@
+import warnings
+from io import BytesIO
+from PIL import Image
+from error import FileReadError, UploadTooLargeError
+
+
+class PreparedImage:
+    """
+    #### An uploaded image decoded at reduced size for detection, with lazy access to the full-resolution image for cropping.
+    """
+    detection = None
+    width = 0
+    height = 0
+
+    def __init__(self, file: bytes, detection, width: int, height: int, full=None) -> None:
+        self._file = file
+        self.detection = detection
+        self.width = width
+        self.height = height
+        self._full = full if full is not None or detection.size != (
+            width, height) else detection
+
+    @property
+    def scale(self) -> tuple:
+        """
+        #### Returns the (x, y) factors mapping detection-image coordinates to full-resolution coordinates.
+        """
+        return (self.width / self.detection.width, self.height / self.detection.height)
+
+    def full(self):
+        """
+        #### Decodes the upload at full resolution, once, and returns it as an RGB PIL image.
+
+        Raises:
+        - FileReadError: If the image cannot be decoded.
+        """
+        if self._full is None:
+            self._full = decode(self._file)
+        return self._full
+
+
+def check_upload(file: bytes, max_bytes=0, max_pixels=0):
+    """
+    #### Opens an upload lazily and rejects it before decoding if it is too large.
+
+    Arguments:
+    - file (bytes): The raw bytes of the upload.
+    - max_bytes (int, optional): The maximum upload size in bytes. Defaults to 0, which disables the check.
+    - max_pixels (int, optional): The maximum number of pixels (width times height). Defaults to 0, which disables the check.
+
+    Returns:
+    - An unloaded PIL image; only its header has been read.
+
+    Raises:
+    - UploadTooLargeError: If the upload has more bytes or pixels than allowed, or PIL flags it as a decompression bomb.
+    - FileReadError: If the bytes are not a readable image.
+    """
+    if max_bytes > 0 and len(file) > max_bytes:
+        raise UploadTooLargeError()
+    try:
+        with warnings.catch_warnings():
+            warnings.simplefilter("error", Image.DecompressionBombWarning)
+            image = Image.open(BytesIO(file))
+    except (Image.DecompressionBombError, Image.DecompressionBombWarning):
+        raise UploadTooLargeError()
+    except:
+        raise FileReadError()
+    if max_pixels > 0 and image.width * image.height > max_pixels:
+        raise UploadTooLargeError()
+    return image
+
+
+def decode(file: bytes, max_bytes=0, max_pixels=0):
+    """
+    #### Decodes an upload at full resolution into an RGB PIL image, after the size checks of `check_upload()`.
+
+    Raises:
+    - UploadTooLargeError: If the upload is too large.
+    - FileReadError: If the image cannot be decoded.
+    """
+    image = check_upload(file, max_bytes, max_pixels)
+    try:
+        return image.convert("RGB")
+    except:
+        raise FileReadError()
+
+
+def prepare(file: bytes, max_side=0, max_bytes=0, max_pixels=0) -> PreparedImage:
+    """
+    #### Decodes an upload for detection at a reduced size.
+
+    Arguments:
+    - file (bytes): The raw bytes of the upload.
+    - max_side (int, optional): The maximum width or height of the detection image. Defaults to 0, which keeps the full resolution.
+    - max_bytes (int, optional): The maximum upload size in bytes, see `check_upload()`.
+    - max_pixels (int, optional): The maximum number of pixels, see `check_upload()`.
+
+    Returns:
+    - A PreparedImage whose `detection` image fits in `max_side`, and whose `full()` returns the full-resolution image for cropping.
+
+    Raises:
+    - UploadTooLargeError: If the upload is too large.
+    - FileReadError: If the image cannot be decoded.
+
+    Notes:
+    - JPEG uploads use draft mode, so the decoder itself scales the image down by 1/2, 1/4 or 1/8 using the DCT coefficients, without materializing the full-resolution pixels. Any remaining reduction is a resize of the already small image.
+    - For JPEG uploads, the full-resolution image is only decoded when `full()` is called, after detection, so the detector never holds it in memory. Other formats have no reduced decode; their full decode is kept for `full()` instead of decoding the upload a second time.
+    """
+    image = check_upload(file, max_bytes, max_pixels)
+    width, height = image.size
+    try:
+        if max_side > 0 and max(width, height) > max_side:
+            if image.format == "JPEG":
+                image.draft("RGB", (max_side, max_side))
+            decoded = image.convert("RGB")
+            full = decoded if decoded.size == (width, height) else None
+            detection = decoded
+            if max(decoded.size) > max_side:
+                ratio = max_side / max(decoded.size)
+                detection = decoded.resize((max(1, round(decoded.width * ratio)), max(
+                    1, round(decoded.height * ratio))), Image.BILINEAR)
+        else:
+            detection = image.convert("RGB")
+            full = detection
+    except:
+        raise FileReadError()
+    return PreparedImage(file, detection, width, height, full)
@@ -0,0 +1,107 @@
+import os
+import torch
+from transformers import VisionEncoderDecoderModel
+from error import RecognitionInitializationError
+
+
+class EagerBackend:
+    """
+    #### Runs the TrOCR model with full-precision eager PyTorch `generate`.
+    """
+    name = "eager"
+    device = None
+    model = None
+
+    def __init__(self, model_path: str, device) -> None:
+        self.device = device
+        self.model = VisionEncoderDecoderModel.from_pretrained(
+            model_path).to(self.device)
+        self.model.eval()
+
+    def generate(self, pixel_values, **kwargs):
+        """
+        #### Generates token IDs for a batch of preprocessed images.
+
+        Arguments:
+        - pixel_values (torch.Tensor): The batch returned by the TrOCRProcessor.
+        - kwargs: Extra arguments forwarded to `generate`.
+
+        Returns:
+        - The output of the model's `generate` method.
+        """
+        with torch.no_grad():
+            return self.model.generate(pixel_values.to(self.device), **kwargs)
+
+
+class QuantizedBackend(EagerBackend):
+    """
+    #### Runs the TrOCR model on the CPU with dynamic int8 quantization of every linear layer.
+    """
+    name = "int8"
+
+    def __init__(self, model_path: str, device) -> None:
+        self.device = torch.device("cpu")
+        model = VisionEncoderDecoderModel.from_pretrained(model_path)
+        model.eval()
+        self.model = torch.quantization.quantize_dynamic(
+            model, {torch.nn.Linear}, dtype=torch.qint8)
+
+
+class OnnxBackend:
+    """
+    #### Runs an exported ONNX encoder and decoder with ONNX Runtime, reusing the decoder KV cache between steps.
+    """
+    name = "onnx"
+    device = None
+    model = None
+
+    def __init__(self, model_path: str, device) -> None:
+        """
+        #### Loads the ONNX export of the model, exporting it next to the PyTorch weights on first use.
+
+        Notes:
+        - Requires the optional `optimum[onnxruntime]` package.
+        - The export is stored in `<model_path>_onnx` and reused on later starts. The decoder is exported with past key values, so each generation step only runs the new token through the decoder.
+        """
+        from optimum.onnxruntime import ORTModelForVision2Seq
+
+        self.device = torch.device("cpu")
+        onnx_path = "{}_onnx".format(model_path.rstrip(os.sep))
+        if os.path.isdir(onnx_path):
+            self.model = ORTModelForVision2Seq.from_pretrained(
+                onnx_path, use_cache=True, provider="CPUExecutionProvider")
+        else:
+            self.model = ORTModelForVision2Seq.from_pretrained(
+                model_path, export=True, use_cache=True, provider="CPUExecutionProvider")
+            self.model.save_pretrained(onnx_path)
+
+    def generate(self, pixel_values, **kwargs):
+        return self.model.generate(pixel_values.to(self.device), **kwargs)
+
+
+BACKENDS = {backend.name: backend for backend in (
+    EagerBackend, QuantizedBackend, OnnxBackend)}
+
+
+def load_backend(name: str, model_path: str, device):
+    """
+    #### Loads the recognition inference backend selected by name.
+
+    Arguments:
+    - name (str): One of 'eager' (full-precision PyTorch), 'int8' (PyTorch dynamic int8 quantization) or 'onnx' (ONNX Runtime).
+    - model_path (str): The directory of the pre-trained TrOCR model.
+    - device: The torch device preferred by the caller. The 'int8' and 'onnx' backends always run on the CPU.
+
+    Returns:
+    - A backend instance exposing `name`, `device`, `model` and `generate()`.
+
+    Raises:
+    - RecognitionInitializationError: If the backend name is unknown or the backend failed to load.
+    """
+    if name not in BACKENDS:
+        raise RecognitionInitializationError(
+            "UNKNOWN RECOGNITION BACKEND: {}".format(name))
+    try:
+        return BACKENDS[name](model_path, device)
+    except:
+        raise RecognitionInitializationError()
@@ -0,0 +1,95 @@
+import hashlib
+import threading
+import numpy as np
+from PIL import Image
+from collections import OrderedDict
+
+
+class CropCache:
+    max_entries = 0
+
+    HASH_HEIGHT = 24
+
+    def __init__(self, MAX_ENTRIES=4096) -> None:
+        """
+        #### Initializes a bounded cache of recognition results keyed by a perceptual hash of the crop.
+
+        Arguments:
+        - MAX_ENTRIES (int, optional): The maximum number of crops remembered. The least recently used crop is evicted first. Defaults to 4096.
+
+        Notes:
+        - A crop is answered from the cache only if its key is identical to a stored one. Lines of different prescriptions often differ in a single digit of a dosage, so near matches are never used: a cached "Warfarin 1mg" must not answer "Warfarin 5mg".
+        - The cache therefore pays off for repeats of the same picture, e.g. retried uploads and the same scan sent to several endpoints or with other settings, not for a similar line on another scan.
+        - All methods are thread-safe.
+        """
+        self.max_entries = max(1, int(MAX_ENTRIES))
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+
+    def key(self, image) -> bytes:
+        """
+        #### Computes the perceptual hash of a crop.
+
+        Arguments:
+        - image: A PIL image object or an RGB NumPy array.
+
+        Returns:
+        - The hash as 16 bytes.
+
+        Notes:
+        - The crop is converted to grayscale and resized to `HASH_HEIGHT` rows and as many columns as keep its aspect ratio, then reduced to one bit per horizontal gradient (a difference hash). This ignores brightness and contrast, while every character still spans several columns, so crops that differ in one digit get different keys.
+        - The number of columns is hashed together with the bits, so crops of different shapes never share a key.
+        """
+        if not isinstance(image, Image.Image):
+            image = Image.fromarray(np.asarray(image))
+        width, height = image.size
+        columns = max(1, round(self.HASH_HEIGHT * width / max(height, 1)))
+        small = np.asarray(image.convert("L").resize(
+            (columns + 1, self.HASH_HEIGHT), Image.BILINEAR), dtype=np.int16)
+        bits = small[:, 1:] > small[:, :-1]
+        return hashlib.blake2b(columns.to_bytes(4, "big") + np.packbits(bits).tobytes(), digest_size=16).digest()
+
+    def get(self, key: bytes, scope=None):
+        """
+        #### Returns the result stored for a crop hash, or None if it is unknown.
+
+        Arguments:
+        - key (bytes): A hash returned by `key()`.
+        - scope (optional): Any hashable value results are kept apart by. Callers pass the decoding settings, so a result decoded with one setting is never returned for another. Defaults to None.
+        """
+        with self._lock:
+            result = self._entries.get((scope, key))
+            if result is None:
+                self._misses += 1
+                return None
+            self._entries.move_to_end((scope, key))
+            self._hits += 1
+            return result
+
+    def put(self, key: bytes, result, scope=None) -> None:
+        """
+        #### Stores the result recognized for a crop hash in a scope.
+        """
+        with self._lock:
+            self._entries[(scope, key)] = result
+            self._entries.move_to_end((scope, key))
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self) -> dict:
+        """
+        #### Returns the cache counters.
+
+        Returns:
+        - A dictionary with the number of entries, hits and misses, and the hit rate.
+        """
+        with self._lock:
+            total = self._hits + self._misses
+            return {
+                "entries": len(self._entries),
+                "hits": self._hits,
+                "misses": self._misses,
+                "hit_rate": self._hits / total if total else 0.0
+            }
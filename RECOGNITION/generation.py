@@ -0,0 +1,90 @@
+import math
+
+
+def aspect(image) -> float:
+    """
+    #### Returns the width over height of a PIL image or NumPy array.
+    """
+    if hasattr(image, "shape"):
+        height, width = image.shape[:2]
+    else:
+        width, height = image.size
+    return width / max(height, 1)
+
+
+class GenerationSettings:
+    """
+    #### Decoding settings for the OCR model's `generate` call.
+    """
+    NUM_BEAMS = 1
+    MAX_NEW_TOKENS = 48
+    TOKENS_PER_ASPECT = 1.0
+    EARLY_EXIT_SCORE = 0.0
+    RESCORE_BEAMS = 4
+
+    MIN_NEW_TOKENS = 8
+    TOKEN_MARGIN = 8
+
+    def __init__(self, NUM_BEAMS=1, MAX_NEW_TOKENS=48, TOKENS_PER_ASPECT=1.0, EARLY_EXIT_SCORE=0.0, RESCORE_BEAMS=4) -> None:
+        """
+        #### Initializes the decoding settings.
+
+        Arguments:
+        - NUM_BEAMS (int, optional): The number of beams. 1 decodes greedily. Defaults to 1.
+        - MAX_NEW_TOKENS (int, optional): The hard limit on generated tokens per line. Defaults to 48, enough for a prescription line of about 40 characters with margin.
+        - TOKENS_PER_ASPECT (float, optional): The number of tokens allowed per unit of crop width over crop height. The limit of a batch is derived from its widest crop and capped by `MAX_NEW_TOKENS`. Defaults to 1.0. A value of 0 always uses `MAX_NEW_TOKENS`.
+        - EARLY_EXIT_SCORE (float, optional): A confidence between 0 and 1. With greedy decoding, lines scoring at least this value are accepted straight away and only the others are decoded again with `RESCORE_BEAMS` beams. Defaults to 0.0, which never re-runs a line.
+        - RESCORE_BEAMS (int, optional): The number of beams used to re-run low-confidence lines. Defaults to 4.
+        """
+        self.NUM_BEAMS = max(1, int(NUM_BEAMS))
+        self.MAX_NEW_TOKENS = max(1, int(MAX_NEW_TOKENS))
+        self.TOKENS_PER_ASPECT = max(0.0, float(TOKENS_PER_ASPECT))
+        self.EARLY_EXIT_SCORE = min(1.0, max(0.0, float(EARLY_EXIT_SCORE)))
+        self.RESCORE_BEAMS = max(1, int(RESCORE_BEAMS))
+
+    def replace(self, **overrides):
+        """
+        #### Returns a copy of these settings with some values overridden. Overrides that are None are ignored.
+
+        Notes:
+        - These settings are the deployment's limits, so per-request overrides can only lower the cost of decoding: `NUM_BEAMS` is capped by the larger of `NUM_BEAMS` and `RESCORE_BEAMS`, `MAX_NEW_TOKENS` and `RESCORE_BEAMS` by their own values.
+        """
+        values = self.toDict()
+        values.update({name: value for name, value in overrides.items()
+                       if value is not None})
+        settings = GenerationSettings(**values)
+        settings.NUM_BEAMS = min(settings.NUM_BEAMS, max(self.NUM_BEAMS, self.RESCORE_BEAMS))
+        settings.MAX_NEW_TOKENS = min(settings.MAX_NEW_TOKENS, self.MAX_NEW_TOKENS)
+        settings.RESCORE_BEAMS = min(settings.RESCORE_BEAMS, self.RESCORE_BEAMS)
+        return settings
+
+    def toDict(self) -> dict:
+        return {
+            "NUM_BEAMS": self.NUM_BEAMS,
+            "MAX_NEW_TOKENS": self.MAX_NEW_TOKENS,
+            "TOKENS_PER_ASPECT": self.TOKENS_PER_ASPECT,
+            "EARLY_EXIT_SCORE": self.EARLY_EXIT_SCORE,
+            "RESCORE_BEAMS": self.RESCORE_BEAMS
+        }
+
+    def key(self) -> tuple:
+        """
+        #### Returns a hashable key; crops are only batched together when their settings have the same key.
+        """
+        return tuple(sorted(self.toDict().items()))
+
+    def maxNewTokens(self, images) -> int:
+        """
+        #### Derives the token limit of a batch from the widest crop in it.
+
+        Arguments:
+        - images: A list of PIL image objects or NumPy arrays.
+
+        Returns:
+        - The `max_new_tokens` value passed to `generate`.
+        """
+        if self.TOKENS_PER_ASPECT <= 0:
+            return self.MAX_NEW_TOKENS
+        widest = max((aspect(image) for image in images), default=0.0)
+        limit = math.ceil(widest * self.TOKENS_PER_ASPECT) + self.TOKEN_MARGIN
+        return min(self.MAX_NEW_TOKENS, max(self.MIN_NEW_TOKENS, limit))
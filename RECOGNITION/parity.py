@@ -0,0 +1,104 @@
+import os
+import sys
+import json
+import time
+import argparse
+from PIL import Image
+from RECOGNITION.recognition import TEXT_RECOGNITION
+
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".bmp", ".tif", ".tiff")
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+MIN_EXACT_MATCH_RATE = 0.95
+MAX_CHARACTER_ERROR_RATE = 0.01
+
+
+def edit_distance(a: str, b: str) -> int:
+    """
+    #### Returns the Levenshtein distance between two strings.
+    """
+    previous = list(range(len(b) + 1))
+    for i, char_a in enumerate(a, 1):
+        current = [i]
+        for j, char_b in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1,
+                               previous[j - 1] + (char_a != char_b)))
+        previous = current
+    return previous[-1]
+
+
+def timed_recognition(recognizer: TEXT_RECOGNITION, images: list, batch_size: int) -> tuple:
+    started = time.perf_counter()
+    texts = recognizer.recognize_batch(images, batch_size)
+    return texts, time.perf_counter() - started
+
+
+def check_parity(backend: str, fixtures=FIXTURES, batch_size=8) -> dict:
+    """
+    #### Compares a recognition backend against the eager PyTorch backend on a directory of crop images.
+
+    Arguments:
+    - backend (str): The backend to check, see `RECOGNITION/backends.py`.
+    - fixtures (str, optional): A directory of cropped line images. Defaults to `RECOGNITION/fixtures`.
+    - batch_size (int): The batch size used for both backends. Default is 8.
+
+    Returns:
+    - A dictionary with the number of crops, the exact-match rate, the character error rate of the backend relative to the eager output, the total latency of both backends, the speedup, the crops whose text differs, and whether the backend passed.
+
+    Notes:
+    - Each backend runs once untimed to warm up before the timed run, so one-time costs such as graph optimization are not counted.
+    - The eager output is the reference, so no labels are needed. A backend passes with an exact-match rate of at least `MIN_EXACT_MATCH_RATE` (95%) and a character error rate of at most `MAX_CHARACTER_ERROR_RATE` (1%). Below that, quantization changes enough lines to be visible in `DETECT_LIST`, and the speedup does not pay for it.
+    - `RECOGNITION/fixtures` holds 16 printed prescription-style lines, blurred or slightly rotated, as a smoke test that runs anywhere. Printed text decodes more confidently than handwriting, so before switching `RECOGNITION_BACKEND` in production, also run the check on at least a few hundred crops exported from real uploads, e.g. with `--fixtures` pointing to crops saved from `detect_and_crop(as_pil=True)`. Those contain patient data and are not committed.
+    """
+    names = sorted(name for name in os.listdir(fixtures)
+                   if name.lower().endswith(IMAGE_EXTENSIONS))
+    images = [Image.open(os.path.join(fixtures, name)).convert("RGB")
+              for name in names]
+
+    results = {}
+    for name in ("eager", backend):
+        recognizer = TEXT_RECOGNITION(BACKEND=name)
+        recognizer.recognize_batch(images[:batch_size], batch_size)
+        results[name] = timed_recognition(recognizer, images, batch_size)
+        del recognizer
+
+    reference, reference_time = results["eager"]
+    candidate, candidate_time = results[backend]
+    distance = sum(edit_distance(ref, cand)
+                   for ref, cand in zip(reference, candidate))
+    characters = sum(len(ref) for ref in reference)
+    matches = sum(ref == cand for ref, cand in zip(reference, candidate))
+    exact_match_rate = matches / len(images) if images else 1.0
+    character_error_rate = distance / characters if characters else 0.0
+    return {
+        "backend": backend,
+        "crops": len(images),
+        "exact_match_rate": exact_match_rate,
+        "character_error_rate": character_error_rate,
+        "eager_seconds": reference_time,
+        "backend_seconds": candidate_time,
+        "speedup": reference_time / candidate_time if candidate_time else 0.0,
+        "mismatches": [
+            {"file": name, "eager": ref, "backend": cand}
+            for name, ref, cand in zip(names, reference, candidate) if ref != cand
+        ],
+        "passed": exact_match_rate >= MIN_EXACT_MATCH_RATE and character_error_rate <= MAX_CHARACTER_ERROR_RATE
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Check the accuracy and latency of a recognition backend against eager PyTorch.")
+    parser.add_argument("--backend", required=True,
+                        help="Backend to check: int8 or onnx")
+    parser.add_argument("--fixtures", default=FIXTURES,
+                        help="Directory of cropped line images. Defaults to RECOGNITION/fixtures")
+    parser.add_argument("--batch-size", type=int, default=8)
+    parser.add_argument("--output", help="Write the report to this JSON file")
+    args = parser.parse_args()
+
+    report = check_parity(args.backend, args.fixtures, args.batch_size)
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    sys.exit(0 if report["passed"] else 1)
@@ -1,52 +1,72 @@
 import os
 import torch
 from configs import Config
-from transformers import TrOCRProcessor, VisionEncoderDecoderModel
+from transformers import TrOCRProcessor
 from error import RecognitionInitializationError, RecognitionRecognizeError
+from RECOGNITION.cropCache import CropCache
+from RECOGNITION.backends import load_backend
+from RECOGNITION.generation import GenerationSettings, aspect
 
 
 class TEXT_RECOGNITION:
     processor = None
     device = None
     model = None
+    backend = None
+    crop_cache = None
+    generation = None
 
-    def __init__(self) -> None:
+    def __init__(self, CROP_CACHE_SIZE=0, BACKEND="eager", GENERATION=None) -> None:
         """
         #### Initializes the OCR model for recognizing handwritten text from images.
 
         Attributes:
         - device: An instance of the torch.device class, representing the hardware accelerator (GPU or CPU) available for running the model.
         - processor: An instance of the TrOCRProcessor class, which performs text normalization and post-processing on the OCR output.
-        - model: An instance of the VisionEncoderDecoderModel class, representing the pre-trained OCR model loaded from disk.
+        - model: The model loaded by the backend: a VisionEncoderDecoderModel for the PyTorch backends, or an ORTModelForVision2Seq for ONNX Runtime.
+        - backend: The inference backend running `generate`, see `RECOGNITION/backends.py`.
+        - crop_cache: An instance of the CropCache class remembering the text of recently seen crops, or None if crop caching is disabled.
+        - generation: The default GenerationSettings of this deployment, used when a call does not pass its own.
 
         Arguments:
-        - None
+        - CROP_CACHE_SIZE (int, optional): The maximum number of crops remembered by the perceptual-hash crop cache. Defaults to 0, which disables the cache.
+        - BACKEND (str, optional): The inference backend: 'eager' for full-precision PyTorch, 'int8' for PyTorch dynamic int8 quantization or 'onnx' for ONNX Runtime. Defaults to 'eager'.
+        - GENERATION (GenerationSettings, optional): The default decoding settings. Defaults to greedy decoding with a crop-width-derived length limit.
 
         Raises:
         - RecognitionInitializationError: If an error occurs while loading the OCR model, such as a missing or corrupted file, unsupported file format, or incorrect file path.
 
         Notes:
         - This function initializes the OCR model by loading the pre-trained model weights and associated processing components from disk. The paths to these files are specified in the `Config` object.
-        - The `device` attribute is set to the available GPU device if one is available, or to the CPU if not.
+        - The `device` attribute is set to the available GPU device if one is available, or to the CPU if not. The 'int8' and 'onnx' backends always run on the CPU.
+        - Use `python -m RECOGNITION.parity` to measure the accuracy and latency of a backend against 'eager' before switching.
         - The initialized OCR model can be used to recognize handwritten text from images by calling the `recognize()` method of the object, which takes an image file or array as input and returns the recognized text as a string.
 
         """
         try:
+            self.generation = GENERATION if GENERATION is not None else GenerationSettings()
             self.device = torch.device(
                 "cuda" if torch.cuda.is_available() else "cpu")
             self.processor = TrOCRProcessor.from_pretrained(os.path.join(
                 Config.ROOT_DIR.value, 'RECOGNITION', 'model', 'handwritten_best'))
-            self.model = VisionEncoderDecoderModel.from_pretrained(os.path.join(
-                Config.ROOT_DIR.value, 'RECOGNITION', 'model', 'handwritten_best')).to(self.device)
+            self.backend = load_backend(BACKEND, os.path.join(
+                Config.ROOT_DIR.value, 'RECOGNITION', 'model', 'handwritten_best'), self.device)
+            self.device = self.backend.device
+            self.model = self.backend.model
+            if CROP_CACHE_SIZE > 0:
+                self.crop_cache = CropCache(CROP_CACHE_SIZE)
+        except RecognitionInitializationError:
+            raise
         except:
             raise RecognitionInitializationError()
 
-    def recognize(self, image) -> str:
+    def recognize(self, image, settings=None) -> str:
         """
         #### Recognizes handwritten text from an input image using the initialized OCR model.
 
         Arguments:
         - image: A PIL image object or NumPy array representing the input image to be recognized.
+        - settings (GenerationSettings, optional): The decoding settings of this call. Defaults to the settings of the instance.
 
         Returns:
         - recognized_text (str): A string containing the recognized text extracted from the input image.
@@ -55,19 +75,132 @@ class TEXT_RECOGNITION:
         - RecognitionRecognizeError: If an error occurs while recognizing the text, such as an issue with the input image or the OCR model.
 
         Notes:
-        - This function preprocesses the input image using the TrOCRProcessor object to normalize and prepare the image for OCR.
-        - The processed image is then passed through the OCR model to generate a sequence of predicted token IDs, which are decoded back into a string of text using the TrOCRProcessor object.
-        - The recognized text is returned as a string.
-        - If an error occurs during any step of the OCR process, a custom exception, `RecognitionRecognizeError`, is raised.
+        - This function is a single-image shortcut for `recognize_batch_scored()`.
+
+        """
+        return self.recognize_batch_scored([image], 1, settings)[0][0]
+
+    def recognize_batch(self, images, batch_size=8, settings=None) -> list:
+        """
+        #### Recognizes handwritten text from many input images, running the OCR model once per batch instead of once per image.
+
+        Arguments:
+        - images: A list of PIL image objects or NumPy arrays representing the input images to be recognized.
+        - batch_size (int): The maximum number of images passed to a single `generate` call. Default is 8.
+        - settings (GenerationSettings, optional): The decoding settings of this call. Defaults to the settings of the instance.
+
+        Returns:
+        - text_list (list[str]): A list of recognized strings, in the same order as the input images.
+
+        Raises:
+        - RecognitionRecognizeError: If an error occurs while recognizing the text, such as an issue with an input image or the OCR model.
+
+        Notes:
+        - This function returns the texts of `recognize_batch_scored()` without their scores.
+
+        """
+        return self.recognize_batch_scored(images, batch_size, settings)[0]
+
+    def recognize_batch_scored(self, images, batch_size=8, settings=None) -> tuple:
+        """
+        #### Recognizes handwritten text from many input images and returns a confidence score for every line.
+
+        Arguments:
+        - images: A list of PIL image objects or NumPy arrays representing the input images to be recognized.
+        - batch_size (int): The maximum number of images passed to a single `generate` call. Default is 8.
+        - settings (GenerationSettings, optional): The decoding settings of this call. Defaults to the settings of the instance.
+
+        Returns:
+        - A tuple of two lists in the same order as the input images: the recognized strings, and their sequence scores between 0 and 1 (the geometric mean of the token probabilities).
+
+        Raises:
+        - RecognitionRecognizeError: If an error occurs while recognizing the text, such as an issue with an input image or the OCR model.
+
+        Notes:
+        - The TrOCRProcessor resizes and normalizes every image to the same input size, so each batch is stacked into a single padded tensor and decoded with one `generate` call.
+        - Batching amortizes the per-call overhead of the encoder and decoder, which is the dominant cost on CPU-only hosts when a prescription contains many lines.
+        - The token limit of each batch is derived from its widest crop, so short lines do not pay for the library's default length. Crops are batched in order of aspect ratio, so a short line is not decoded for as long as the longest line of the document.
+        - With greedy decoding and an `EARLY_EXIT_SCORE`, lines at or above the score exit after the greedy pass and only the remaining lines are decoded again with `RESCORE_BEAMS` beams, instead of paying for beams on every line.
+        - If the crop cache is enabled, crops whose perceptual hash is already known for the same settings are answered from the cache and only the remaining crops are sent to the model. Cached results are final, including lines that were rescored.
+        - An empty input list returns two empty lists without touching the model.
 
         """
         try:
-            img = image
-            pixel_values = self.processor(
-                images=img, return_tensors="pt", device=self.device).pixel_values.to(self.device)
-            generated_ids = self.model.generate(pixel_values)
-            generated_text = self.processor.batch_decode(
-                generated_ids, skip_special_tokens=True)[0]
-            return generated_text
+            settings = settings if settings is not None else self.generation
+            images = list(images)
+            batch_size = max(1, int(batch_size))
+            text_list = [None] * len(images)
+            score_list = [None] * len(images)
+            keys = [None] * len(images)
+            pending = list(range(len(images)))
+            if self.crop_cache is not None:
+                settings_key = settings.key()
+                keys = [self.crop_cache.key(image) for image in images]
+                pending = []
+                for index, key in enumerate(keys):
+                    cached = self.crop_cache.get(key, settings_key)
+                    if cached is None:
+                        pending.append(index)
+                    else:
+                        text_list[index], score_list[index] = cached
+
+            pending.sort(key=lambda index: aspect(images[index]))
+            for start in range(0, len(pending), batch_size):
+                batch = pending[start:start + batch_size]
+                texts, scores = self._generate(
+                    [images[index] for index in batch], settings, settings.NUM_BEAMS)
+                for index, text, score in zip(batch, texts, scores):
+                    text_list[index] = text
+                    score_list[index] = score
+
+            if settings.NUM_BEAMS == 1 and settings.EARLY_EXIT_SCORE > 0 and settings.RESCORE_BEAMS > 1:
+                rescore = [index for index in pending
+                           if score_list[index] < settings.EARLY_EXIT_SCORE]
+                for start in range(0, len(rescore), batch_size):
+                    batch = rescore[start:start + batch_size]
+                    texts, scores = self._generate(
+                        [images[index] for index in batch], settings, settings.RESCORE_BEAMS)
+                    for index, text, score in zip(batch, texts, scores):
+                        text_list[index] = text
+                        score_list[index] = score
+
+            if self.crop_cache is not None:
+                for index in pending:
+                    self.crop_cache.put(
+                        keys[index], (text_list[index], score_list[index]), settings_key)
+            return (text_list, score_list)
         except:
             raise RecognitionRecognizeError()
+
+    def _generate(self, images: list, settings: GenerationSettings, num_beams: int) -> tuple:
+        pixel_values = self.processor(
+            images=images, return_tensors="pt").pixel_values.to(self.device)
+        output = self.backend.generate(
+            pixel_values,
+            num_beams=num_beams,
+            early_stopping=num_beams > 1,
+            max_new_tokens=settings.maxNewTokens(images),
+            output_scores=True,
+            return_dict_in_generate=True)
+        texts = self.processor.batch_decode(
+            output.sequences, skip_special_tokens=True)
+        if num_beams > 1:
+            scores = output.sequences_scores.float().exp().tolist()
+        else:
+            scores = self._greedyScores(output)
+        return (texts, scores)
+
+    def _greedyScores(self, output) -> list:
+        pad_token_id = self.processor.tokenizer.pad_token_id
+        steps = len(output.scores)
+        tokens = output.sequences[:, -steps:]
+        total = torch.zeros(tokens.shape[0])
+        count = torch.zeros(tokens.shape[0])
+        for step, step_scores in enumerate(output.scores):
+            token = tokens[:, step]
+            log_probs = torch.log_softmax(step_scores.float(), dim=-1).gather(
+                -1, token.unsqueeze(-1)).squeeze(-1).cpu()
+            mask = (token != pad_token_id).float().cpu()
+            total += log_probs * mask
+            count += mask
+        return (total / count.clamp(min=1)).exp().tolist()
@@ -0,0 +1,289 @@
+import time
+import queue
+import itertools
+import threading
+from collections import deque
+from error import RecognitionRecognizeError
+from METRICS.metrics import STAGE_SECONDS, RECOGNITION_BATCH_SIZE
+
+
+class RecognitionJob:
+    """
+    #### Handle for the crops of one document submitted to the `RECOGNITION_SCHEDULER`.
+    """
+
+    def __init__(self, size: int) -> None:
+        self.size = size
+        self.texts = [None] * size
+        self.scores = [None] * size
+        self.error = None
+        self._remaining = size
+        self._chunks = queue.Queue()
+        self._done = threading.Event()
+        if size == 0:
+            self._done.set()
+
+    def _deliver(self, indices: list, texts: list, scores: list) -> None:
+        for index, text, score in zip(indices, texts, scores):
+            self.texts[index] = text
+            self.scores[index] = score
+        self._remaining -= len(indices)
+        self._chunks.put(list(zip(indices, texts, scores)))
+        if self._remaining <= 0:
+            self._done.set()
+
+    def _fail(self, error: Exception) -> None:
+        if self._done.is_set():
+            return
+        self.error = error
+        self._chunks.put(None)
+        self._done.set()
+
+    def __iter__(self):
+        """
+        #### Yields the recognition results of this job as they are produced.
+
+        Returns:
+        - A generator of lists of `(index, text, score)` tuples, one list per scheduler batch that contained crops of this job.
+
+        Raises:
+        - RecognitionRecognizeError: If one of this job's crops could not be recognized.
+
+        Notes:
+        - Crops are queued in FIFO order, so indices arrive in ascending order.
+        """
+        received = 0
+        while received < self.size:
+            chunk = self._chunks.get()
+            if chunk is None:
+                raise self.error
+            received += len(chunk)
+            yield chunk
+
+    def wait(self, timeout=None) -> bool:
+        """
+        #### Blocks until every crop of this job is recognized or failed, or until `timeout` seconds have passed.
+
+        Returns:
+        - True if the job finished, False on timeout. Crops finished so far can be read from `texts` and `scores`, where pending crops are None.
+        """
+        return self._done.wait(timeout)
+
+    def result(self, timeout=None) -> list:
+        """
+        #### Blocks until every crop of this job is recognized and returns the texts in input order.
+
+        Arguments:
+        - timeout (float, optional): The maximum number of seconds to wait. Default waits forever.
+
+        Returns:
+        - text_list (list[str]): The recognized strings, in the same order as the submitted images.
+
+        Raises:
+        - RecognitionRecognizeError: If the job failed or did not finish within `timeout`.
+        """
+        if not self._done.wait(timeout):
+            raise RecognitionRecognizeError("RECOGNITION TIMEOUT")
+        if self.error is not None:
+            raise self.error
+        return list(self.texts)
+
+
+class RECOGNITION_SCHEDULER:
+    """
+    #### Dynamic batching scheduler that groups crops from many in-flight documents into micro-batches for one `TEXT_RECOGNITION` model.
+    """
+    _recent_waits = 1024
+
+    def __init__(self, recognizer, max_batch_size=8, max_wait_ms=20) -> None:
+        """
+        #### Starts the scheduler thread in front of a recognizer.
+
+        Arguments:
+        - recognizer: A `TEXT_RECOGNITION` instance exposing `recognize_batch_scored()`.
+        - max_batch_size (int): The maximum number of crops sent to one `recognize_batch_scored()` call. Default is 8.
+        - max_wait_ms (float): The maximum time in milliseconds the oldest queued crop waits for a batch to fill up. Default is 20.
+
+        Notes:
+        - A batch is dispatched as soon as it is full or its oldest crop has waited `max_wait_ms`, whichever comes first. Under light load this adds at most `max_wait_ms` to a request; under heavy load batches fill immediately.
+        - Only the scheduler thread calls the recognizer, so the model is never used concurrently.
+        - Crops with different decoding settings can share a batch window, but they are sent to the recognizer in separate calls.
+        - If a call fails, the crops of each document in it are recognized again on their own, so only the documents whose crops fail by themselves are failed.
+        - Crops are queued by priority first and submission order second. A batch takes the most urgent crops waiting, so interactive documents overtake queued bulk documents instead of waiting behind them. Under sustained interactive load, bulk crops wait until it eases.
+        """
+        self.recognizer = recognizer
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, float(max_wait_ms)) / 1000
+        self._queue = queue.PriorityQueue()
+        self._sequence = itertools.count()
+        self._lock = threading.Lock()
+        self._batch_count = 0
+        self._item_count = 0
+        self._error_count = 0
+        self._max_queue_depth = 0
+        self._batch_size_histogram = {}
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+        self._waits = deque(maxlen=self._recent_waits)
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def submit(self, images, settings=None, priority=0) -> RecognitionJob:
+        """
+        #### Queues the crops of one document for recognition.
+
+        Arguments:
+        - images: A list of PIL image objects or NumPy arrays representing the crops of one document.
+        - settings (GenerationSettings, optional): The decoding settings of this document. Defaults to the settings of the recognizer.
+        - priority (int, optional): The priority class of this document, see `ACCESS.apiKeys`. Lower values are recognized first. Defaults to 0, the interactive class.
+
+        Returns:
+        - A `RecognitionJob` that yields results as batches complete and collects them in input order.
+        """
+        images = list(images)
+        job = RecognitionJob(len(images))
+        now = time.monotonic()
+        for index, image in enumerate(images):
+            self._queue.put((priority, next(self._sequence),
+                            (job, index, image, now, settings)))
+        with self._lock:
+            self._max_queue_depth = max(
+                self._max_queue_depth, self._queue.qsize())
+        return job
+
+    def queueDepth(self) -> int:
+        """
+        #### Returns the number of crops waiting to be batched.
+        """
+        return self._queue.qsize()
+
+    def shutdown(self) -> None:
+        """
+        #### Stops the scheduler thread after the crops already queued have been processed.
+        """
+        self._queue.put((float("inf"), next(self._sequence), None))
+        self._thread.join()
+
+    def _collect(self, first) -> list:
+        batch = [first]
+        deadline = first[3] + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                entry = self._queue.get(timeout=remaining) if remaining > 0 \
+                    else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if entry[2] is None:
+                self._queue.put(entry)
+                break
+            batch.append(entry[2])
+        return batch
+
+    def _run(self) -> None:
+        while True:
+            first = self._queue.get()[2]
+            if first is None:
+                return
+            batch = self._collect(first)
+            self._record(batch, time.monotonic())
+            groups = {}
+            for item in batch:
+                key = item[4].key() if item[4] is not None else None
+                groups.setdefault(key, []).append(item)
+            for group in groups.values():
+                self._recognize(group)
+
+    def _recognize(self, group: list) -> None:
+        RECOGNITION_BATCH_SIZE.observe(len(group))
+        try:
+            texts, scores = self._call(group)
+        except Exception as e:
+            self._countError()
+            by_job = {}
+            for item in group:
+                by_job.setdefault(id(item[0]), []).append(item)
+            if len(by_job) == 1:
+                self._fail(group, e)
+                return
+            # One bad crop must not fail the other documents it was batched with
+            for items in by_job.values():
+                try:
+                    texts, scores = self._call(items)
+                except Exception as e:
+                    self._countError()
+                    self._fail(items, e)
+                else:
+                    self._deliver(items, texts, scores)
+            return
+        self._deliver(group, texts, scores)
+
+    def _call(self, items: list) -> tuple:
+        with STAGE_SECONDS.time(stage="recognize"):
+            return self.recognizer.recognize_batch_scored(
+                [item[2] for item in items], self.max_batch_size, items[0][4])
+
+    def _countError(self) -> None:
+        with self._lock:
+            self._error_count += 1
+
+    def _fail(self, items: list, e: Exception) -> None:
+        error = e if isinstance(
+            e, RecognitionRecognizeError) else RecognitionRecognizeError()
+        for item in items:
+            item[0]._fail(error)
+
+    def _deliver(self, items: list, texts: list, scores: list) -> None:
+        by_job = {}
+        for (job, index, _, _, _), text, score in zip(items, texts, scores):
+            entry = by_job.setdefault(id(job), (job, [], [], []))
+            entry[1].append(index)
+            entry[2].append(text)
+            entry[3].append(score)
+        for job, indices, job_texts, job_scores in by_job.values():
+            job._deliver(indices, job_texts, job_scores)
+
+    def _record(self, batch: list, started: float) -> None:
+        with self._lock:
+            self._batch_count += 1
+            self._item_count += len(batch)
+            size = len(batch)
+            self._batch_size_histogram[size] = self._batch_size_histogram.get(
+                size, 0) + 1
+            for item in batch:
+                wait = started - item[3]
+                self._wait_total += wait
+                self._wait_max = max(self._wait_max, wait)
+                self._waits.append(wait)
+
+    def stats(self) -> dict:
+        """
+        #### Returns scheduler statistics for tuning `max_batch_size` and `max_wait_ms` under load.
+
+        Returns:
+        - A dictionary with the current and maximum queue depth, the number of batches, crops and failed recognizer calls, a histogram of batch sizes and the queue wait time of crops in milliseconds (mean and maximum over all crops, p50 and p95 over the most recent crops).
+        """
+        with self._lock:
+            waits = sorted(self._waits)
+
+            def percentile(p):
+                if not waits:
+                    return 0.0
+                return waits[min(len(waits) - 1, int(p * len(waits)))] * 1000
+
+            return {
+                "queue_depth": self._queue.qsize(),
+                "max_queue_depth": self._max_queue_depth,
+                "max_batch_size": self.max_batch_size,
+                "max_wait_ms": self.max_wait * 1000,
+                "batches": self._batch_count,
+                "items": self._item_count,
+                "errors": self._error_count,
+                "batch_size_histogram": dict(sorted(self._batch_size_histogram.items())),
+                "wait_ms": {
+                    "mean": (self._wait_total / self._item_count * 1000) if self._item_count else 0.0,
+                    "max": self._wait_max * 1000,
+                    "p50": percentile(0.50),
+                    "p95": percentile(0.95)
+                }
+            }
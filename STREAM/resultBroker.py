@@ -0,0 +1,153 @@
+import time
+import asyncio
+import threading
+
+
+class ResultBroker:
+    retention = 0
+    timeout = 0
+
+    LINE = "line"
+    DONE = "done"
+    ERROR = "error"
+
+    def __init__(self, RETENTION=300, TIMEOUT=600) -> None:
+        """
+        #### Initializes an in-process broker that pushes recognition results to streaming clients as they are produced.
+
+        Arguments:
+        - RETENTION (float, optional): The number of seconds a finished document stays available, so clients that connect late still receive every line. Defaults to 300.
+        - TIMEOUT (float, optional): The number of seconds an opened document may stay unfinished. After that an `error` event is published and its retention period starts, so a document whose job never reports back, e.g. because it was taken over by another process, neither blocks its clients nor stays in memory forever. Defaults to 600. A value of 0 disables it.
+
+        Notes:
+        - Recognition workers publish from their own threads. Each subscriber owns an asyncio queue on its event loop, and events are handed over with `call_soon_threadsafe`.
+        - Every event of a document is kept until it expires, and a new subscriber first receives the events published so far. A client may therefore connect at any time after receiving the `documentID`.
+        - The broker only knows the documents of its own process. Clients of a multi-process deployment must reach the process that accepted the upload, or read Firestore.
+        - Expiry is checked whenever the broker is used; call `isOpen()` to check it explicitly.
+        """
+        self.retention = float(RETENTION)
+        self.timeout = max(0.0, float(TIMEOUT))
+        self._lock = threading.Lock()
+        self._documents = {}
+
+    def open(self, documentId: str, XYXY_LIST: list, CONFIDENCE_LIST=None) -> None:
+        """
+        #### Registers a document before its recognition starts. Calling it again for a known document does nothing.
+
+        Arguments:
+        - documentId (str): The ID of the document.
+        - XYXY_LIST (list[list[float]]): The bounding boxes of the document, in box order.
+        - CONFIDENCE_LIST (list[float], optional): The detection confidence of each box.
+        """
+        with self._lock:
+            self._expire()
+            if documentId in self._documents:
+                return
+            self._documents[documentId] = {
+                "boxes": XYXY_LIST,
+                "confidences": CONFIDENCE_LIST,
+                "events": [],
+                "subscribers": [],
+                "opened": time.monotonic(),
+                "finished": None
+            }
+
+    def isOpen(self, documentId: str) -> bool:
+        with self._lock:
+            self._expire()
+            return documentId in self._documents
+
+    def publishLines(self, documentId: str, lines: list) -> None:
+        """
+        #### Publishes recognized lines of a document.
+
+        Arguments:
+        - documentId (str): The ID of the document.
+        - lines (list[tuple]): `(index, text, score)` tuples as yielded by a `RecognitionJob`.
+        """
+        with self._lock:
+            document = self._documents.get(documentId)
+            if document is None:
+                return
+            for index, text, score in lines:
+                self._publish(document, {
+                    "event": self.LINE,
+                    "index": index,
+                    "text": text,
+                    "score": score,
+                    "box": document["boxes"][index] if index < len(document["boxes"]) else None,
+                    "confidence": document["confidences"][index] if document["confidences"] is not None and index < len(document["confidences"]) else None
+                })
+
+    def close(self, documentId: str, error=None) -> None:
+        """
+        #### Publishes the final event of a document and starts its retention period.
+
+        Arguments:
+        - documentId (str): The ID of the document.
+        - error (str, optional): The error message if recognition failed.
+        """
+        with self._lock:
+            document = self._documents.get(documentId)
+            if document is None or document["finished"] is not None:
+                return
+            if error is None:
+                self._publish(document, {"event": self.DONE})
+            else:
+                self._publish(
+                    document, {"event": self.ERROR, "error": error})
+            document["finished"] = time.monotonic()
+
+    def subscribe(self, documentId: str):
+        """
+        #### Subscribes the running event loop to the events of a document.
+
+        Arguments:
+        - documentId (str): The ID of the document.
+
+        Returns:
+        - An asyncio.Queue that receives every event published so far followed by new ones, or None if the document is unknown.
+
+        Notes:
+        - Must be called from a coroutine. Call `unsubscribe()` when the client disconnects.
+        """
+        loop = asyncio.get_running_loop()
+        events = asyncio.Queue()
+        with self._lock:
+            self._expire()
+            document = self._documents.get(documentId)
+            if document is None:
+                return None
+            for event in document["events"]:
+                events.put_nowait(event)
+            document["subscribers"].append((loop, events))
+        return events
+
+    def unsubscribe(self, documentId: str, events) -> None:
+        with self._lock:
+            document = self._documents.get(documentId)
+            if document is None:
+                return
+            document["subscribers"] = [
+                subscriber for subscriber in document["subscribers"] if subscriber[1] is not events]
+
+    def _publish(self, document: dict, event: dict) -> None:
+        document["events"].append(event)
+        for loop, events in document["subscribers"]:
+            try:
+                loop.call_soon_threadsafe(events.put_nowait, event)
+            except RuntimeError:
+                pass
+
+    def _expire(self) -> None:
+        now = time.monotonic()
+        if self.timeout > 0:
+            for document in self._documents.values():
+                if document["finished"] is None and now - document["opened"] > self.timeout:
+                    self._publish(
+                        document, {"event": self.ERROR, "error": "STREAM TIMED OUT"})
+                    document["finished"] = now
+        expired = [documentId for documentId, document in self._documents.items()
+                   if document["finished"] is not None and now - document["finished"] > self.retention]
+        for documentId in expired:
+            del self._documents[documentId]
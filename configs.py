@@ -10,6 +10,7 @@ class Config(Enum):
     CONF_LIST = "CONFIDENCE_LIST"
     CROP_IMG = "CROPPED_IMG_LIST"
     CROP_XYXY = "CROPPED_XYXY_LIST"
+    TIMINGS = "TIMINGS"
     ROOT_DIR = os.path.realpath(os.path.join(os.path.dirname(__file__)))
     FIREBASE_KEY = auto()
     FIREBASE_DATABASE_URL = "databaseURL"
@@ -18,5 +19,53 @@ class Config(Enum):
     API_KEY = auto()
     REDIRECT_URL = auto()
     CORS_ORIGINS = auto()
-    TEMP_IMG = "temp"
     DETECT_CONFIDENCE = auto()
+    RECOGNITION_BATCH_SIZE = auto()
+    RECOGNITION_MAX_WAIT_MS = auto()
+    MAX_CONCURRENT_REQUESTS = auto()
+    DETECT_WORKERS = auto()
+    UPLOAD_JPEG_QUALITY = auto()
+    UPLOAD_MAX_DIMENSION = auto()
+    OVERLAY_QUEUE_MAX = auto()
+    FIRESTORE_FLUSH_COUNT = auto()
+    FIRESTORE_FLUSH_INTERVAL_MS = auto()
+    JOB_QUEUE_PATH = auto()
+    JOB_QUEUE_MAX_PENDING = auto()
+    JOB_QUEUE_LEASE_S = auto()
+    JOB_QUEUE_RETENTION_S = auto()
+    RECOGNITION_WORKERS = auto()
+    RESULT_CACHE_SIZE = auto()
+    RESULT_CACHE_TTL_S = auto()
+    RESULT_CACHE_DIR = auto()
+    CROP_CACHE_SIZE = auto()
+    RECOGNITION_BACKEND = auto()
+    GENERATION_NUM_BEAMS = auto()
+    GENERATION_MAX_NEW_TOKENS = auto()
+    GENERATION_TOKENS_PER_ASPECT = auto()
+    GENERATION_EARLY_EXIT_SCORE = auto()
+    GENERATION_RESCORE_BEAMS = auto()
+    FIRESTORE_SINK = auto()
+    STREAM_RETENTION_S = auto()
+    STREAM_TIMEOUT_S = auto()
+    EXTRACT_DEFAULT_DEADLINE_MS = auto()
+    EXTRACT_MAX_DEADLINE_MS = auto()
+    DETECT_BATCH_SIZE = auto()
+    BATCH_MAX_IMAGES = auto()
+    BATCH_MAX_BYTES = auto()
+    DETECT_MAX_SIDE = auto()
+    MAX_UPLOAD_BYTES = auto()
+    MAX_IMAGE_PIXELS = auto()
+    MODEL_LOAD_MODE = auto()
+    MODEL_WARMUP = auto()
+    INFERENCE_MODE = auto()
+    INFERENCE_ADDRESS = auto()
+    INFERENCE_AUTHKEY = auto()
+    TRACING = auto()
+    STORAGE_BACKEND = auto()
+    STORAGE_DIR = auto()
+    FIREBASE_POOL_SIZE = auto()
+    LINE_LAYOUT = auto()
+    LINE_MERGE_GAP = auto()
+    LINE_MIN_HEIGHT_RATIO = auto()
+    API_KEYS = auto()
+    BULK_SHARE = auto()
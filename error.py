@@ -66,3 +66,64 @@ class RecognitionRecognizeError(Exception):
     def __init__(self, message="RECOGNITION MODEL RECOGNIZE ERROR") -> None:
         self.message = message
         super().__init__(self.message)
+
+
+class ServerBusyError(Exception):
+
+    def __init__(self, message="SERVER BUSY", retry_after=1) -> None:
+        self.message = message
+        self.retry_after = retry_after
+        super().__init__(self.message)
+
+
+class JobQueueError(Exception):
+
+    def __init__(self, message="JOB QUEUE ERROR") -> None:
+        self.message = message
+        super().__init__(self.message)
+
+
+class JobQueueFullError(Exception):
+
+    def __init__(self, message="RECOGNITION QUEUE FULL", retry_after=5) -> None:
+        self.message = message
+        self.retry_after = retry_after
+        super().__init__(self.message)
+
+
+class BatchTooLargeError(Exception):
+
+    def __init__(self, message="TOO MANY IMAGES IN BATCH") -> None:
+        self.message = message
+        super().__init__(self.message)
+
+
+class UploadTooLargeError(Exception):
+
+    def __init__(self, message="UPLOAD TOO LARGE") -> None:
+        self.message = message
+        super().__init__(self.message)
+
+
+class InferenceServerError(Exception):
+
+    def __init__(self, message="INFERENCE SERVER UNAVAILABLE", retry_after=5) -> None:
+        self.message = message
+        self.retry_after = retry_after
+        super().__init__(self.message)
+
+
+class RateLimitError(Exception):
+
+    def __init__(self, message="RATE LIMIT EXCEEDED", retry_after=1) -> None:
+        self.message = message
+        self.retry_after = retry_after
+        super().__init__(self.message)
+
+
+class QuotaExceededError(Exception):
+
+    def __init__(self, message="QUOTA EXCEEDED", retry_after=3600) -> None:
+        self.message = message
+        self.retry_after = retry_after
+        super().__init__(self.message)
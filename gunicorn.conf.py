@@ -0,0 +1,21 @@
+"""
+#### Gunicorn settings for serving `main:app`.
+
+Run with `gunicorn -c gunicorn.conf.py main:app`.
+
+Notes:
+- With `MODEL_LOAD_MODE=prefork`, the app is imported once in the master, which loads the model weights before forking. Workers share the weights copy-on-write instead of each loading a private copy. Firebase, the job queue and every thread are still started per worker, in the FastAPI lifespan hook.
+- With `lazy` or `eager`, each worker imports the app itself, as with a plain gunicorn command line.
+"""
+import os
+from dotenv import load_dotenv
+from configs import Config
+
+load_dotenv(".env.development")
+
+bind = os.environ.get("BIND", "0.0.0.0:8000")
+workers = int(os.environ.get("WEB_CONCURRENCY", 1))
+worker_class = "uvicorn.workers.UvicornWorker"
+preload_app = os.environ.get(
+    str(Config.MODEL_LOAD_MODE.name), "eager").lower() == "prefork"
+timeout = 120
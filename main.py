@@ -1,47 +1,362 @@
 from io import BytesIO
 import os
+import time
+import uuid
+import asyncio
+import zipfile
+from typing import List
 import json
 import base64
+import gc
 import threading
-from model import ResponseModel
+from contextlib import asynccontextmanager
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from model import ResponseModel, JobStatusModel, LineModel, ExtractResponseModel, BatchItemModel, BatchResponseModel
 from PIL import Image
-from fastapi import FastAPI, Security, HTTPException, status, File, Depends
+from fastapi import FastAPI, Security, HTTPException, status, File, Depends, UploadFile, Request
 from fastapi.security import APIKeyHeader
-from fastapi.responses import RedirectResponse, HTMLResponse, JSONResponse
-from fastapi.security.api_key import APIKey
+from fastapi.responses import RedirectResponse, HTMLResponse, JSONResponse, StreamingResponse, PlainTextResponse
 from fastapi.encoders import jsonable_encoder
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.openapi.docs import get_swagger_ui_html
 from fastapi.openapi.utils import get_openapi
 from dotenv import load_dotenv
-from DETECTION.detection import TEXT_DETECTION
-from RECOGNITION.recognition import TEXT_RECOGNITION
-from FIREBASE.firebaseIO import FirebaseIO
+from DETECTION.layout import LineLayout
+from DETECTION.boxes import crop_boxes, render_boxes
+from RECOGNITION.generation import GenerationSettings
+from RECOGNITION.scheduler import RECOGNITION_SCHEDULER
+from INFERENCE.transport import EXPORT_METRICS
+from INFERENCE.client import InferenceClient, RemoteDetectionPool, RemoteRecognition, RemoteRecognitionScheduler
+from METRICS import tracing
+from METRICS.metrics import CONTENT_TYPE, REQUEST_SECONDS, Counter, Gauge, render as renderMetrics, observe_timings, observe_detection, count_error
+from FIREBASE.firebaseIO import FirebaseIO, CoalescedWriter
+from FIREBASE.localStore import LocalFirebaseIO
+from JOBS.jobQueue import JobQueue, JobWorkerPool
+from JOBS.priorityExecutor import PriorityExecutor
+from ACCESS.apiKeys import ApiKey, ApiKeyRegistry, BULK
+from CACHE.resultCache import ResultCache
+from STREAM.resultBroker import ResultBroker
+from PREPROCESS.preprocess import prepare, decode
 from configs import Config
 from error import *
 
 load_dotenv(".env.development")
 API_KEY: str = os.environ.get(str(Config.API_KEY.name))
+API_KEYS: str = os.environ.get(str(Config.API_KEYS.name))
 REDIRECT_URL: str = os.environ.get(str(Config.REDIRECT_URL.name))
 CORS_ORIGINS: str = os.environ.get(str(Config.CORS_ORIGINS.name))
 FIREBASE_DATABASE_URL: str = os.environ.get(
     str(Config.FIREBASE_DATABASE_URL.name))
 FIREBASE_STORAGE_BUCKET_URL: str = os.environ.get(
     str(Config.FIREBASE_STORAGE_BUCKET_URL.name))
-FIREBASE_KEY_ENCODED: str = os.environ.get(str(Config.FIREBASE_KEY.name))
-FIREBASE_KEY_DECODED = base64.b64decode(FIREBASE_KEY_ENCODED).decode('UTF-8')
-FIREBASE_KEY_JSON = json.loads(FIREBASE_KEY_DECODED)
+STORAGE_BACKEND: str = os.environ.get(
+    str(Config.STORAGE_BACKEND.name), "firebase").lower()
+STORAGE_DIR: str = os.environ.get(str(Config.STORAGE_DIR.name), os.path.join(
+    Config.ROOT_DIR.value, "storage"))
+FIREBASE_POOL_SIZE: int = int(
+    os.environ.get(str(Config.FIREBASE_POOL_SIZE.name), 32))
+FIREBASE_KEY_JSON = None
+if STORAGE_BACKEND == "firebase":
+    FIREBASE_KEY_ENCODED: str = os.environ.get(str(Config.FIREBASE_KEY.name))
+    FIREBASE_KEY_DECODED = base64.b64decode(
+        FIREBASE_KEY_ENCODED).decode('UTF-8')
+    FIREBASE_KEY_JSON = json.loads(FIREBASE_KEY_DECODED)
 DETECT_CONFIDENCE: float = float(
-    os.environ.get(str(Config.DETECT_CONFIDENCE.name)))
+    os.environ.get(str(Config.DETECT_CONFIDENCE.name), 0.5))
+RECOGNITION_BATCH_SIZE: int = int(
+    os.environ.get(str(Config.RECOGNITION_BATCH_SIZE.name), 8))
+RECOGNITION_MAX_WAIT_MS: float = float(
+    os.environ.get(str(Config.RECOGNITION_MAX_WAIT_MS.name), 20))
+MAX_CONCURRENT_REQUESTS: int = int(
+    os.environ.get(str(Config.MAX_CONCURRENT_REQUESTS.name), 8))
+DETECT_WORKERS: int = int(
+    os.environ.get(str(Config.DETECT_WORKERS.name), 1))
+UPLOAD_JPEG_QUALITY: int = int(
+    os.environ.get(str(Config.UPLOAD_JPEG_QUALITY.name), 90))
+UPLOAD_MAX_DIMENSION: int = int(
+    os.environ.get(str(Config.UPLOAD_MAX_DIMENSION.name), 0))
+OVERLAY_QUEUE_MAX: int = int(
+    os.environ.get(str(Config.OVERLAY_QUEUE_MAX.name), 32))
+FIRESTORE_FLUSH_COUNT: int = int(
+    os.environ.get(str(Config.FIRESTORE_FLUSH_COUNT.name), 8))
+FIRESTORE_FLUSH_INTERVAL_MS: float = float(
+    os.environ.get(str(Config.FIRESTORE_FLUSH_INTERVAL_MS.name), 1000))
+JOB_QUEUE_PATH: str = os.environ.get(str(Config.JOB_QUEUE_PATH.name), os.path.join(
+    Config.ROOT_DIR.value, "jobs.sqlite3"))
+JOB_QUEUE_MAX_PENDING: int = int(
+    os.environ.get(str(Config.JOB_QUEUE_MAX_PENDING.name), 100))
+JOB_QUEUE_LEASE_S: float = float(
+    os.environ.get(str(Config.JOB_QUEUE_LEASE_S.name), 30))
+JOB_QUEUE_RETENTION_S: float = float(
+    os.environ.get(str(Config.JOB_QUEUE_RETENTION_S.name), 86400))
+RECOGNITION_WORKERS: int = int(
+    os.environ.get(str(Config.RECOGNITION_WORKERS.name), 4))
+RESULT_CACHE_SIZE: int = int(
+    os.environ.get(str(Config.RESULT_CACHE_SIZE.name), 256))
+RESULT_CACHE_TTL_S: float = float(
+    os.environ.get(str(Config.RESULT_CACHE_TTL_S.name), 3600))
+RESULT_CACHE_DIR: str = os.environ.get(str(Config.RESULT_CACHE_DIR.name))
+CROP_CACHE_SIZE: int = int(
+    os.environ.get(str(Config.CROP_CACHE_SIZE.name), 0))
+RECOGNITION_BACKEND: str = os.environ.get(
+    str(Config.RECOGNITION_BACKEND.name), "eager")
+GENERATION_NUM_BEAMS: int = int(
+    os.environ.get(str(Config.GENERATION_NUM_BEAMS.name), 1))
+GENERATION_MAX_NEW_TOKENS: int = int(
+    os.environ.get(str(Config.GENERATION_MAX_NEW_TOKENS.name), 48))
+GENERATION_TOKENS_PER_ASPECT: float = float(
+    os.environ.get(str(Config.GENERATION_TOKENS_PER_ASPECT.name), 1.0))
+GENERATION_EARLY_EXIT_SCORE: float = float(
+    os.environ.get(str(Config.GENERATION_EARLY_EXIT_SCORE.name), 0.0))
+GENERATION_RESCORE_BEAMS: int = int(
+    os.environ.get(str(Config.GENERATION_RESCORE_BEAMS.name), 4))
+FIRESTORE_SINK: bool = os.environ.get(
+    str(Config.FIRESTORE_SINK.name), "true").lower() not in ("0", "false", "no")
+STREAM_RETENTION_S: float = float(
+    os.environ.get(str(Config.STREAM_RETENTION_S.name), 300))
+STREAM_TIMEOUT_S: float = float(
+    os.environ.get(str(Config.STREAM_TIMEOUT_S.name), 600))
+EXTRACT_DEFAULT_DEADLINE_MS: float = float(
+    os.environ.get(str(Config.EXTRACT_DEFAULT_DEADLINE_MS.name), 5000))
+EXTRACT_MAX_DEADLINE_MS: float = float(
+    os.environ.get(str(Config.EXTRACT_MAX_DEADLINE_MS.name), 30000))
+DETECT_BATCH_SIZE: int = max(1, int(
+    os.environ.get(str(Config.DETECT_BATCH_SIZE.name), 8)))
+BATCH_MAX_IMAGES: int = int(
+    os.environ.get(str(Config.BATCH_MAX_IMAGES.name), 100))
+BATCH_MAX_BYTES: int = int(
+    os.environ.get(str(Config.BATCH_MAX_BYTES.name), 200000000))
+DETECT_MAX_SIDE: int = int(
+    os.environ.get(str(Config.DETECT_MAX_SIDE.name), 1280))
+MAX_UPLOAD_BYTES: int = int(
+    os.environ.get(str(Config.MAX_UPLOAD_BYTES.name), 20000000))
+MAX_IMAGE_PIXELS: int = int(
+    os.environ.get(str(Config.MAX_IMAGE_PIXELS.name), 50000000))
+MODEL_LOAD_MODE: str = os.environ.get(
+    str(Config.MODEL_LOAD_MODE.name), "eager").lower()
+MODEL_WARMUP: bool = os.environ.get(
+    str(Config.MODEL_WARMUP.name), "true").lower() not in ("0", "false", "no")
+INFERENCE_MODE: str = os.environ.get(
+    str(Config.INFERENCE_MODE.name), "local").lower()
+INFERENCE_ADDRESS: str = os.environ.get(str(Config.INFERENCE_ADDRESS.name), os.path.join(
+    Config.ROOT_DIR.value, "inference.sock"))
+INFERENCE_AUTHKEY: bytes = os.environ.get(
+    str(Config.INFERENCE_AUTHKEY.name), "").encode()
+TRACING: bool = os.environ.get(
+    str(Config.TRACING.name), "false").lower() in ("1", "true", "yes")
+BULK_SHARE: float = min(1.0, max(0.0, float(
+    os.environ.get(str(Config.BULK_SHARE.name), 0.5))))
+LINE_LAYOUT: bool = os.environ.get(
+    str(Config.LINE_LAYOUT.name), "true").lower() not in ("0", "false", "no")
+LINE_MERGE_GAP: float = float(
+    os.environ.get(str(Config.LINE_MERGE_GAP.name), 1.0))
+LINE_MIN_HEIGHT_RATIO: float = float(
+    os.environ.get(str(Config.LINE_MIN_HEIGHT_RATIO.name), 0.3))
 
 api_key_header = APIKeyHeader(name="x-api-key", auto_error=False)
 
-detection_model = TEXT_DETECTION()
-recognition_model = TEXT_RECOGNITION()
-fb = FirebaseIO(FIREBASE_KEY_JSON, FIREBASE_DATABASE_URL,
-                FIREBASE_STORAGE_BUCKET_URL)
+detection_model = None
+recognition_model = None
+recognition_scheduler = None
+fb = None
+job_queue = None
+recognition_workers = None
+inference_client = InferenceClient(
+    INFERENCE_ADDRESS, INFERENCE_AUTHKEY) if INFERENCE_MODE == "remote" else None
+detection_executor = PriorityExecutor(max(1, DETECT_WORKERS))
+background_executor = ThreadPoolExecutor(max_workers=RECOGNITION_WORKERS)
+OVERLAY_WORKERS = 2
+overlay_executor = ThreadPoolExecutor(max_workers=OVERLAY_WORKERS)
+overlay_lock = threading.Lock()
+overlays_pending = 0
+inflight_requests = 0
+inflight_bulk = 0
+BULK_MAX_CONCURRENT_REQUESTS = min(MAX_CONCURRENT_REQUESTS - 1,
+                                   max(1, int(MAX_CONCURRENT_REQUESTS * BULK_SHARE)))
+STREAM_KEEPALIVE_S = 15
+result_broker = ResultBroker(STREAM_RETENTION_S, STREAM_TIMEOUT_S)
+result_cache = ResultCache(RESULT_CACHE_SIZE, RESULT_CACHE_TTL_S,
+                           RESULT_CACHE_DIR) if RESULT_CACHE_SIZE > 0 else None
+LOADING = "loading"
+READY = "ready"
+FAILED = "failed"
+load_state = {"status": LOADING, "error": None, "seconds": None}
+tracing.configure(TRACING)
+Gauge("prescription_inflight_requests",
+      "Uploads being detected right now.", lambda: inflight_requests)
+Gauge("prescription_inflight_bulk_requests",
+      "Uploads of bulk API keys being detected right now.", lambda: inflight_bulk)
+Gauge("prescription_detection_queue_depth",
+      "Detections waiting for a free detector of this process.", detection_executor.queueDepth)
+Gauge("prescription_recognition_queue_depth",
+      "Crops waiting for the recognition scheduler of this process.", lambda: recognition_scheduler.queueDepth())
+Gauge("prescription_job_queue_pending",
+      "Recognition jobs queued or running.", lambda: job_queue.pendingCount())
+Gauge("prescription_overlay_queue_depth",
+      "Overlays queued or being rendered and uploaded.", lambda: overlays_pending)
+OVERLAYS_SKIPPED = Counter(
+    "prescription_overlays_skipped_total", "Overlays skipped because OVERLAY_QUEUE_MAX overlays were pending.")
+Gauge("prescription_threads",
+      "Threads alive in this process, including executor, scheduler and recognition worker threads.", threading.active_count)
 
-app = FastAPI(redoc_url=None, docs_url=None)
+
+def loadModels() -> None:
+    """
+    #### Loads the detection and recognition weights into the module globals, if they are not loaded yet.
+
+    Raises:
+    - DetectionInitializationError, RecognitionInitializationError: If a model cannot be loaded.
+
+    Notes:
+    - No thread is started here, so the function is safe to call in a gunicorn master before it forks. Workers forked afterwards share the loaded weights copy-on-write.
+    - With `INFERENCE_MODE=remote`, no weights are loaded in this process. The globals hold stand-ins that send images to the inference server through shared memory, and PyTorch is never imported.
+    """
+    global detection_model, recognition_model
+    generation = GenerationSettings(GENERATION_NUM_BEAMS, GENERATION_MAX_NEW_TOKENS,
+                                    GENERATION_TOKENS_PER_ASPECT, GENERATION_EARLY_EXIT_SCORE, GENERATION_RESCORE_BEAMS)
+    if inference_client is not None:
+        if detection_model is None:
+            detection_model = RemoteDetectionPool(
+                inference_client, DETECT_WORKERS)
+        if recognition_model is None:
+            recognition_model = RemoteRecognition(inference_client, generation)
+        return
+    from DETECTION.detection import TEXT_DETECTION_POOL
+    from RECOGNITION.recognition import TEXT_RECOGNITION
+    if detection_model is None:
+        detection_model = TEXT_DETECTION_POOL(DETECT_WORKERS, LineLayout(
+            MIN_HEIGHT_RATIO=LINE_MIN_HEIGHT_RATIO, MERGE_GAP=LINE_MERGE_GAP) if LINE_LAYOUT else None)
+    if recognition_model is None:
+        recognition_model = TEXT_RECOGNITION(
+            CROP_CACHE_SIZE, RECOGNITION_BACKEND, generation)
+
+
+def warmUp() -> None:
+    """
+    #### Runs one detection per detector instance and one recognition on blank images, so the first real request does not pay for lazy initialization inside PyTorch and ultralytics.
+    """
+    blank = Image.new("RGB", (640, 640), (255, 255, 255))
+    for _ in range(detection_model.size):
+        detection_model.detect_and_crop(blank, DETECT_CONFIDENCE, plot=False)
+    recognition_model.recognize_batch_scored(
+        [np.full((32, 128, 3), 255, dtype=np.uint8)], 1)
+
+
+def openStorage() -> FirebaseIO:
+    """
+    #### Opens the storage backend selected by `STORAGE_BACKEND`: Firebase, or a `LocalFirebaseIO` kept in memory or written to `STORAGE_DIR`.
+    """
+    if STORAGE_BACKEND == "memory":
+        return LocalFirebaseIO(None, UPLOAD_JPEG_QUALITY, UPLOAD_MAX_DIMENSION)
+    if STORAGE_BACKEND == "local":
+        return LocalFirebaseIO(STORAGE_DIR, UPLOAD_JPEG_QUALITY, UPLOAD_MAX_DIMENSION)
+    return FirebaseIO(FIREBASE_KEY_JSON, FIREBASE_DATABASE_URL,
+                      FIREBASE_STORAGE_BUCKET_URL, UPLOAD_JPEG_QUALITY, UPLOAD_MAX_DIMENSION, FIREBASE_POOL_SIZE)
+
+
+def startServices() -> None:
+    """
+    #### Loads the models if needed, opens the storage backend and the job queue, starts the recognition threads and marks the process ready.
+
+    Notes:
+    - Runs once per process, after any fork. Firebase clients, the SQLite connection and threads do not survive a fork, so they are never created in a gunicorn master.
+    - With `INFERENCE_MODE=remote`, it waits until the inference server answers; the server warms its models up itself.
+    - Failures are recorded in `load_state` and reported by `/live` and `/ready` instead of being raised.
+    """
+    global recognition_scheduler, fb, job_queue, recognition_workers
+    started = time.perf_counter()
+    try:
+        loadModels()
+        fb = openStorage()
+        if inference_client is not None:
+            inference_client.waitReady()
+            recognition_scheduler = RemoteRecognitionScheduler(
+                inference_client)
+        else:
+            if MODEL_WARMUP:
+                warmUp()
+            recognition_scheduler = RECOGNITION_SCHEDULER(
+                recognition_model, RECOGNITION_BATCH_SIZE, RECOGNITION_MAX_WAIT_MS)
+        job_queue = JobQueue(
+            JOB_QUEUE_PATH, JOB_QUEUE_MAX_PENDING, BULK_SHARE, JOB_QUEUE_LEASE_S, JOB_QUEUE_RETENTION_S)
+        job_queue.requeueExpired()
+        recognition_workers = JobWorkerPool(
+            job_queue, runRecognitionJob, RECOGNITION_WORKERS, on_failure=evictResult)
+    except Exception as e:
+        load_state["status"] = FAILED
+        load_state["error"] = getattr(e, "message", "Unknown Error")
+        print("Startup failed: {}".format(load_state["error"]))
+        return
+    load_state["seconds"] = time.perf_counter() - started
+    load_state["status"] = READY
+
+
+def checkReady() -> None:
+    """
+    #### Rejects requests that arrive before the models are loaded.
+
+    Raises:
+    - ServerBusyError: If the process is still loading, or failed to load.
+    """
+    if load_state["status"] != READY:
+        raise ServerBusyError("MODELS LOADING" if load_state["status"] == LOADING else "MODELS UNAVAILABLE", retry_after=5)
+
+
+def admitRequest(api_key: ApiKey) -> None:
+    """
+    #### Takes one of the `MAX_CONCURRENT_REQUESTS` upload slots. Pair every call with `releaseRequest()`.
+
+    Raises:
+    - ServerBusyError: If all slots are taken, or if the key is bulk and bulk uploads already hold `BULK_SHARE` of them.
+
+    Notes:
+    - Bulk uploads can never take the last slot, so an interactive upload is admitted even while a backfill saturates the server. With `MAX_CONCURRENT_REQUESTS=1`, bulk uploads are never admitted.
+    - Runs on the event loop only, so the counters need no lock.
+    """
+    global inflight_requests, inflight_bulk
+    if inflight_requests >= MAX_CONCURRENT_REQUESTS:
+        raise ServerBusyError()
+    if api_key.priority == BULK and inflight_bulk >= BULK_MAX_CONCURRENT_REQUESTS:
+        raise ServerBusyError()
+    inflight_requests += 1
+    if api_key.priority == BULK:
+        inflight_bulk += 1
+
+
+def releaseRequest(api_key: ApiKey) -> None:
+    """
+    #### Gives back the upload slot taken by `admitRequest()`.
+    """
+    global inflight_requests, inflight_bulk
+    inflight_requests -= 1
+    if api_key.priority == BULK:
+        inflight_bulk -= 1
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    #### Starts the services of a worker process.
+
+    Notes:
+    - With `MODEL_LOAD_MODE=lazy`, startup runs on a background thread and the worker accepts connections at once; `/ready` answers 503 until the models are loaded and warmed up.
+    - With `eager` and `prefork`, the weights are already loaded at import and the remaining startup completes before the worker accepts connections.
+    """
+    if MODEL_LOAD_MODE == "lazy":
+        threading.Thread(target=startServices, daemon=True).start()
+    else:
+        await run_in_threadpool(startServices)
+    yield
+
+
+if MODEL_LOAD_MODE in ("eager", "prefork"):
+    loadModels()
+    if MODEL_LOAD_MODE == "prefork":
+        gc.freeze()
+
+app = FastAPI(redoc_url=None, docs_url=None, lifespan=lifespan)
 
 
 if CORS_ORIGINS is not None:
@@ -57,10 +372,19 @@ if CORS_ORIGINS is not None:
     except:
         print("Invalid CORS_ORIGINS ENV Value")
 
+try:
+    api_keys = ApiKeyRegistry(ApiKeyRegistry.parse(API_KEYS, API_KEY))
+except:
+    print("Invalid API_KEYS ENV Value")
+    api_keys = ApiKeyRegistry(ApiKeyRegistry.parse(None, API_KEY))
+if BULK_MAX_CONCURRENT_REQUESTS < 1 and any(usage["priority"] == "bulk" for usage in api_keys.usage().values()):
+    print("MAX_CONCURRENT_REQUESTS must be at least 2 to admit bulk API keys")
+
 
-async def get_api_key(api_key_header: str = Security(api_key_header)):
-    if api_key_header == API_KEY:
-        return api_key_header
+async def get_api_key(api_key_header: str = Security(api_key_header)) -> ApiKey:
+    api_key = api_keys.authenticate(api_key_header)
+    if api_key is not None:
+        return api_key
     else:
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN, detail="Could not validate API KEY"
@@ -119,79 +443,780 @@ async def favicon():
     return RedirectResponse("https://res.cloudinary.com/pasindua/image/upload/v1681017394/api_assets/favicon_y7jctk.ico")
 
 
+@app.get("/live", include_in_schema=False)
+async def live():
+    """
+    #### Liveness probe. Fails only if startup failed, so the process should be restarted.
+    """
+    return JSONResponse(
+        status_code=status.HTTP_500_INTERNAL_SERVER_ERROR if load_state[
+            "status"] == FAILED else status.HTTP_200_OK,
+        content=load_state
+    )
+
+
+@app.get("/ready", include_in_schema=False)
+async def ready():
+    """
+    #### Readiness probe. Succeeds once the models are loaded and warmed up and the services are running.
+    """
+    return JSONResponse(
+        status_code=status.HTTP_200_OK if load_state[
+            "status"] == READY else status.HTTP_503_SERVICE_UNAVAILABLE,
+        content=load_state
+    )
+
+
+@app.middleware("http")
+async def observeRequests(request: Request, call_next):
+    """
+    #### Records the latency and status of every request in `REQUEST_SECONDS`, inside a tracing span that the pipeline stages and background jobs link to.
+    """
+    started = time.perf_counter()
+    statusCode = status.HTTP_500_INTERNAL_SERVER_ERROR
+    try:
+        with tracing.span("HTTP {}".format(request.method), **{"http.target": request.url.path}):
+            response = await call_next(request)
+            statusCode = response.status_code
+            return response
+    finally:
+        endpoint = request.scope.get("endpoint")
+        REQUEST_SECONDS.observe(time.perf_counter() - started, endpoint=getattr(
+            endpoint, "__name__", "unmatched"), status=statusCode)
+
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics(source: str = None):
+    """
+    #### Exposes the metrics of this process in the Prometheus text format.
+
+    Notes:
+    - Every web worker process keeps its own metrics; scrape each worker, or run a single worker per port.
+    - With `INFERENCE_MODE=remote`, `?source=inference` returns the metrics of the inference server instead, as a separate scrape target, so the two never mix series of the same name.
+    """
+    if source == "inference" and inference_client is not None:
+        try:
+            content = (await run_in_threadpool(inference_client.call, {"op": EXPORT_METRICS}))["metrics"]
+        except InferenceServerError as e:
+            return PlainTextResponse(e.message, status_code=status.HTTP_503_SERVICE_UNAVAILABLE)
+        return PlainTextResponse(content, media_type=CONTENT_TYPE)
+    return PlainTextResponse(renderMetrics(), media_type=CONTENT_TYPE)
+
+
+@app.get("/stats", include_in_schema=False)
+async def stats(api_key: ApiKey = Depends(get_api_key)):
+    """
+    #### Returns the scheduler and cache statistics of this worker, and the usage counters of the calling API key only.
+
+    Notes:
+    - With `INFERENCE_MODE=remote`, the scheduler and crop cache statistics are socket round-trips to the inference server, so they are collected on the thread pool.
+    """
+    if load_state["status"] != READY:
+        return JSONResponse(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            content=load_state
+        )
+
+    def collect():
+        return {
+            "recognition_scheduler": recognition_scheduler.stats(),
+            "result_cache": result_cache.stats() if result_cache is not None else None,
+            "crop_cache": recognition_model.crop_cache.stats() if recognition_model.crop_cache is not None else None,
+            "api_keys": {api_key.name: api_keys.usage()[api_key.name]}
+        }
+
+    try:
+        content = await run_in_threadpool(collect)
+    except InferenceServerError as e:
+        return JSONResponse(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            content={"error": e.message},
+            headers={"Retry-After": str(e.retry_after)}
+        )
+    return JSONResponse(
+        status_code=status.HTTP_200_OK,
+        content=content
+    )
+
+
+@app.get("/usage", include_in_schema=False)
+async def usage(api_key: ApiKey = Depends(get_api_key)):
+    """
+    #### Returns the usage counters and remaining daily quota of the calling API key.
+    """
+    return JSONResponse(
+        status_code=status.HTTP_200_OK,
+        content=dict(api_keys.usage()[api_key.name], name=api_key.name)
+    )
+
+
+@app.get("/job_status/{documentId}", status_code=200)
+async def job_status(documentId: str, api_key: ApiKey = Depends(get_api_key)) -> JobStatusModel:
+    response = JobStatusModel(documentID=documentId)
+    try:
+        checkReady()
+        job = await run_in_threadpool(job_queue.status, documentId)
+        if job is None:
+            response.error = "JOB NOT FOUND"
+            return JSONResponse(
+                status_code=status.HTTP_404_NOT_FOUND,
+                content=jsonable_encoder(response)
+            )
+        return JSONResponse(
+            status_code=status.HTTP_200_OK,
+            content=jsonable_encoder(JobStatusModel(**job))
+        )
+    except Exception as e:
+        return errorResponse(response, e)
+
+
+@app.get("/stream/{documentId}", status_code=200)
+async def stream(documentId: str, api_key: ApiKey = Depends(get_api_key)):
+    """
+    #### Streams the recognized lines of a document as Server-Sent Events.
+
+    Notes:
+    - Each `line` event carries the line index, text, recognition score, box and detection confidence as JSON. The stream ends with a `done` or `error` event.
+    - Lines recognized before the client connected are sent first, so the stream can be opened at any time after `/detect_img` returns.
+    - Events live in the memory of the worker process that accepted the upload, and the job queue runs each job in that process while it is alive. With several gunicorn workers, the client must reach the same process, e.g. through sticky sessions, or run a single worker. Otherwise it gets 404 and must read Firestore instead.
+    - If the job does not report back within `STREAM_TIMEOUT_S`, e.g. because the process restarted and another one took the job over, the stream ends with an `error` event.
+    """
+    events = result_broker.subscribe(documentId)
+    if events is None and load_state["status"] != READY:
+        return errorResponse(ResponseModel(documentID=documentId), ServerBusyError("MODELS LOADING", retry_after=5))
+    if events is None:
+        return JSONResponse(
+            status_code=status.HTTP_404_NOT_FOUND,
+            content=jsonable_encoder(ResponseModel(
+                documentID=documentId, error="STREAM NOT FOUND"))
+        )
+
+    async def eventSource():
+        try:
+            while True:
+                try:
+                    event = await asyncio.wait_for(events.get(), STREAM_KEEPALIVE_S)
+                except asyncio.TimeoutError:
+                    result_broker.isOpen(documentId)
+                    yield ": keepalive\n\n"
+                    continue
+                yield "event: {}\ndata: {}\n\n".format(event["event"], json.dumps(event))
+                if event["event"] != ResultBroker.LINE:
+                    break
+        finally:
+            result_broker.unsubscribe(documentId, events)
+
+    return StreamingResponse(eventSource(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+
 @app.post("/detect_img", status_code=200)
-async def add_post(api_key: APIKey = Depends(get_api_key), file: bytes = File(...)) -> ResponseModel:
+async def add_post(api_key: ApiKey = Depends(get_api_key), file: bytes = File(...), overlay: bool = True, num_beams: int = None, max_new_tokens: int = None, early_exit_score: float = None) -> ResponseModel:
+    """
+    #### Detects the text lines of a prescription and queues their recognition.
+
+    Notes:
+    - With `overlay`, `imageURL` points to the image annotated with the detected boxes. It is rendered and uploaded in the background, concurrently with the document write and until after the response, so the URL may answer 404 for a moment. Without `overlay`, or while `OVERLAY_QUEUE_MAX` overlays are pending, no image is rendered or stored and `imageURL` is empty.
+    - The recognized lines are written to the Firestore document and published on `/stream/{documentID}`. The stream is only served by the worker process that handled this request, see `/stream`.
+    - A repeated upload with the same settings is answered from `result_cache` with the first `documentID` for `RESULT_CACHE_TTL_S`. Responses whose overlay was skipped are not cached, and the entry is evicted if the recognition job fails, so a retry runs again.
+    """
     response = ResponseModel()
+    charged = 0
     try:
+        checkReady()
+        api_keys.charge(api_key)
+        charged = 1
+        settings = {
+            "NUM_BEAMS": num_beams,
+            "MAX_NEW_TOKENS": max_new_tokens,
+            "EARLY_EXIT_SCORE": early_exit_score
+        }
+        if result_cache is not None:
+            cacheKey = ResultCache.key(
+                file, DETECT_CONFIDENCE, overlay, settings)
+            cached = await run_in_threadpool(result_cache.get, cacheKey)
+            if cached is not None:
+                return JSONResponse(
+                    status_code=status.HTTP_200_OK,
+                    content=cached
+                )
+
+        admitRequest(api_key)
         try:
-            input_image = Image.open(BytesIO(file)).convert("RGB")
-        except:
-            raise FileReadError()
-        detected_dict = detection_model.detect(input_image, DETECT_CONFIDENCE)
-        crop_dict = detection_model.crop_image()
-        url_and_name = fb.uploadImage(detected_dict[Config.IMAGE.value])
-        documentId = fb.createDocument(url_and_name[0], url_and_name[1])
-        conf_list = detected_dict[Config.CONF_LIST.value]
-
-        # Create Thread for background process
-        thread = threading.Thread(
-            target=runRecognizerInBackground, args=(documentId, crop_dict, conf_list,), daemon=True)
-        thread.start()
-
-        # Create Response
+            await run_in_threadpool(job_queue.checkCapacity, api_key.priority)
+            detected_dict = await asyncio.wrap_future(detection_executor.submit(
+                tracing.bind(runDetection), file, False, priority=api_key.priority))
+            conf_list = detected_dict[Config.CONF_LIST.value].tolist()
+            box_list = detected_dict[Config.CROP_XYXY.value].tolist()
+            url_and_name = submitOverlay(
+                file, box_list, conf_list) if overlay else (None, None)
+            documentId = await fb.createDocumentAsync(url_and_name[0], url_and_name[1], conf_list, box_list)
+
+            # Create Response
+            response.documentID = documentId
+            response.imageURL = url_and_name[0]
+            response.boxes = box_list
+            response.confidences = conf_list
+            resJson = jsonable_encoder(response)
+            # Cached before the job is queued, so a failing job always finds the entry to evict
+            cacheable = result_cache is not None and (
+                not overlay or url_and_name[0] is not None)
+            if cacheable:
+                await run_in_threadpool(result_cache.put, cacheKey, resJson)
+            result_broker.open(documentId, box_list, conf_list)
+            try:
+                await run_in_threadpool(job_queue.enqueue, documentId, file, box_list, settings, tracing.inject(), api_key.priority)
+            except Exception as e:
+                result_broker.close(documentId, getattr(
+                    e, "message", "Unknown Error"))
+                if cacheable:
+                    await run_in_threadpool(result_cache.evict, cacheKey)
+                raise
+            recognition_workers.notify()
+        finally:
+            releaseRequest(api_key)
+
+        return JSONResponse(
+            status_code=status.HTTP_200_OK,
+            content=resJson
+        )
+    except Exception as e:
+        api_keys.refund(api_key, charged)
+        return errorResponse(response, e)
+
+
+@app.post("/extract", status_code=200)
+async def extract(api_key: ApiKey = Depends(get_api_key), file: bytes = File(...), deadline_ms: float = None, persist: bool = False, overlay: bool = True, num_beams: int = None, max_new_tokens: int = None, early_exit_score: float = None) -> ExtractResponseModel:
+    """
+    #### Runs detection, batched recognition and an optional Firestore persist in one call, within a caller-supplied latency budget.
+
+    Notes:
+    - `deadline_ms` is measured from the start of the request, defaults to `EXTRACT_DEFAULT_DEADLINE_MS` and is capped at `EXTRACT_MAX_DEADLINE_MS`. Lines not recognized by then are returned with `pending` set, and keep being recognized in the background. They are published on `/stream/{documentID}` and, with `persist`, written to the Firestore document.
+    - Without `persist`, `documentID` is a stream ID that is not stored in Firestore and `imageURL` is empty.
+    - With `persist`, document creation runs concurrently with recognition. With `persist` and `overlay`, the annotated image is rendered and uploaded in the background, as on `/detect_img`.
+    - `timings` holds the milliseconds spent in the decode, detect, crop, recognize and upload stages. Upload is the document creation and overlaps with recognize.
+    - The upload slot taken by `admitRequest()` is given back once the document is created, as on `/detect_img`; waiting for recognition does not hold it.
+    """
+    started = time.perf_counter()
+    deadline = started + requestBudget(deadline_ms)
+    response = ExtractResponseModel()
+    charged = 0
+    try:
+        checkReady()
+        api_keys.charge(api_key)
+        charged = 1
+        admitRequest(api_key)
+        try:
+            detected_dict = await asyncio.wrap_future(detection_executor.submit(
+                tracing.bind(runDetection), file, priority=api_key.priority))
+            timings = detected_dict[Config.TIMINGS.value]
+            conf_list = detected_dict[Config.CONF_LIST.value].tolist()
+            box_list = detected_dict[Config.CROP_XYXY.value].tolist()
+            settings = recognition_model.generation.replace(
+                NUM_BEAMS=num_beams, MAX_NEW_TOKENS=max_new_tokens, EARLY_EXIT_SCORE=early_exit_score)
+
+            recognize_started = time.perf_counter()
+            job = recognition_scheduler.submit(
+                detected_dict[Config.CROP_IMG.value], settings, api_key.priority)
+
+            url_and_name = (None, None)
+            if persist:
+                upload_started = time.perf_counter()
+                if overlay:
+                    url_and_name = submitOverlay(file, box_list, conf_list)
+                documentId = await fb.createDocumentAsync(url_and_name[0], url_and_name[1], conf_list, box_list)
+                timings["upload"] = time.perf_counter() - upload_started
+            else:
+                documentId = uuid.uuid4().hex
+
+            result_broker.open(documentId, box_list, conf_list)
+            background_executor.submit(
+                consumeRecognition, documentId, job, persist, tracing.inject())
+        finally:
+            releaseRequest(api_key)
+
+        await run_in_threadpool(job.wait, max(0.0, deadline - time.perf_counter()))
+        timings["recognize"] = time.perf_counter() - recognize_started
+        if job.error is not None:
+            raise job.error
         response.documentID = documentId
         response.imageURL = url_and_name[0]
-        response.boxes = crop_dict[Config.CROP_XYXY.value]
-        response.confidences = conf_list
-        resJson = jsonable_encoder(response)
+        response.lines = buildLines(job, box_list, conf_list)
+        response.pending = sum(line.pending for line in response.lines)
+        response.timings = {stage: seconds * 1000 for stage, seconds in timings.items()}
         return JSONResponse(
             status_code=status.HTTP_200_OK,
-            content=resJson
+            content=jsonable_encoder(response)
         )
     except Exception as e:
-        errorMessage = ""
-        httpStatus = None
-
-        if isinstance(e, FileReadError):
-            errorMessage = e.message
-            httpStatus = status.HTTP_415_UNSUPPORTED_MEDIA_TYPE
-        elif isinstance(e, (FirebaseInitializationError, FirebaseCreateDocumentError, FirebaseUpdateDocumentError, FirebaseUploadError, DetectionInitializationError, DetectionDetectError, DetectionCropError, RecognitionInitializationError, RecognitionRecognizeError)):
-            errorMessage = e.message
-            httpStatus = status.HTTP_500_INTERNAL_SERVER_ERROR
-        else:
-            errorMessage = "Unknown Error"
-            httpStatus = status.HTTP_500_INTERNAL_SERVER_ERROR
+        api_keys.refund(api_key, charged)
+        return errorResponse(response, e)
+
+
+@app.post("/detect_batch", status_code=200)
+async def detect_batch(api_key: ApiKey = Depends(get_api_key), files: List[UploadFile] = File(...), deadline_ms: float = None, persist: bool = False, overlay: bool = True, num_beams: int = None, max_new_tokens: int = None, early_exit_score: float = None) -> BatchResponseModel:
+    """
+    #### Extracts the text of many prescriptions in one call.
+
+    Notes:
+    - `files` may hold images, zip archives of images, or both; at most `BATCH_MAX_IMAGES` images and `BATCH_MAX_BYTES` bytes in total once extracted. Archives are checked against both limits from their directory and extracted on the thread pool, off the event loop.
+    - Images are detected `DETECT_BATCH_SIZE` at a time with one batched YOLO call per chunk, and the chunks are spread over the detector pool. All crops of all images are then queued on the recognition scheduler together.
+    - Each image gets its own result or error in `results`, in upload order. Lines, `deadline_ms`, `persist`, `overlay` and the decoding settings behave as in `/extract`.
+    - Every image counts against the rate limit and quota of the API key. Images that could not be read, detected or stored are given back.
+    """
+    started = time.perf_counter()
+    deadline = started + requestBudget(deadline_ms)
+    response = BatchResponseModel()
+    charged = 0
+    try:
+        checkReady()
+        admitRequest(api_key)
+        try:
+            uploads = []
+            size = 0
+            for upload in files:
+                expanded = await run_in_threadpool(expandUpload, upload.filename, await upload.read(),
+                                                   BATCH_MAX_IMAGES - len(uploads), BATCH_MAX_BYTES - size if BATCH_MAX_BYTES > 0 else None)
+                uploads.extend(expanded)
+                size += sum(len(data) for _, data in expanded)
+                if len(uploads) > BATCH_MAX_IMAGES:
+                    raise BatchTooLargeError()
+                if BATCH_MAX_BYTES > 0 and size > BATCH_MAX_BYTES:
+                    raise UploadTooLargeError()
+            api_keys.charge(api_key, len(uploads))
+            charged = len(uploads)
+
+            detect_started = time.perf_counter()
+            chunks = await asyncio.gather(*[
+                asyncio.wrap_future(detection_executor.submit(tracing.bind(runDetectionBatch), [
+                                    data for _, data in uploads[start:start + DETECT_BATCH_SIZE]], priority=api_key.priority))
+                for start in range(0, len(uploads), DETECT_BATCH_SIZE)
+            ])
+            detected_list = [detected for chunk in chunks for detected in chunk]
+            timings = {"detect": time.perf_counter() - detect_started}
+
+            settings = recognition_model.generation.replace(
+                NUM_BEAMS=num_beams, MAX_NEW_TOKENS=max_new_tokens, EARLY_EXIT_SCORE=early_exit_score)
+            recognize_started = time.perf_counter()
+            jobs = [None if isinstance(detected, Exception) else recognition_scheduler.submit(
+                detected[Config.CROP_IMG.value], settings, api_key.priority) for detected in detected_list]
+
+            async def persistImage(file, detected):
+                conf_list = detected[Config.CONF_LIST.value].tolist()
+                box_list = detected[Config.CROP_XYXY.value].tolist()
+                url_and_name = submitOverlay(
+                    file, box_list, conf_list) if overlay else (None, None)
+                documentId = await fb.createDocumentAsync(url_and_name[0], url_and_name[1], conf_list, box_list)
+                return (documentId, url_and_name[0])
+
+            if persist:
+                upload_started = time.perf_counter()
+                documents = await asyncio.gather(*[
+                    persistImage(data, detected) if job is not None else asyncio.sleep(0)
+                    for (_, data), detected, job in zip(uploads, detected_list, jobs)
+                ], return_exceptions=True)
+                timings["upload"] = time.perf_counter() - upload_started
+            else:
+                documents = [(uuid.uuid4().hex, None) for _ in jobs]
 
-        response.error = errorMessage
-        resJson = jsonable_encoder(response)
+            for index, (detected, job, document) in enumerate(zip(detected_list, jobs, documents)):
+                if job is None:
+                    continue
+                if isinstance(document, Exception):
+                    detected_list[index] = document
+                    continue
+                result_broker.open(document[0], detected[Config.CROP_XYXY.value].tolist(
+                ), detected[Config.CONF_LIST.value].tolist())
+                background_executor.submit(
+                    consumeRecognition, document[0], job, persist, tracing.inject())
+        finally:
+            releaseRequest(api_key)
+
+        for job in jobs:
+            if job is not None:
+                await run_in_threadpool(job.wait, max(0.0, deadline - time.perf_counter()))
+        timings["recognize"] = time.perf_counter() - recognize_started
+
+        for (name, _), detected, job, document in zip(uploads, detected_list, jobs, documents):
+            item = BatchItemModel(fileName=name)
+            if isinstance(detected, Exception):
+                item.error = getattr(detected, "message", "Unknown Error")
+            elif job.error is not None:
+                item.error = job.error.message
+            else:
+                item.documentID = document[0]
+                item.imageURL = document[1]
+                item.lines = buildLines(job, detected[Config.CROP_XYXY.value].tolist(
+                ), detected[Config.CONF_LIST.value].tolist())
+                item.pending = sum(line.pending for line in item.lines)
+                item.timings = {stage: seconds * 1000 for stage,
+                                seconds in detected[Config.TIMINGS.value].items()}
+            response.results.append(item)
+        api_keys.refund(api_key, sum(
+            isinstance(detected, Exception) for detected in detected_list))
+        response.timings = {stage: seconds * 1000 for stage, seconds in timings.items()}
         return JSONResponse(
-            status_code=httpStatus,
-            content=resJson
+            status_code=status.HTTP_200_OK,
+            content=jsonable_encoder(response)
         )
+    except Exception as e:
+        api_keys.refund(api_key, charged)
+        return errorResponse(response, e)
+
+
+def requestBudget(deadline_ms: float) -> float:
+    """
+    #### Returns the latency budget in seconds of an `/extract` or `/detect_batch` call: `deadline_ms`, or `EXTRACT_DEFAULT_DEADLINE_MS` if it is None, capped at `EXTRACT_MAX_DEADLINE_MS`.
+    """
+    if deadline_ms is None:
+        deadline_ms = EXTRACT_DEFAULT_DEADLINE_MS
+    return min(max(0.0, deadline_ms), EXTRACT_MAX_DEADLINE_MS) / 1000
+
+
+def buildLines(job, box_list: list, conf_list: list) -> list:
+    """
+    #### Builds the line models of a document from its recognition job, marking the lines that are not recognized yet as pending.
+    """
+    texts = list(job.texts)
+    scores = list(job.scores)
+    return [
+        LineModel(index=index, text=texts[index], score=scores[index], box=box,
+                  confidence=conf_list[index], pending=texts[index] is None)
+        for index, box in enumerate(box_list)
+    ]
+
+
+def expandUpload(name: str, data: bytes, max_images: int, max_bytes: int = None) -> list:
+    """
+    #### Expands an uploaded file into its images.
+
+    Arguments:
+    - name (str): The file name of the upload.
+    - data (bytes): The raw bytes of the upload.
+    - max_images (int): The number of images the batch still has room for.
+    - max_bytes (int, optional): The number of bytes the batch still has room for. Defaults to None, which disables the check.
+
+    Returns:
+    - A list of `(name, bytes)` tuples: the entries of a zip archive, or the upload itself otherwise.
+
+    Raises:
+    - BatchTooLargeError: If a zip archive holds more than `max_images` files.
+    - UploadTooLargeError: If an entry of a zip archive is larger than `MAX_UPLOAD_BYTES`, or all entries together are larger than `max_bytes`, once extracted.
+
+    Notes:
+    - The entry sizes are read from the archive directory, before anything is extracted. `zipfile` never inflates an entry past its declared size, so an archive cannot lie its way past the limits.
+    - Extraction is CPU-bound; call this function on the thread pool.
+    """
+    buffer = BytesIO(data)
+    if not zipfile.is_zipfile(buffer):
+        return [(name, data)]
+    with zipfile.ZipFile(buffer) as archive:
+        entries = [info for info in archive.infolist() if not info.is_dir()]
+        if len(entries) > max_images:
+            raise BatchTooLargeError()
+        if MAX_UPLOAD_BYTES > 0 and any(info.file_size > MAX_UPLOAD_BYTES for info in entries):
+            raise UploadTooLargeError()
+        if max_bytes is not None and sum(info.file_size for info in entries) > max_bytes:
+            raise UploadTooLargeError()
+        return [(info.filename, archive.read(info)) for info in entries]
+
+
+def errorResponse(response: ResponseModel, e: Exception) -> JSONResponse:
+    """
+    #### Maps an exception raised while serving a request to a JSON error response.
+
+    Arguments:
+    - response (ResponseModel | ExtractResponseModel | BatchResponseModel | JobStatusModel): The response model to attach the error message to.
+    - e (Exception): The exception raised by the endpoint.
+
+    Returns:
+    - A JSONResponse with the error message and the HTTP status matching the exception class from `error.py`.
+    """
+    errorMessage = ""
+    httpStatus = None
+    headers = None
+    count_error(e, "request")
+
+    if isinstance(e, FileReadError):
+        errorMessage = e.message
+        httpStatus = status.HTTP_415_UNSUPPORTED_MEDIA_TYPE
+    elif isinstance(e, (BatchTooLargeError, UploadTooLargeError)):
+        errorMessage = e.message
+        httpStatus = status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+    elif isinstance(e, (ServerBusyError, JobQueueFullError, InferenceServerError)):
+        errorMessage = e.message
+        httpStatus = status.HTTP_503_SERVICE_UNAVAILABLE
+        headers = {"Retry-After": str(e.retry_after)}
+    elif isinstance(e, (RateLimitError, QuotaExceededError)):
+        errorMessage = e.message
+        httpStatus = status.HTTP_429_TOO_MANY_REQUESTS
+        headers = {"Retry-After": str(e.retry_after)}
+    elif isinstance(e, (FirebaseInitializationError, FirebaseCreateDocumentError, FirebaseUpdateDocumentError, FirebaseUploadError, DetectionInitializationError, DetectionDetectError, DetectionCropError, RecognitionInitializationError, RecognitionRecognizeError, JobQueueError)):
+        errorMessage = e.message
+        httpStatus = status.HTTP_500_INTERNAL_SERVER_ERROR
+    else:
+        errorMessage = "Unknown Error"
+        httpStatus = status.HTTP_500_INTERNAL_SERVER_ERROR
+
+    response.error = errorMessage
+    resJson = jsonable_encoder(response)
+    return JSONResponse(
+        status_code=httpStatus,
+        content=resJson,
+        headers=headers
+    )
+
+
+def runDetection(file: bytes, crop=True) -> dict:
+    """
+    #### Decodes an uploaded image and runs text detection and cropping on it.
+
+    Arguments:
+    - file (bytes): The raw bytes of the uploaded image.
+    - crop (bool, optional): Take the crops from the full-resolution image. Defaults to True. When False, the full-resolution image is never decoded and `Config.CROP_IMG.value` is None, for callers that only need the boxes, like `/detect_img`, whose recognition job crops the stored upload later.
+
+    Returns:
+    - The dictionary returned by `TEXT_DETECTION.detect_and_crop()`, holding the plotted image, confidences, boxes, crops and stage timings. The seconds spent decoding are added to the timings under 'decode'.
+
+    Raises:
+    - UploadTooLargeError: If the upload is larger than `MAX_UPLOAD_BYTES` or `MAX_IMAGE_PIXELS`.
+    - FileReadError: If the uploaded bytes are not a readable image.
+    - DetectionDetectError, DetectionCropError: If detection or cropping failed.
+
+    Notes:
+    - This function is CPU-bound and is run on `detection_executor`, never on the event loop. The executor has one worker per detector instance in `detection_model`, so `DETECT_WORKERS` detections run in parallel. Queued detections of interactive API keys run before those of bulk keys.
+    - Detection runs on a copy of at most `DETECT_MAX_SIDE` pixels per side, decoded in JPEG draft mode. The boxes are returned in the coordinates of the uploaded image and the crops are taken from it at full resolution.
+    - No overlay is drawn, so `Config.IMAGE.value` is None. The annotated image is rendered later by `uploadOverlay()`, only for requests that want it.
+    - The stage timings, the number of boxes and the size of each box are recorded in the Prometheus metrics.
+    """
+    with tracing.span("detection"):
+        started = time.perf_counter()
+        prepared = prepare(file, DETECT_MAX_SIDE,
+                           MAX_UPLOAD_BYTES, MAX_IMAGE_PIXELS)
+        decoded = time.perf_counter() - started
+        detected_dict = detection_model.detect_and_crop(
+            prepared.detection, DETECT_CONFIDENCE, source=prepared.full if crop else None, plot=False)
+    if not crop:
+        scale_x, scale_y = prepared.scale
+        detected_dict[Config.CROP_XYXY.value] = detected_dict[Config.CROP_XYXY.value] * \
+            np.array([scale_x, scale_y, scale_x, scale_y], dtype=np.float32)
+        detected_dict[Config.CROP_IMG.value] = None
+    detected_dict[Config.TIMINGS.value]["decode"] = decoded
+    observe_timings(detected_dict[Config.TIMINGS.value])
+    observe_detection(detected_dict[Config.CROP_XYXY.value])
+    return detected_dict
+
 
+def runDetectionBatch(files: list) -> list:
+    """
+    #### Decodes many uploaded images and runs one batched text detection over the readable ones.
+
+    Arguments:
+    - files (list[bytes]): The raw bytes of the uploaded images.
+
+    Returns:
+    - A list with one entry per file, in input order: the dictionary returned by `TEXT_DETECTION.detect_and_crop_batch()` for that image, or the exception that made it fail.
 
-def runRecognizerInBackground(documentId: str, crop_dict: dict, conf_list: list) -> None:
+    Notes:
+    - Like `runDetection()`, this function runs on `detection_executor` and detects on images of at most `DETECT_MAX_SIDE` pixels per side. A file that cannot be decoded or is too large only fails itself; a failed detection call fails the images of this chunk.
+    """
+    detected_list = [FileReadError() for _ in files]
+    prepared_list = []
+    indices = []
+    decode_times = []
+    for index, file in enumerate(files):
+        started = time.perf_counter()
+        try:
+            prepared_list.append(
+                prepare(file, DETECT_MAX_SIDE, MAX_UPLOAD_BYTES, MAX_IMAGE_PIXELS))
+        except (FileReadError, UploadTooLargeError) as e:
+            detected_list[index] = e
+            continue
+        indices.append(index)
+        decode_times.append(time.perf_counter() - started)
+    try:
+        results = detection_model.detect_and_crop_batch(
+            [prepared.detection for prepared in prepared_list], DETECT_CONFIDENCE,
+            sources=[prepared.full for prepared in prepared_list], plot=False)
+    except Exception as e:
+        results = [e] * len(prepared_list)
+    for index, decoded, detected in zip(indices, decode_times, results):
+        if not isinstance(detected, Exception):
+            detected[Config.TIMINGS.value]["decode"] = decoded
+            observe_timings(detected[Config.TIMINGS.value])
+            observe_detection(detected[Config.CROP_XYXY.value])
+        detected_list[index] = detected
+    return detected_list
+
+
+def submitOverlay(file: bytes, box_list: list, conf_list: list) -> tuple:
+    """
+    #### Reserves an image name and queues the overlay of an upload on `overlay_executor`, unless `OVERLAY_QUEUE_MAX` overlays are already pending.
+
+    Arguments:
+    - file (bytes): The raw bytes of the uploaded image.
+    - box_list (list[list[float]]): The detected boxes, in the coordinates of the uploaded image.
+    - conf_list (list[float]): The detection confidence of each box, as a percentage.
+
+    Returns:
+    - The `(imageURL, fileName)` reserved for the overlay, or `(None, None)` if the overlay was skipped.
+
+    Notes:
+    - Every pending overlay holds the upload bytes, so the queue is bounded to keep memory bounded when uploads arrive faster than overlays are rendered. A skipped overlay only leaves `imageURL` empty; detection and recognition are unaffected.
+    """
+    global overlays_pending
+    with overlay_lock:
+        if overlays_pending >= OVERLAY_QUEUE_MAX:
+            OVERLAYS_SKIPPED.inc()
+            return (None, None)
+        overlays_pending += 1
+    try:
+        url_and_name = fb.reserveImage()
+        overlay_executor.submit(tracing.bind(uploadOverlay), file,
+                                url_and_name[1], box_list, conf_list).add_done_callback(releaseOverlay)
+    except:
+        releaseOverlay(None)
+        raise
+    return url_and_name
+
+
+def releaseOverlay(future) -> None:
+    global overlays_pending
+    with overlay_lock:
+        overlays_pending -= 1
+
+
+def uploadOverlay(file: bytes, fileName: str, box_list: list, conf_list: list) -> None:
+    """
+    #### Renders the annotated image of an upload and stores it under a file name reserved with `FirebaseIO.reserveImage()`.
+
+    Arguments:
+    - file (bytes): The raw bytes of the uploaded image.
+    - fileName (str): The reserved file name the document already points to.
+    - box_list (list[list[float]]): The detected boxes, in the coordinates of the uploaded image.
+    - conf_list (list[float]): The detection confidence of each box, as a percentage.
+
+    Notes:
+    - This function runs on `overlay_executor`, submitted by `submitOverlay()` before the document is created, so rendering, encoding and the upload overlap the Firestore write and finish after the response has been sent.
+    - The upload is decoded again at `UPLOAD_MAX_DIMENSION` (or `DETECT_MAX_SIDE`) in JPEG draft mode and the boxes are scaled to it, so the overlay never needs the full-resolution pixels.
+    - A failure only leaves the reserved URL without an image; it is reported on stdout and does not affect recognition.
+    """
+    try:
+        prepared = prepare(file, UPLOAD_MAX_DIMENSION or DETECT_MAX_SIDE)
+        scale_x, scale_y = prepared.scale
+        xyxy = np.asarray(box_list, dtype=np.float32).reshape(-1, 4) / \
+            np.array([scale_x, scale_y, scale_x, scale_y], dtype=np.float32)
+        fb.uploadImage(render_boxes(np.asarray(
+            prepared.detection), xyxy, conf_list), fileName)
+    except Exception as e:
+        print("Overlay upload failed for {}: {}".format(
+            fileName, getattr(e, "message", "Unknown Error")))
+
+
+def runRecognizerInBackground(documentId: str, crop_list: list, settings=None, priority=0) -> None:
     """
     #### Runs an OCR recognizer on a set of image crops in the background and updates a Firebase Firestore document with the recognition results.
 
     Arguments:
     - documentId (str): The ID of the Firestore document to update with the recognition results.
-    - crop_dict (dict): A dictionary containing image crops and their corresponding bounding box coordinates, as returned by an object detection model.
-    - conf_list (list[float]): A list of confidence scores for the detected objects.
+    - crop_list (list): The image crops of the document, as returned by the object detection model, in box order.
+    - settings (GenerationSettings, optional): The decoding settings of this document. Defaults to the deployment settings of `recognition_model`.
+    - priority (int, optional): The priority class of the API key that uploaded the document. Defaults to 0, the interactive class.
 
     Returns:
         None.
 
     Notes:
-    - This function runs an OCR recognizer on each image crop in the input dictionary in the background, without blocking the main thread. The recognition results are stored in a list, which is then passed to the FirebaseClient.updateDocument() method along with the confidence scores and bounding box coordinates.
-    - The OCR recognizer is assumed to be defined in a separate module or class and imported as `recognition_model`. The recognizer should take a NumPy array representing an image as input and return a string representing the recognized text.
-    - The input `crop_dict` should be a dictionary with keys 'CROP_IMG' and 'CROP_XYXY', corresponding to the image crops and their bounding box coordinates, respectively. The image crops should be provided as a list of NumPy arrays, and the coordinates should be provided as a list of lists, in the format [[x1, y1, x2, y2], [x1, y1, x2, y2], ...]. The `conf_list` should be a list of confidence scores for the detected objects, in the same order as the image crops.
-    - The function assumes that the FirebaseClient instance is defined in the global scope as `fb`, and that the updateDocument() method is available on the instance.
-    - This function does not return any values, but updates the specified Firestore document with the recognition results.
+    - This function runs on a worker of `recognition_workers` and submits the image crops to the shared `recognition_scheduler`. The scheduler batches them together with the crops of other in-flight documents.
+    - The results are handed out by `consumeRecognition()`.
+    """
+    job = recognition_scheduler.submit(crop_list, settings, priority)
+    consumeRecognition(documentId, job)
+
+
+def consumeRecognition(documentId: str, job, persist=True, trace=None) -> None:
+    """
+    #### Hands out the results of a recognition job as its batches complete.
+
+    Arguments:
+    - documentId (str): The ID of the document the job belongs to.
+    - job (RecognitionJob): The job returned by `recognition_scheduler.submit()`.
+    - persist (bool, optional): Write the results to the Firestore document. Defaults to True.
+    - trace (dict, optional): The tracing carrier of the request the job belongs to, from `tracing.inject()`. The span of this function is linked to it.
+
+    Raises:
+    - RecognitionRecognizeError, FirebaseUpdateDocumentError: If recognition or the Firestore update failed. The error is also counted in the metrics.
+
+    Notes:
+    - Every batch of recognized lines is published to `result_broker` as soon as it is produced, for clients of the `/stream` endpoint.
+    - If `persist` and `FIRESTORE_SINK` are enabled, the recognized texts are also written through a `CoalescedWriter`, which flushes `DETECT_LIST` and the per-line `SCORE_LIST` every `FIRESTORE_FLUSH_COUNT` texts or `FIRESTORE_FLUSH_INTERVAL_MS` milliseconds and once more at the end. The confidence scores and bounding boxes were already written when the document was created.
+    - The function assumes that the FirebaseClient instance is defined in the global scope as `fb`.
+    """
+    writer = CoalescedWriter(fb, documentId, FIRESTORE_FLUSH_COUNT,
+                             FIRESTORE_FLUSH_INTERVAL_MS / 1000) if persist and FIRESTORE_SINK else None
+    with tracing.span("recognition", link=trace, documentID=documentId, lines=job.size):
+        try:
+            for chunk in job:
+                result_broker.publishLines(documentId, chunk)
+                if writer is not None:
+                    writer.extend([text for _, text, _ in chunk],
+                                  [score for _, _, score in chunk])
+            if writer is not None:
+                writer.close()
+        except Exception as e:
+            count_error(e, "recognition")
+            result_broker.close(documentId, getattr(
+                e, "message", "Unknown Error"))
+            raise
+    result_broker.close(documentId)
+
+
+def evictResult(job: dict, error: Exception) -> None:
+    """
+    #### Evicts the cached `/detect_img` response of a failed recognition job, so a retry of the upload is not answered with the failed document.
+
+    Notes:
+    - The key is rebuilt from the stored upload and settings. Both overlay variants are evicted, since the job does not know which one was requested.
+    """
+    if result_cache is None:
+        return
+    for overlay in (True, False):
+        result_cache.evict(ResultCache.key(
+            job["image"], DETECT_CONFIDENCE, overlay, job["settings"]))
+
+
+def runRecognitionJob(job: dict) -> None:
+    """
+    #### Runs one queued recognition job on a worker of `recognition_workers`.
+
+    Arguments:
+    - job (dict): The job returned by `JobQueue.claim()`, with the keys 'documentID', 'image', 'boxes', 'settings', 'trace' and 'priority'.
+
+    Raises:
+    - FileReadError: If the stored image can no longer be decoded.
+    - DetectionCropError: If the stored boxes cannot be cropped from the image.
+    - RecognitionRecognizeError, FirebaseUpdateDocumentError: If recognition or the Firestore update failed.
+
+    Notes:
+    - The crops are rebuilt from the stored upload and boxes instead of being kept in memory, so the same code path serves new jobs and jobs resumed after a restart.
+    - The job runs in a tracing span linked to the span of the request that queued it, even when the job resumes after a restart.
     """
-    text_list = []
-    for image in crop_dict[Config.CROP_IMG.value]:
-        recognized_text = recognition_model.recognize(image)
-        text_list.append(recognized_text)
-        fb.updateDocument(documentId, text_list, conf_list,
-                          crop_dict[Config.CROP_XYXY.value])
+    with tracing.span("recognition_job", link=job.get("trace"), documentID=job["documentID"]):
+        result_broker.open(job["documentID"], job["boxes"])
+        try:
+            input_image = decode(job["image"])
+        except FileReadError as e:
+            count_error(e, "job")
+            result_broker.close(job["documentID"], e.message)
+            raise
+        try:
+            crop_list = crop_boxes(np.asarray(input_image), np.asarray(
+                job["boxes"], dtype=np.float32).reshape(-1, 4))
+        except:
+            count_error(DetectionCropError(), "job")
+            result_broker.close(
+                job["documentID"], DetectionCropError().message)
+            raise DetectionCropError()
+        settings = recognition_model.generation.replace(**job["settings"])
+        runRecognizerInBackground(
+            job["documentID"], crop_list, settings, job["priority"])
+
@@ -1,4 +1,4 @@
-from typing import List
+from typing import List, Dict
 from pydantic import BaseModel
 
 
@@ -11,3 +11,54 @@ class ResponseModel(BaseModel):
     boxes: List[str] = []
     confidences: List[str] = []
     error: str = None
+
+
+class JobStatusModel(BaseModel):
+    """
+    #### Response model for the job status endpoint
+    """
+    documentID: str = None
+    status: str = None
+    created: float = None
+    updated: float = None
+    error: str = None
+
+
+class LineModel(BaseModel):
+    """
+    #### A recognized line of the extract endpoint
+    """
+    index: int = None
+    text: str = None
+    score: float = None
+    box: List[float] = []
+    confidence: float = None
+    pending: bool = False
+
+
+class ExtractResponseModel(BaseModel):
+    """
+    #### Response model for the extract endpoint
+    """
+    documentID: str = None
+    imageURL: str = None
+    lines: List[LineModel] = []
+    pending: int = 0
+    timings: Dict[str, float] = {}
+    error: str = None
+
+
+class BatchItemModel(ExtractResponseModel):
+    """
+    #### Result of one image of the batch endpoint
+    """
+    fileName: str = None
+
+
+class BatchResponseModel(BaseModel):
+    """
+    #### Response model for the batch endpoint
+    """
+    results: List[BatchItemModel] = []
+    timings: Dict[str, float] = {}
+    error: str = None
@@ -0,0 +1,77 @@
+import json
+import pytest
+from ACCESS.apiKeys import ApiKey, ApiKeyRegistry, TokenBucket, BULK, INTERACTIVE
+from error import RateLimitError, QuotaExceededError
+
+
+def test_token_bucket_refills_at_its_rate():
+    bucket = TokenBucket(rate=2, burst=3)
+
+    assert bucket.take(3) == 0
+    assert bucket.take(1) == pytest.approx(0.5, abs=0.01)
+    bucket.updated -= 1.0
+    assert bucket.take(2) == 0
+    bucket.refund(10)
+    assert bucket.tokens == 3
+
+
+def test_token_bucket_lets_a_large_batch_run_into_debt():
+    bucket = TokenBucket(rate=1, burst=2)
+
+    assert bucket.take(5) == 0
+    assert bucket.tokens == -3
+    assert bucket.take(1) == pytest.approx(4, abs=0.01)
+
+
+def test_parse_keeps_the_legacy_key():
+    keys = ApiKeyRegistry.parse(json.dumps([
+        {"name": "backfill", "key": "b", "priority": "bulk", "rate": 2, "daily_quota": 10}]), "legacy")
+
+    assert [(key.name, key.priority) for key in keys] == [("backfill", BULK), ("default", INTERACTIVE)]
+    assert keys[0].bucket.rate == 2 and keys[0].daily_quota == 10
+    assert keys[1].bucket is None
+    with pytest.raises(ValueError):
+        ApiKeyRegistry.parse(json.dumps([{"name": "x", "key": "x", "priority": "urgent"}]))
+
+
+def test_authenticate():
+    registry = ApiKeyRegistry([ApiKey("counter", "secret")])
+
+    assert registry.authenticate("secret").name == "counter"
+    assert registry.authenticate("other") is None
+    assert registry.authenticate("") is None
+
+
+def test_charge_enforces_the_rate_limit_without_consuming_rejected_requests():
+    registry = ApiKeyRegistry([ApiKey("counter", "secret", RATE=1, BURST=2)])
+    key = registry.authenticate("secret")
+
+    registry.charge(key, 2)
+    with pytest.raises(RateLimitError) as error:
+        registry.charge(key)
+    assert error.value.retry_after >= 1
+    usage = registry.usage()["counter"]
+    assert (usage["requests"], usage["images"], usage["rate_limited"]) == (2, 2, 1)
+
+
+def test_charge_enforces_the_daily_quota():
+    registry = ApiKeyRegistry([ApiKey("backfill", "secret", "bulk", DAILY_QUOTA=3)])
+    key = registry.authenticate("secret")
+
+    registry.charge(key, 2)
+    with pytest.raises(QuotaExceededError):
+        registry.charge(key, 2)
+    registry.charge(key, 1)
+    usage = registry.usage()["backfill"]
+    assert (usage["used_today"], usage["remaining_today"], usage["quota_exceeded"]) == (3, 0, 1)
+
+
+def test_refund_gives_back_tokens_and_quota():
+    registry = ApiKeyRegistry([ApiKey("counter", "secret", RATE=1, BURST=2, DAILY_QUOTA=2)])
+    key = registry.authenticate("secret")
+
+    registry.charge(key, 2)
+    registry.refund(key, 2)
+    registry.refund(key, 0)
+    registry.charge(key, 2)
+    assert registry.usage()["counter"]["used_today"] == 2
@@ -0,0 +1,33 @@
+import numpy as np
+import pytest
+
+pytest.importorskip("cv2")
+from PIL import Image
+from DETECTION.boxes import crop_boxes, scale_boxes
+
+IMAGE = np.arange(20 * 30 * 3, dtype=np.uint8).reshape(20, 30, 3)
+
+
+def test_boxes_are_rounded_outwards_and_clipped():
+    crops = crop_boxes(IMAGE, np.array([[2.5, 3.2, 10.1, 8.9], [-5, -5, 40, 40]], dtype=np.float32))
+
+    assert crops[0].shape == (6, 9, 3)
+    assert np.array_equal(crops[0], IMAGE[3:9, 2:11])
+    assert crops[1].shape == IMAGE.shape
+
+
+def test_crops_are_views_unless_converted():
+    crops = crop_boxes(IMAGE, np.array([[0, 0, 5, 5]], dtype=np.float32))
+    images = crop_boxes(IMAGE, np.array([[0, 0, 5, 5]], dtype=np.float32), as_pil=True)
+
+    assert np.shares_memory(crops[0], IMAGE)
+    assert isinstance(images[0], Image.Image) and images[0].size == (5, 5)
+    assert crop_boxes(IMAGE, np.zeros((0, 4), dtype=np.float32)) == []
+
+
+def test_scale_boxes_maps_to_the_source_resolution():
+    source = Image.new("RGB", (60, 40))
+    scaled = scale_boxes([[1, 2, 3, 4]], IMAGE, source)
+
+    assert scaled.dtype == np.float32
+    assert scaled.tolist() == [[2, 4, 6, 8]]
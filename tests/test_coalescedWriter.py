@@ -0,0 +1,51 @@
+import pytest
+
+pytest.importorskip("cv2")
+pytest.importorskip("firebase_admin")
+from FIREBASE.firebaseIO import CoalescedWriter
+
+
+class FakeFirebase:
+    """
+    #### Records the texts and scores of every document update.
+    """
+
+    def __init__(self) -> None:
+        self.writes = []
+
+    def updateDetections(self, documentId, detect_list, score_list) -> None:
+        self.writes.append((documentId, list(detect_list), list(score_list)))
+
+
+def test_texts_are_written_once_the_count_is_reached():
+    fb = FakeFirebase()
+    writer = CoalescedWriter(fb, "document", FLUSH_COUNT=3, FLUSH_INTERVAL=60)
+    writer.extend(["a", "b"], [0.1, 0.2])
+    assert fb.writes == []
+
+    writer.extend(["c"], [0.3])
+    writer.extend(["d"], [0.4])
+    writer.close()
+    writer.close()
+    assert fb.writes == [("document", ["a", "b", "c"], [0.1, 0.2, 0.3]),
+                         ("document", ["a", "b", "c", "d"], [0.1, 0.2, 0.3, 0.4])]
+
+
+def test_pending_texts_are_written_once_the_interval_passed():
+    fb = FakeFirebase()
+    writer = CoalescedWriter(fb, "document", FLUSH_COUNT=100, FLUSH_INTERVAL=60)
+    writer.extend(["a"], [0.1])
+    writer._last_flush -= 61
+    writer.extend(["b"], [0.2])
+
+    assert fb.writes == [("document", ["a", "b"], [0.1, 0.2])]
+
+
+def test_zero_count_writes_after_every_extend():
+    fb = FakeFirebase()
+    writer = CoalescedWriter(fb, "document", FLUSH_COUNT=0, FLUSH_INTERVAL=60)
+    writer.extend(["a"], [0.1])
+    writer.extend(["b"], [0.2])
+    writer.close()
+
+    assert len(fb.writes) == 2
@@ -0,0 +1,67 @@
+import numpy as np
+import pytest
+from PIL import Image, ImageDraw, ImageFont
+from RECOGNITION.cropCache import CropCache
+
+TEMPLATES = ["Warfarin {}mg daily", "Paracetamol {}mg", "Tab Metformin {}mg",
+             "Insulin {} units", "Amoxicillin {}mg 1-0-1", "Tab {} x 5 days"]
+DOSES = ["1", "2", "3", "4", "5", "6", "7", "8", "10", "20", "40", "250", "500", "650", "850"]
+
+
+def line(text: str, size=28) -> Image.Image:
+    font = ImageFont.load_default(size=size)
+    _, _, right, bottom = font.getbbox(text)
+    image = Image.new("RGB", (right + 24, bottom + 16), (245, 245, 240))
+    ImageDraw.Draw(image).text((12, 8), text, fill=(20, 20, 60), font=font)
+    return image
+
+
+@pytest.mark.parametrize("size", [20, 28, 36])
+def test_crops_differing_in_one_dosage_do_not_collide(size):
+    cache = CropCache()
+    for template in TEMPLATES:
+        keys = {cache.key(line(template.format(dose), size)) for dose in DOSES}
+        assert len(keys) == len(DOSES), template
+
+
+def test_a_stored_dosage_never_answers_another():
+    cache = CropCache()
+    for stored, looked_up in [("Warfarin 1mg daily", "Warfarin 5mg daily"),
+                              ("Paracetamol 500mg", "Paracetamol 650mg"),
+                              ("Tab Metformin 500mg", "Tab Metformin 850mg"),
+                              ("Insulin 10 units", "Insulin 40 units"),
+                              ("Amoxicillin 250mg 1-0-1", "Amoxicillin 500mg 1-0-1")]:
+        cache.put(cache.key(line(stored)), (stored, 0.9))
+        assert cache.get(cache.key(line(looked_up))) is None
+        assert cache.get(cache.key(line(stored))) == (stored, 0.9)
+
+
+def test_the_same_crop_hits_regardless_of_input_type():
+    cache = CropCache()
+    image = line("Tab Cetirizine 10mg")
+    cache.put(cache.key(image), ("Tab Cetirizine 10mg", 0.8))
+
+    assert cache.get(cache.key(np.asarray(image))) == ("Tab Cetirizine 10mg", 0.8)
+    assert cache.stats()["hits"] == 1
+
+
+def test_results_are_kept_apart_by_scope():
+    cache = CropCache()
+    key = cache.key(line("x 3 days"))
+    cache.put(key, ("x 3 days", 0.9), scope="greedy")
+
+    assert cache.get(key, scope="beams") is None
+    assert cache.get(key, scope="greedy") == ("x 3 days", 0.9)
+
+
+def test_least_recently_used_crop_is_evicted():
+    cache = CropCache(MAX_ENTRIES=2)
+    keys = [cache.key(line("Tab {}".format(index))) for index in range(3)]
+    cache.put(keys[0], "0")
+    cache.put(keys[1], "1")
+    cache.get(keys[0])
+    cache.put(keys[2], "2")
+
+    assert cache.get(keys[1]) is None
+    assert cache.get(keys[0]) == "0" and cache.get(keys[2]) == "2"
+    assert cache.stats()["entries"] == 2
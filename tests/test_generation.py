@@ -0,0 +1,17 @@
+from RECOGNITION.generation import GenerationSettings
+
+
+def test_replace_ignores_missing_overrides():
+    settings = GenerationSettings(NUM_BEAMS=2, MAX_NEW_TOKENS=40)
+
+    assert settings.replace(NUM_BEAMS=None, MAX_NEW_TOKENS=None).key() == settings.key()
+    assert settings.replace(EARLY_EXIT_SCORE=0.9).EARLY_EXIT_SCORE == 0.9
+
+
+def test_replace_clamps_overrides_to_the_deployment_limits():
+    settings = GenerationSettings(NUM_BEAMS=1, MAX_NEW_TOKENS=48, RESCORE_BEAMS=4)
+    replaced = settings.replace(NUM_BEAMS=64, MAX_NEW_TOKENS=100000, RESCORE_BEAMS=64)
+
+    assert (replaced.NUM_BEAMS, replaced.MAX_NEW_TOKENS, replaced.RESCORE_BEAMS) == (4, 48, 4)
+    lowered = settings.replace(NUM_BEAMS=2, MAX_NEW_TOKENS=16)
+    assert (lowered.NUM_BEAMS, lowered.MAX_NEW_TOKENS) == (2, 16)
@@ -0,0 +1,120 @@
+import threading
+import pytest
+from JOBS.jobQueue import JobQueue, JobWorkerPool
+from error import JobQueueFullError, RecognitionRecognizeError
+
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / "jobs.sqlite3")
+
+
+def test_claim_order_is_priority_then_age(path):
+    jobs = JobQueue(path)
+    jobs.enqueue("bulk", b"1", [[0, 0, 1, 1]], PRIORITY=1)
+    jobs.enqueue("first", b"2", [[0, 0, 2, 2]])
+    jobs.enqueue("second", b"3", [], {"NUM_BEAMS": 2}, {"traceparent": "x"})
+
+    claimed = [jobs.claim() for _ in range(4)]
+
+    assert [job["documentID"] for job in claimed[:3]] == ["first", "second", "bulk"]
+    assert claimed[0]["image"] == b"2" and claimed[0]["boxes"] == [[0, 0, 2, 2]]
+    assert claimed[1]["settings"] == {"NUM_BEAMS": 2}
+    assert claimed[1]["trace"] == {"traceparent": "x"}
+    assert claimed[2]["priority"] == 1
+    assert claimed[3] is None
+
+
+def test_bulk_jobs_leave_room_for_interactive_ones(path):
+    jobs = JobQueue(path, MAX_PENDING=4, BULK_SHARE=0.5)
+    jobs.enqueue("bulk-1", b"", [], PRIORITY=1)
+    jobs.enqueue("bulk-2", b"", [], PRIORITY=1)
+
+    with pytest.raises(JobQueueFullError):
+        jobs.checkCapacity(1)
+    with pytest.raises(JobQueueFullError):
+        jobs.enqueue("bulk-3", b"", [], PRIORITY=1)
+    jobs.checkCapacity(0)
+    jobs.enqueue("interactive-1", b"", [])
+    jobs.enqueue("interactive-2", b"", [])
+    with pytest.raises(JobQueueFullError):
+        jobs.enqueue("interactive-3", b"", [])
+    assert jobs.pendingCount() == 4
+
+
+def test_jobs_of_a_live_process_stay_with_it(path):
+    first = JobQueue(path)
+    second = JobQueue(path)
+    first.enqueue("document", b"", [])
+
+    assert second.claim() is None
+    assert first.claim()["documentID"] == "document"
+    assert second.requeueExpired() == 0
+    assert first.renewLeases() == 1
+    assert first.status("document")["status"] == JobQueue.RUNNING
+
+
+def test_expired_leases_are_requeued_and_taken_over(path):
+    first = JobQueue(path)
+    second = JobQueue(path)
+    first.enqueue("document", b"image", [])
+    first.claim()
+    first.connection.execute("UPDATE jobs SET lease = 0")
+
+    assert second.requeueExpired() == 1
+    assert second.claim()["image"] == b"image"
+    first.complete("document")
+    assert second.status("document")["status"] == JobQueue.RUNNING
+    second.complete("document")
+    assert second.status("document")["status"] == JobQueue.DONE
+
+
+def test_failed_jobs_keep_their_error(path):
+    jobs = JobQueue(path)
+    jobs.enqueue("document", b"", [])
+    jobs.claim()
+    jobs.fail("document", "RECOGNITION ERROR")
+
+    status = jobs.status("document")
+    assert status["status"] == JobQueue.FAILED
+    assert status["error"] == "RECOGNITION ERROR"
+    assert jobs.pendingCount() == 0
+
+
+def test_prune_deletes_only_old_finished_jobs(path):
+    jobs = JobQueue(path, RETENTION=60)
+    for documentId in ("old", "recent", "queued"):
+        jobs.enqueue(documentId, b"", [])
+    jobs.claim()
+    jobs.complete("old")
+    jobs.claim()
+    jobs.complete("recent")
+    jobs.connection.execute(
+        "UPDATE jobs SET updated = 0 WHERE document_id IN ('old', 'queued')")
+
+    assert jobs.prune() == 1
+    assert jobs.status("old") is None
+    assert jobs.status("recent")["status"] == JobQueue.DONE
+    assert jobs.status("queued")["status"] == JobQueue.QUEUED
+    assert JobQueue(path, RETENTION=0).prune() == 0
+
+
+def test_worker_pool_reports_failed_jobs(path):
+    jobs = JobQueue(path)
+    failures = []
+    done = threading.Event()
+
+    def handler(job):
+        raise RecognitionRecognizeError()
+
+    def on_failure(job, error):
+        failures.append((job["documentID"], error.message))
+        done.set()
+
+    pool = JobWorkerPool(jobs, handler, workers=1, poll_interval=0.01, on_failure=on_failure)
+    jobs.enqueue("document", b"", [])
+    pool.notify()
+
+    assert done.wait(5)
+    assert failures == [("document", "RECOGNITION MODEL RECOGNIZE ERROR")]
+    assert jobs.status("document")["status"] == JobQueue.FAILED
@@ -0,0 +1,45 @@
+import numpy as np
+from DETECTION.layout import LineLayout
+
+
+def test_boxes_are_merged_into_lines_in_reading_order():
+    xyxy = [[300, 110, 500, 140], [10, 100, 200, 140], [10, 200, 400, 240],
+            [205, 102, 290, 138], [12, 101, 198, 139], [50, 300, 52, 302], [500, 205, 700, 245]]
+    conf = np.arange(7) * 10
+
+    boxes, scores = LineLayout().arrange(xyxy, conf)
+
+    assert boxes.dtype == np.float32 and scores.dtype == np.float32
+    np.testing.assert_array_equal(
+        boxes, [[10, 100, 500, 140], [10, 200, 400, 240], [500, 205, 700, 245]])
+    np.testing.assert_array_equal(scores, [40, 20, 60])
+
+
+def test_fragments_further_apart_than_the_merge_gap_stay_separate():
+    xyxy = [[400, 0, 500, 20], [0, 0, 100, 20], [120, 2, 200, 22]]
+
+    boxes, scores = LineLayout(MERGE_GAP=1.0).arrange(xyxy, [1, 2, 3])
+    np.testing.assert_array_equal(boxes, [[0, 0, 200, 22], [400, 0, 500, 20]])
+    np.testing.assert_array_equal(scores, [3, 1])
+
+    boxes, _ = LineLayout(MERGE_GAP=0).arrange(xyxy, [1, 2, 3])
+    np.testing.assert_array_equal(
+        boxes, [[0, 0, 100, 20], [120, 2, 200, 22], [400, 0, 500, 20]])
+
+
+def test_small_and_low_boxes_are_dropped():
+    xyxy = [[0, 0, 100, 30], [0, 50, 100, 80], [0, 100, 3, 130], [0, 150, 100, 155]]
+
+    boxes, scores = LineLayout(MIN_SIDE=4, MIN_HEIGHT_RATIO=0.3).arrange(xyxy, [1, 2, 3, 4])
+    np.testing.assert_array_equal(boxes, [[0, 0, 100, 30], [0, 50, 100, 80]])
+    np.testing.assert_array_equal(scores, [1, 2])
+
+    boxes, _ = LineLayout(MIN_SIDE=0, MIN_HEIGHT_RATIO=0).arrange(xyxy, [1, 2, 3, 4])
+    assert len(boxes) == 4
+
+
+def test_no_boxes():
+    boxes, scores = LineLayout().arrange(np.zeros((0, 4)), np.zeros(0))
+
+    assert boxes.shape == (0, 4)
+    assert scores.shape == (0,)
@@ -0,0 +1,52 @@
+import pytest
+from io import BytesIO
+from PIL import Image
+from PREPROCESS.preprocess import check_upload, decode, prepare
+from error import FileReadError, UploadTooLargeError
+
+
+def encode(size, format="JPEG") -> bytes:
+    buffer = BytesIO()
+    Image.new("RGB", size, (200, 120, 40)).save(buffer, format)
+    return buffer.getvalue()
+
+
+def test_check_upload_rejects_large_and_unreadable_uploads():
+    file = encode((400, 300))
+
+    assert check_upload(file).size == (400, 300)
+    with pytest.raises(UploadTooLargeError):
+        check_upload(file, max_bytes=len(file) - 1)
+    with pytest.raises(UploadTooLargeError):
+        check_upload(file, max_pixels=400 * 300 - 1)
+    with pytest.raises(FileReadError):
+        check_upload(b"not an image")
+    with pytest.raises(FileReadError):
+        decode(file[:len(file) // 2])
+
+
+def test_jpeg_is_decoded_small_for_detection_and_full_size_on_demand():
+    prepared = prepare(encode((2000, 1500)), max_side=500)
+
+    assert max(prepared.detection.size) == 500
+    assert (prepared.width, prepared.height) == (2000, 1500)
+    assert prepared._full is None
+    assert prepared.scale == pytest.approx((4.0, 4.0), rel=0.01)
+    assert prepared.full().size == (2000, 1500)
+    assert prepared.full() is prepared.full()
+
+
+def test_other_formats_keep_their_full_decode():
+    prepared = prepare(encode((800, 200), "PNG"), max_side=400)
+
+    assert prepared.detection.size == (400, 100)
+    assert prepared.full().size == (800, 200)
+    assert prepared.scale == (2.0, 2.0)
+
+
+def test_small_uploads_are_detected_at_full_resolution():
+    prepared = prepare(encode((300, 200)), max_side=1000)
+
+    assert prepared.detection.size == (300, 200)
+    assert prepared.full() is prepared.detection
+    assert prepared.scale == (1.0, 1.0)
@@ -0,0 +1,73 @@
+import asyncio
+import threading
+from STREAM.resultBroker import ResultBroker
+
+BOXES = [[0, 0, 10, 10], [0, 20, 10, 30]]
+
+
+def test_late_subscribers_receive_every_event():
+    broker = ResultBroker()
+    broker.open("document", BOXES, [0.9, 0.8])
+    broker.publishLines("document", [(1, "Tab 5mg", 0.7)])
+    broker.close("document")
+
+    async def read():
+        events = broker.subscribe("document")
+        return [events.get_nowait() for _ in range(events.qsize())]
+
+    line, done = asyncio.run(read())
+    assert line == {"event": ResultBroker.LINE, "index": 1, "text": "Tab 5mg",
+                    "score": 0.7, "box": BOXES[1], "confidence": 0.8}
+    assert done == {"event": ResultBroker.DONE}
+
+
+def test_events_published_from_other_threads_reach_the_subscriber():
+    broker = ResultBroker()
+    broker.open("document", BOXES)
+
+    async def read():
+        events = broker.subscribe("document")
+        thread = threading.Thread(target=lambda: (
+            broker.publishLines("document", [(0, "a", 0.5)]), broker.close("document", "FAILED")))
+        thread.start()
+        received = [await asyncio.wait_for(events.get(), 5) for _ in range(2)]
+        thread.join()
+        broker.unsubscribe("document", events)
+        return received
+
+    line, error = asyncio.run(read())
+    assert (line["index"], line["confidence"]) == (0, None)
+    assert error == {"event": ResultBroker.ERROR, "error": "FAILED"}
+
+
+def test_unknown_documents_are_ignored():
+    broker = ResultBroker()
+    broker.publishLines("unknown", [(0, "a", 0.5)])
+    broker.close("unknown")
+
+    async def subscribe():
+        return broker.subscribe("unknown")
+
+    assert not broker.isOpen("unknown")
+    assert asyncio.run(subscribe()) is None
+
+
+def test_close_is_final_and_documents_expire_after_retention():
+    broker = ResultBroker(RETENTION=60)
+    broker.open("document", BOXES)
+    broker.close("document", "FAILED")
+    broker.close("document")
+
+    assert broker._documents["document"]["events"] == [{"event": ResultBroker.ERROR, "error": "FAILED"}]
+    broker._documents["document"]["finished"] -= 61
+    assert not broker.isOpen("document")
+
+
+def test_unfinished_documents_time_out():
+    broker = ResultBroker(RETENTION=60, TIMEOUT=10)
+    broker.open("document", BOXES)
+    broker._documents["document"]["opened"] -= 11
+
+    assert broker.isOpen("document")
+    assert broker._documents["document"]["events"] == [
+        {"event": ResultBroker.ERROR, "error": "STREAM TIMED OUT"}]
@@ -0,0 +1,85 @@
+import os
+import time
+from CACHE.resultCache import ResultCache
+
+SETTINGS = {"NUM_BEAMS": None, "MAX_NEW_TOKENS": None, "EARLY_EXIT_SCORE": None}
+
+
+def test_key_depends_on_the_upload_threshold_overlay_and_overrides():
+    key = ResultCache.key(b"image", 0.5)
+
+    assert ResultCache.key(b"image", 0.5, True, SETTINGS) == key
+    assert ResultCache.key(b"other", 0.5) != key
+    assert ResultCache.key(b"image", 0.6) != key
+    assert ResultCache.key(b"image", 0.5, False) != key
+    assert ResultCache.key(b"image", 0.5, True, dict(SETTINGS, NUM_BEAMS=4)) != key
+    assert ResultCache.key(b"image", 0.5, True, dict(SETTINGS, NUM_BEAMS=4)) != \
+        ResultCache.key(b"image", 0.5, True, dict(SETTINGS, MAX_NEW_TOKENS=4))
+
+
+def test_memory_tier_expires_and_evicts_least_recently_used():
+    cache = ResultCache(MAX_ENTRIES=2, TTL=60)
+    cache.put("a", {"documentID": "a"})
+    cache.put("b", {"documentID": "b"})
+    cache.get("a")
+    cache.put("c", {"documentID": "c"})
+
+    assert cache.get("b") is None
+    assert cache.get("a") == {"documentID": "a"}
+    cache.ttl = -1
+    cache.put("d", {"documentID": "d"})
+    assert cache.get("d") is None
+
+
+def test_disk_tier_survives_a_restart(tmp_path):
+    ResultCache(TTL=60, DIRECTORY=str(tmp_path)).put("key", {"documentID": "x"})
+    cache = ResultCache(TTL=60, DIRECTORY=str(tmp_path))
+
+    assert cache.get("key") == {"documentID": "x"}
+    assert cache.stats()["disk_hits"] == 1
+    assert cache.get("key") == {"documentID": "x"}
+    assert cache.stats()["memory_hits"] == 1
+
+
+def test_evict_removes_both_tiers(tmp_path):
+    cache = ResultCache(TTL=60, DIRECTORY=str(tmp_path))
+    cache.put("key", {"documentID": "x"})
+    cache.evict("key")
+    cache.evict("unknown")
+
+    assert cache.get("key") is None
+    assert ResultCache(TTL=60, DIRECTORY=str(tmp_path)).get("key") is None
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_expired_files_are_pruned(tmp_path):
+    cache = ResultCache(TTL=60, DIRECTORY=str(tmp_path))
+    cache.put("old", {"documentID": "old"})
+    cache.put("new", {"documentID": "new"})
+    stale = time.time() - 120
+    for name in ("old.json", "leftover.json.1.tmp"):
+        (tmp_path / name).touch()
+        os.utime(tmp_path / name, (stale, stale))
+
+    assert cache.prune() == 2
+    assert sorted(path.name for path in tmp_path.iterdir()) == ["new.json"]
+
+
+def test_put_prunes_at_most_every_interval(tmp_path):
+    cache = ResultCache(TTL=60, DIRECTORY=str(tmp_path))
+    (tmp_path / "old.json").touch()
+    os.utime(tmp_path / "old.json", (0, 0))
+    cache.put("a", {})
+    assert (tmp_path / "old.json").exists()
+
+    cache._pruned -= ResultCache.PRUNE_INTERVAL
+    cache.put("b", {})
+    assert not (tmp_path / "old.json").exists()
+
+
+def test_creating_the_cache_prunes_leftovers_of_earlier_runs(tmp_path):
+    (tmp_path / "old.json").touch()
+    os.utime(tmp_path / "old.json", (0, 0))
+    ResultCache(TTL=60, DIRECTORY=str(tmp_path))
+
+    assert list(tmp_path.iterdir()) == []
@@ -0,0 +1,107 @@
+import threading
+import pytest
+from RECOGNITION.scheduler import RECOGNITION_SCHEDULER
+from error import RecognitionRecognizeError
+
+
+class FakeRecognizer:
+    """
+    #### Records the crops of every call and answers with their upper-cased text. Sets `entered` and then blocks until `gate` is set. Raises `error` for calls holding the `poison` crop, or for every call if `poison` is None.
+    """
+
+    def __init__(self, error=None, poison=None) -> None:
+        self.calls = []
+        self.entered = threading.Event()
+        self.gate = threading.Event()
+        self.error = error
+        self.poison = poison
+
+    def recognize_batch_scored(self, images, batch_size=8, settings=None) -> tuple:
+        self.entered.set()
+        self.gate.wait(5)
+        self.calls.append(list(images))
+        if self.error is not None and (self.poison is None or self.poison in images):
+            raise self.error
+        return ([image.upper() for image in images], [0.5] * len(images))
+
+
+@pytest.fixture
+def recognizer():
+    return FakeRecognizer()
+
+
+def test_results_are_returned_in_input_order(recognizer):
+    scheduler = RECOGNITION_SCHEDULER(recognizer, max_batch_size=2, max_wait_ms=0)
+    recognizer.gate.set()
+    job = scheduler.submit(["a", "b", "c"])
+
+    assert job.result(5) == ["A", "B", "C"]
+    assert job.scores == [0.5, 0.5, 0.5]
+    scheduler.shutdown()
+
+
+def test_interactive_crops_overtake_queued_bulk_crops(recognizer):
+    scheduler = RECOGNITION_SCHEDULER(recognizer, max_batch_size=1, max_wait_ms=0)
+    blocker = scheduler.submit(["blocker"])
+    assert recognizer.entered.wait(5)
+    bulk = scheduler.submit(["bulk-1", "bulk-2"], priority=1)
+    interactive = scheduler.submit(["interactive"], priority=0)
+    recognizer.gate.set()
+
+    for job in (blocker, bulk, interactive):
+        job.result(5)
+    scheduler.shutdown()
+    assert [call[0] for call in recognizer.calls] == [
+        "blocker", "interactive", "bulk-1", "bulk-2"]
+
+
+def test_empty_job_is_done_at_once(recognizer):
+    scheduler = RECOGNITION_SCHEDULER(recognizer)
+    job = scheduler.submit([])
+
+    assert job.wait(0)
+    assert job.result(0) == []
+    assert list(job) == []
+    scheduler.shutdown()
+
+
+def test_failed_batch_fails_only_the_jobs_that_fail_on_their_own():
+    recognizer = FakeRecognizer(ValueError("model error"), poison="bad")
+    scheduler = RECOGNITION_SCHEDULER(recognizer, max_batch_size=8, max_wait_ms=50)
+    first = scheduler.submit(["a"])
+    second = scheduler.submit(["bad", "c"])
+    third = scheduler.submit(["d"])
+    recognizer.gate.set()
+
+    assert first.wait(5) and second.wait(5) and third.wait(5)
+    assert first.result(0) == ["A"] and third.result(0) == ["D"]
+    assert isinstance(second.error, RecognitionRecognizeError)
+    with pytest.raises(RecognitionRecognizeError):
+        second.result(0)
+    with pytest.raises(RecognitionRecognizeError):
+        list(second)
+    assert recognizer.calls == [["a", "bad", "c", "d"], ["a"], ["bad", "c"], ["d"]]
+    assert scheduler.stats()["errors"] == 2
+    scheduler.shutdown()
+
+
+def test_failed_batch_of_one_job_is_not_retried():
+    recognizer = FakeRecognizer(ValueError("model error"))
+    scheduler = RECOGNITION_SCHEDULER(recognizer, max_batch_size=8, max_wait_ms=50)
+    job = scheduler.submit(["a", "b"])
+    recognizer.gate.set()
+
+    assert job.wait(5)
+    assert isinstance(job.error, RecognitionRecognizeError)
+    assert recognizer.calls == [["a", "b"]]
+    scheduler.shutdown()
+
+
+def test_iteration_yields_lines_as_batches_complete(recognizer):
+    scheduler = RECOGNITION_SCHEDULER(recognizer, max_batch_size=2, max_wait_ms=0)
+    recognizer.gate.set()
+    job = scheduler.submit(["a", "b", "c"])
+
+    lines = [line for chunk in job for line in chunk]
+    assert lines == [(0, "A", 0.5), (1, "B", 0.5), (2, "C", 0.5)]
+    scheduler.shutdown()